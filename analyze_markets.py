@@ -1,89 +1,69 @@
 import json
-from collections import defaultdict
+import os
+import sys
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
 
-def analyze_market_data(data):
+# Rollups are computed server-side at import (backend/rollups.py)
+API_URL = os.getenv('API_URL', 'http://localhost:5000').rstrip('/')
+TOP_CITIES = int(os.getenv('TOP_CITIES', 50))
+
+def fetch_rollups(level, **params):
+    """GET /api/markets/rollups/<level> and return its rollups"""
+    url = f"{API_URL}/api/markets/rollups/{level}?{urlencode(params)}"
+    with urlopen(url, timeout=30) as response:
+        payload = json.load(response)
+    if not payload.get('success'):
+        raise RuntimeError(payload.get('error', f"request to {url} failed"))
+    return payload
+
+def analyze_market_data(states, cities):
     try:
-        print("Starting analysis...")
-        print(f"Data type: {type(data)}")
-        print(f"Data length: {len(data)}")
-        
-        # Initialize counters
-        state_counts = defaultdict(int)
-        city_counts = defaultdict(int)
-        total_markets = 0
-        
-        # Process each entry
-        for entry in data:
-            if not isinstance(entry, dict) or '_id' not in entry or 'count' not in entry:
-                print(f"Warning: Invalid entry format: {entry}")
-                continue
-                
-            location = entry['_id']
-            count = entry['count']
-            
-            # Count states (2 letters) and cities (longer names)
-            if len(location) == 2:
-                state_counts[location] += count
-            else:
-                city_counts[location] += count
-                
-            total_markets += count
-        
-        # Sort states by count
-        sorted_states = sorted(state_counts.items(), key=lambda x: x[1], reverse=True)
-        
+        total_markets = sum(rollup['count'] for rollup in states['rollups'])
+
         # Print results
-        print(f"\nTotal number of unique locations: {len(data)}")
+        print(f"\nTotal number of states: {states['total']}")
+        print(f"Total number of cities: {cities['total']}")
         print(f"Total number of markets: {total_markets}")
-        
-        if sorted_states:
+
+        if states['rollups']:
             print("\nStates with farmers markets:")
-            for state, count in sorted_states:
-                print(f"{state}: {count} markets")
+            for rollup in states['rollups']:
+                print(f"{rollup['state']}: {rollup['count']} markets")
         else:
             print("\nNo state data found in the dataset.")
-            
-        if city_counts:
-            print("\nCities with farmers markets:")
-            sorted_cities = sorted(city_counts.items(), key=lambda x: x[1], reverse=True)
-            for city, count in sorted_cities:
-                print(f"{city}: {count} markets")
+
+        if cities['rollups']:
+            print(f"\nTop {len(cities['rollups'])} cities with farmers markets:")
+            for rollup in cities['rollups']:
+                print(f"{rollup['city']}, {rollup['state']}: {rollup['count']} markets")
         else:
             print("\nNo city data found in the dataset.")
-            
+
     except Exception as e:
         print(f"Error analyzing market data: {str(e)}")
         return False
-    
+
     return True
 
 def main():
     try:
-        print("Starting main function...")
-        # Read the data from the JSON file
-        with open('market_data.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            print("Successfully loaded JSON file")
-        
-        if not data:
-            print("Error: No data found in market_data.json")
-            return False
-            
-        # Analyze the data
-        return analyze_market_data(data)
-        
-    except FileNotFoundError:
-        print("Error: market_data.json file not found")
-        return False
-    except json.JSONDecodeError:
-        print("Error: Invalid JSON format in market_data.json")
+        print(f"Fetching rollups from {API_URL}...")
+        # Every state fits in one page (the API caps limit at 1000)
+        states = fetch_rollups('state', sort='count', limit=1000)
+        cities = fetch_rollups('city', sort='count', limit=TOP_CITIES)
+        return analyze_market_data(states, cities)
+
+    except URLError as e:
+        print(f"Error: could not reach the API at {API_URL}: {e.reason}")
         return False
     except Exception as e:
         print(f"Unexpected error: {str(e)}")
         return False
 
 if __name__ == "__main__":
-    print("Script started...")
     success = main()
     if not success:
-        print("\nFailed to load markets. Please try again later.") 
\ No newline at end of file
+        print("\nFailed to load markets. Please try again later.")
+        sys.exit(1)
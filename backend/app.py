@@ -9,7 +9,34 @@ from werkzeug.utils import secure_filename
 import json
 import math
 import sys
-import re
+import threading
+
+# Make sibling modules importable however the app is loaded
+# (wsgi_app imports backend.app, wsgi.py and Render import app directly)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from market_fields import extract_state, derive_image_fields
+from market_schema import LIST_PROJECTION, LIST_FIELDS
+from market_cache import bump_dataset_version
+from autocomplete import autocomplete_cache, MAX_SUGGESTIONS
+from fuzzy_search import fuzzy_cache, DEFAULT_MIN_SCORE
+from metrics import init_metrics, mongo_listeners
+from slow_queries import slow_query_log
+from profiling import init_profiling
+from read_routing import api_read_options, describe as describe_reads
+from deadlines import init_deadlines, client_timeouts
+from single_flight import single_flight
+from resilience import init_resilience, resilient_read, UNAVAILABLE_ERRORS
+from rate_limit import init_rate_limits
+from snapshot import snapshot_store
+from nearby import NEARBY_K, nearby_markets
+from attribute_index import attribute_cache
+from rollups import parse_rollup_query, rebuild_rollups, rollup_cache, top_rollups
+from zip_index import parse_zip, zip_cache
+from facets import document_facets, mask_of, mongo_facets, parse_facets, snapshot_facets
+from map_formats import MAP_FIELDS, MAP_PROJECTION, map_response, parse_format
+from viewport import (CLUSTER_MAX_ZOOM, CLUSTER_PROJECTION, VIEWPORT_MAX_MARKETS, cluster_query,
+                      market_filter, parse_bbox)
 
 # Load environment variables
 load_dotenv()
@@ -25,10 +52,22 @@ CORS(app, resources={r"/*": {
         "https://farmers-market-api.onrender.com"
     ],
     "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    "allow_headers": ["Content-Type", "Authorization"],
+    "allow_headers": ["Content-Type", "Authorization", "X-API-Key"],
     "supports_credentials": True
 }})
 
+# Per-route latency, Mongo command timing and GET /metrics
+init_metrics(app)
+
+# Admin-only cProfile, stack sampler and tracemalloc endpoints
+init_profiling(app)
+
+# Per-request time budget (maxTimeMS) for /api, 503 + Retry-After when it runs out
+init_deadlines(app)
+
+# Circuit breaker around MongoDB; stale responses or a fast 503 while it is down
+init_resilience(app)
+
 # Create API blueprint
 api = Blueprint('api', __name__, url_prefix='/api')
 
@@ -41,136 +80,63 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Largest page the list and filter endpoints return
+MAX_PER_PAGE = int(os.getenv('MAX_PER_PAGE', 500))
+
+def parse_pagination(page=None, per_page=None):
+    """Validated (page, per_page) from query string values; ValueError for anything out of range"""
+    try:
+        page = int(page) if page is not None else 1
+        per_page = int(per_page) if per_page is not None else 10
+    except ValueError:
+        raise ValueError("page and per_page must be integers")
+    if page < 1:
+        raise ValueError("page must be at least 1")
+    if not 1 <= per_page <= MAX_PER_PAGE:
+        raise ValueError(f"per_page must be between 1 and {MAX_PER_PAGE}")
+    return page, per_page
+
+_client = None
+_read_db = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Get the process-wide MongoClient (it owns the connection pool)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
+                _client = MongoClient(mongo_uri, event_listeners=mongo_listeners() + [slow_query_log],
+                                      **client_timeouts())
+                # Sampled explain plans for slow queries run on their own thread
+                slow_query_log.client_factory = get_client
+    return _client
+
 def get_db():
     """Get MongoDB connection and database"""
-    mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
-    client = MongoClient(mongo_uri)
-    db = client.farmers_market
-    
-    # Create indexes for better search performance
-    markets = db.markets
-    try:
-        # Create text index for search
-        markets.create_index([("Name", "text"), ("Address", "text")])
-        # Create index for state queries
-        markets.create_index("state")
-        # Create index for USDA listing ID
-        # Use a more specific name to avoid conflicts
-        markets.create_index("usda_listing_id", name="usda_listing_id_index")
-        # Create geospatial index
-        markets.create_index([("longitude", 1), ("latitude", 1)])
-    except Exception as e:
-        # Log the error but continue, as the application can still function
-        # with existing indexes
-        print(f"Warning: Error creating indexes: {str(e)}")
-    
-    return db
+    # Indexes are declared in indexes.py and applied by scripts/reconcile_indexes.py,
+    # not created here on every request
+    return get_client().farmers_market
+
+def get_read_db():
+    """Database handle for api blueprint reads (read preference/concern from read_routing.py)"""
+    # Writes, admin and debug endpoints stay on get_db(), which reads from the primary
+    global _read_db
+    if _read_db is None:
+        _read_db = get_client().get_database('farmers_market', **api_read_options())
+    return _read_db
+
+def get_snapshot():
+    """Columnar snapshot serving api reads, or None to read from MongoDB (see snapshot.py)"""
+    return snapshot_store.get() if snapshot_store is not None else None
+
+# Token-bucket rate limits per client and per-worker load shedding (429s)
+init_rate_limits(app, get_db)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def extract_state(address):
-    """Extract state from address string"""
-    # State abbreviations and full names mapping
-    state_mapping = {
-        'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas',
-        'CA': 'California', 'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware',
-        'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii', 'ID': 'Idaho',
-        'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa', 'KS': 'Kansas',
-        'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland',
-        'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi',
-        'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada',
-        'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York',
-        'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma',
-        'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
-        'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah',
-        'VT': 'Vermont', 'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia',
-        'WI': 'Wisconsin', 'WY': 'Wyoming', 'DC': 'District of Columbia',
-        'PR': 'Puerto Rico',
-        'VI': 'Virgin Islands'
-    }
-    
-    # Create reverse mapping (full name to abbreviation)
-    reverse_mapping = {v.lower(): k for k, v in state_mapping.items()}
-    
-    if not address:
-        return None
-    
-    # Convert address to string if it's not already
-    if not isinstance(address, str):
-        address = str(address)
-    
-    # Normalize the address
-    address = address.replace('.', '')  # Remove periods
-    address_clean = re.sub(r'\s+', ' ', address).strip()
-    
-    # *** SPECIAL CASES FIRST ***
-    # Handle Massachusetts special case (multiple spellings)
-    address_upper = address_clean.upper()
-    if ', MASSACHUSSETTS' in address_upper or ', MASSACHUSETTS' in address_upper:
-        return 'MA'
-    
-    # Handle Wisconsin special case
-    if re.search(r'\b(WI|WISC|WISCONSIN)\b', address_upper):
-        return 'WI'
-    
-    # Handle Puerto Rico special case
-    if 'PUERTO RICO' in address_upper:
-        return 'PR'
-    
-    # Handle Virgin Islands special case
-    if 'VIRGIN ISLANDS' in address_upper or ', VI' in address_upper:
-        return 'VI'
-    
-    # *** STANDARD PATTERN MATCHING ***
-    # Look for state abbreviation followed by zip code (most common format)
-    state_zip_match = re.search(r'[,\s]+([A-Z]{2})[,\s]*\d{5}', address_upper)
-    if state_zip_match:
-        state_abbr = state_zip_match.group(1)
-        if state_abbr in state_mapping:
-            return state_abbr
-    
-    # Look for state abbreviation at end of string or followed by comma
-    state_end_match = re.search(r'[,\s]+([A-Z]{2})(\s*$|,)', address_upper)
-    if state_end_match:
-        state_abbr = state_end_match.group(1)
-        if state_abbr in state_mapping:
-            return state_abbr
-    
-    # Look for full state names
-    for state_abbr, state_name in state_mapping.items():
-        if state_name.upper() in address_upper:
-            return state_abbr
-    
-    # Fallback for abbreviations
-    for state_abbr in state_mapping.keys():
-        if f', {state_abbr}' in address_upper or f' {state_abbr} ' in address_upper:
-            return state_abbr
-    
-    return None
-
-def extract_place_id(google_maps_link):
-    """Extract place_id and image URL from Google Maps link"""
-    if not google_maps_link:
-        return None, None
-        
-    # Try to extract place_id from the URL
-    place_id_match = re.search(r'place/([^/]+)', google_maps_link)
-    if place_id_match:
-        place_id = place_id_match.group(1)
-        # Generate a static image URL that doesn't require API key
-        image_url = f"https://maps.googleapis.com/maps/api/streetview?size=600x300&location=place_id:{place_id}&key={os.getenv('GOOGLE_MAPS_API_KEY', '')}"
-        return place_id, image_url
-    
-    # If no place_id found, try to get the CID
-    cid_match = re.search(r'cid=(\d+)', google_maps_link)
-    if cid_match:
-        cid = cid_match.group(1)
-        # Return a CID-based identifier and no image (fallback images don't work with CID)
-        return f"cid:{cid_match.group(1)}", None
-        
-    return None, None
-
 @app.route('/update-states', methods=['POST'])
 def update_states():
     """Temporary endpoint to update state fields"""
@@ -198,41 +164,28 @@ def update_states():
                     errors.append(f"Market at index {i} has no _id field")
                     continue
                 
-                # Check for both possible address field names
-                address = market.get('Address', market.get('Market_Address', ''))
-                if not address:
-                    errors.append(f"Market {market_id} has no Address or Market_Address field")
-                    continue
-                
-                if not isinstance(address, str):
-                    errors.append(f"Market {market_id} has non-string Address: {type(address)}")
-                    continue
-                    
-                state = extract_state(address)
-                update_dict = {}
-                
-                if state:
-                    update_dict['state'] = state
-                    state_counts[state] = state_counts.get(state, 0) + 1
+                # Backfill place_id, image_url and has_image so reads never derive them
+                update_dict = derive_image_fields(market)
                 
-                # Extract place_id if available
-                google_maps_link = market.get('google_maps_link')
-                if google_maps_link:
-                    place_id, image_url = extract_place_id(google_maps_link)
-                    if place_id:
-                        update_dict['place_id'] = place_id
-                        if image_url:
-                            update_dict['image_url'] = image_url
+                address = market.get('market_address')
+                if not address:
+                    errors.append(f"Market {market_id} has no market_address field")
+                elif not isinstance(address, str):
+                    errors.append(f"Market {market_id} has non-string market_address: {type(address)}")
+                else:
+                    state = extract_state(address)
+                    if state:
+                        update_dict['state'] = state
+                        state_counts[state] = state_counts.get(state, 0) + 1
+                    else:
+                        errors.append(f"Could not extract state from address: {address}")
                 
-                if update_dict:
-                    updates.append(
-                        UpdateOne(
-                            {'_id': market_id},
-                            {'$set': update_dict}
-                        )
+                updates.append(
+                    UpdateOne(
+                        {'_id': market_id},
+                        {'$set': update_dict}
                     )
-                else:
-                    errors.append(f"Could not extract state from address: {address}")
+                )
             except Exception as e:
                 errors.append(f"Error processing market {market.get('_id', 'unknown')}: {str(e)}")
                 print(f"Error processing market: {str(e)}")
@@ -245,9 +198,9 @@ def update_states():
         if updates:
             try:
                 result = markets.bulk_write(updates)
-                # Create indexes
-                markets.create_index('state', background=True)
-                markets.create_index('place_id', background=True)
+                bump_dataset_version(db)
+                # Rollups group by state and count images
+                rebuild_rollups(db)
                 return jsonify({
                     'success': True,
                     'message': f'Updated {result.modified_count} markets with state information',
@@ -358,15 +311,25 @@ def upload_file():
     return jsonify({'error': 'Invalid file type'}), 400
 
 @api.route('/markets', methods=['GET'])
+@resilient_read
 def get_markets():
     """Get all markets with pagination"""
     try:
-        db = get_db()
+        db = get_read_db()
         
         # Parse pagination parameters
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
+        try:
+            page, per_page = parse_pagination(request.args.get('page'), request.args.get('per_page'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         state = request.args.get('state')
+        with_images = request.args.get('with_images', '').lower() in ('1', 'true', 'yes')
+        try:
+            fmt = parse_format(request.args.get('format'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # Map formats need only the id, name and position of each market
+        projection, fields = (LIST_PROJECTION, LIST_FIELDS) if fmt == 'json' else (MAP_PROJECTION, MAP_FIELDS)
         
         # Calculate skip value for pagination
         skip = (page - 1) * per_page
@@ -375,50 +338,45 @@ def get_markets():
         filter_query = {}
         if state:
             filter_query['state'] = state.upper()
+        if with_images:
+            filter_query['has_image'] = True
         
-        # Get total count for pagination
-        total_markets = db.markets.count_documents(filter_query)
-        
-        # Get markets with pagination
-        markets = list(db.markets.find(
-            filter_query,
-            {
-                '_id': 0,
-                'market_name': 1,
-                'market_address': 1,
-                'state': 1,
-                'zipCode': 1,
-                'latitude': 1,
-                'longitude': 1,
-                'phone_number': 1,
-                'website': 1,
-                'USDA_listing_id': 1,
-                'rating': 1,
-                'google_maps_link': 1,
-                'image_url': 1
-            }
-        ).skip(skip).limit(per_page))
+        def load():
+            # Get total count for pagination
+            total_markets = db.markets.count_documents(filter_query)
+            
+            # Get markets with pagination
+            markets = list(db.markets.find(filter_query, projection).skip(skip).limit(per_page))
+            return total_markets, markets
         
-        # For markets without an image_url but with a google_maps_link, generate a fallback image URL
-        for market in markets:
-            if not market.get('image_url') and market.get('google_maps_link'):
-                _, image_url = extract_place_id(market['google_maps_link'])
-                if image_url:
-                    market['image_url'] = image_url
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            rows = snapshot.filter(filter_query.get('state'), with_images)
+            total_markets = len(rows)
+            markets = [snapshot.document(row, fields) for row in rows[skip:skip + per_page]]
+        else:
+            # Identical concurrent requests share one count + find (see single_flight.py)
+            total_markets, markets = single_flight.do(
+                ('markets', page, per_page, filter_query.get('state'), with_images, fmt), load)
         
-        return jsonify({
+        # image_url is precomputed at import/backfill time (see market_fields.py)
+        return map_response(fmt, {
             'markets': markets,
             'total': total_markets,
             'page': page,
             'per_page': per_page,
             'total_pages': math.ceil(total_markets / per_page)
         })
+    except UNAVAILABLE_ERRORS:
+        # Database slow or down: served stale by resilience.py, or a 503
+        raise
     except Exception as e:
         print(f"Error in /api/markets: {str(e)}")
         sys.stdout.flush()
         return jsonify({'error': str(e)}), 500
 
 @api.route('/markets/search', methods=['GET'])
+@resilient_read
 def search_markets():
     """Search markets with location-based support"""
     try:
@@ -427,9 +385,69 @@ def search_markets():
         lat = request.args.get('lat', type=float)
         lng = request.args.get('lng', type=float)
         radius = request.args.get('radius', type=float, default=50)  # Default 50 miles radius
+        mode = request.args.get('mode', 'text')
+        with_images = request.args.get('with_images', '').lower() in ('1', 'true', 'yes')
+        facets = parse_facets(request.args.get('facets'))
+        fmt = parse_format(request.args.get('format'))
+        projection, fields = (None, None) if fmt == 'json' else (MAP_PROJECTION, MAP_FIELDS)
         
-        db = get_db()
+        db = get_read_db()
         markets = db.markets
+        flight_key = ('search',) + tuple(sorted(request.args.items(multi=True)))
+        
+        # A ZIP code stands in for lat/lng, from the local centroid table (see zip_index.py)
+        origin = None
+        zip_code = parse_zip(request.args.get('zip'))
+        if request.args.get('zip') is not None:
+            if zip_code is None:
+                return jsonify({'success': False, 'error': 'zip must be a 5-digit ZIP code'}), 400
+            if lat is not None or lng is not None:
+                return jsonify({'success': False, 'error': 'Pass either zip or lat/lng, not both'}), 400
+        elif lat is None and lng is None and mode != 'fuzzy':
+            # A ZIP code typed into the search box
+            zip_code = parse_zip(query)
+        if zip_code is not None:
+            position = zip_cache.get(db).lookup(zip_code)
+            if position is not None:
+                lat, lng = position
+                origin = {'zip': zip_code, 'latitude': lat, 'longitude': lng}
+                if request.args.get('zip') is None:
+                    query = ''
+            elif request.args.get('zip') is not None:
+                return jsonify({'success': False, 'error': f"Unknown ZIP code {zip_code}"}), 404
+        
+        def located(payload):
+            return dict(payload, origin=origin) if origin else payload
+        
+        # Typo-tolerant search from the in-memory trigram index
+        if mode == 'fuzzy' and query:
+            payload = single_flight.do(flight_key, lambda: fuzzy_search_markets(db, query, state, lat, lng, radius))
+            if facets:
+                payload = dict(payload, facets=document_facets(payload['markets'], facets))
+            return map_response(fmt, located(payload))
+        
+        # Location and state searches can be answered from the snapshot; text search cannot
+        snapshot = get_snapshot()
+        if snapshot is not None and not query:
+            rows = snapshot.filter(state.upper() if state else None, with_images)
+            if lat is not None and lng is not None:
+                rows = snapshot.near(lat, lng, radius, rows if state or with_images else None)
+            payload = {
+                'success': True,
+                'count': len(rows),
+                'markets': [snapshot.document(row, fields) for row in rows]
+            }
+            if facets:
+                # Facets count the location matches under all filters but their own
+                base = (snapshot.near(lat, lng, radius) if lat is not None and lng is not None
+                        else np.arange(snapshot.count))
+                filters = {}
+                if state:
+                    filters['state'] = mask_of(snapshot.filter(state.upper()), snapshot.count)
+                if with_images:
+                    filters['with_images'] = mask_of(snapshot.filter(with_images=True), snapshot.count)
+                payload['facets'] = snapshot_facets(snapshot, base, filters, facets)
+            return map_response(fmt, located(payload))
         
         # Build search query
         search_query = {}
@@ -462,22 +480,53 @@ def search_markets():
         # Handle state filter
         if state:
             search_query['state'] = state.upper()
+        if with_images:
+            search_query['has_image'] = True
         
-        # Execute search
-        results = list(markets.find(search_query))
-        
-        # Process results
-        processed_results = []
-        for market in results:
-            market['_id'] = str(market['_id'])
-            processed_results.append(market)
+        def run_search():
+            # Execute search
+            results = list(markets.find(search_query, projection))
+            
+            # Process results
+            processed_results = []
+            for market in results:
+                market['_id'] = str(market['_id'])
+                processed_results.append(market)
+            return processed_results
         
-        return jsonify({
+        processed_results = single_flight.do(flight_key, run_search)
+        payload = {
             'success': True,
             'count': len(processed_results),
             'markets': processed_results
-        })
+        }
+        
+        if facets:
+            # One $facet aggregation; $geoNear and $text must be the first stage, so they
+            # stand in for the $near and $text of the find above
+            base_stages = []
+            if 'location' in search_query:
+                base_stages.append({'$geoNear': {
+                    'near': {'type': 'Point', 'coordinates': [lng, lat]},
+                    'distanceField': 'distance',
+                    'maxDistance': radius * 1609.34,
+                    'key': 'location',
+                    'spherical': True
+                }})
+            if query:
+                base_stages.append({'$match': {'$text': {'$search': query}}})
+            filters = {}
+            if state:
+                filters['state'] = {'state': state.upper()}
+            if with_images:
+                filters['with_images'] = {'has_image': True}
+            payload['facets'] = single_flight.do(
+                flight_key + ('facets',), lambda: mongo_facets(markets, base_stages, filters, facets))
         
+        return map_response(fmt, located(payload))
+        
+    except UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         print(f"Search error: {str(e)}")
         return jsonify({
@@ -485,59 +534,230 @@ def search_markets():
             'error': str(e)
         }), 400  # Return 400 for client errors
 
-@api.route('/markets/state-counts', methods=['GET'])
-def get_state_counts():
-    """Get the count of markets by state"""
+def fuzzy_search_markets(db, query, state, lat, lng, radius):
+    """Run a trigram search and return the response payload, best matches first"""
+    limit = request.args.get('limit', type=int, default=50)
+    min_score = request.args.get('min_score', type=float, default=DEFAULT_MIN_SCORE)
+    
+    index = fuzzy_cache.get(db)
+    matches = index.search(
+        query, limit=limit, min_score=min_score, state=state,
+        lat=lat, lng=lng, radius_miles=radius if lat is not None and lng is not None else None
+    )
+    
+    scores = {market_id: score for market_id, score in matches}
+    documents = {market['_id']: market for market in db.markets.find({'_id': {'$in': list(scores)}})}
+    
+    processed_results = []
+    for market_id, score in matches:
+        market = documents.get(market_id)
+        if market is None:
+            continue
+        market['_id'] = str(market['_id'])
+        market['score'] = round(score, 3)
+        processed_results.append(market)
+    
+    return {
+        'success': True,
+        'count': len(processed_results),
+        'mode': 'fuzzy',
+        'markets': processed_results
+    }
+
+@api.route('/markets/autocomplete', methods=['GET'])
+@resilient_read
+def autocomplete_markets():
+    """Typeahead suggestions for market names, cities and states"""
+    try:
+        query = request.args.get('q', '')
+        limit = request.args.get('limit', type=int, default=8)
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+        
+        index = autocomplete_cache.get(get_read_db())
+        suggestions = index.search(query, limit)
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'suggestions': suggestions
+        })
+    except UNAVAILABLE_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Autocomplete error: {str(e)}", file=sys.stderr)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@api.route('/markets/viewport', methods=['GET'])
+@resilient_read
+def get_viewport():
+    """Markets in a map viewport, or grid clusters of them below CLUSTER_MAX_ZOOM (see viewport.py)"""
+    try:
+        try:
+            bbox = parse_bbox(request.args.get('bbox', ''))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        zoom = request.args.get('zoom', type=int)
+        if zoom is None or zoom < 0:
+            return jsonify({'success': False, 'error': 'zoom must be a non-negative integer'}), 400
+        try:
+            fmt = parse_format(request.args.get('format'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        projection = LIST_PROJECTION if fmt == 'json' else MAP_PROJECTION
+        
+        db = get_read_db()
+        if zoom >= CLUSTER_MAX_ZOOM:
+            markets = list(db.markets.find(market_filter(bbox), projection).limit(VIEWPORT_MAX_MARKETS + 1))
+            if len(markets) <= VIEWPORT_MAX_MARKETS:
+                return map_response(fmt, {
+                    'success': True,
+                    'type': 'markets',
+                    'zoom': zoom,
+                    'count': len(markets),
+                    'markets': markets
+                })
+        
+        # Too zoomed out (or too dense) for individual markets
+        cluster_zoom, query = cluster_query(bbox, zoom)
+        clusters = list(db.market_clusters.find(query, CLUSTER_PROJECTION))
+        return map_response(fmt, {
+            'success': True,
+            'type': 'clusters',
+            'zoom': cluster_zoom,
+            'count': sum(cluster['count'] for cluster in clusters),
+            'clusters': clusters
+        }, key='clusters', kind='clusters')
+    except UNAVAILABLE_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error in get_viewport: {str(e)}", file=sys.stderr)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@api.route('/markets/filter', methods=['GET'])
+@resilient_read
+def filter_markets():
+    """Markets matching AND/OR combinations of attributes and states (bitmap index, see attribute_index.py)"""
     try:
+        try:
+            page, per_page = parse_pagination(request.args.get('page'), request.args.get('per_page'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        skip = (page - 1) * per_page
+        
+        def listed(name):
+            return [value.strip() for value in request.args.get(name, '').split(',') if value.strip()]
+        
+        db = get_read_db()
+        index = attribute_cache.get(db)
+        try:
+            bits = index.match(states=[state.upper() for state in listed('state')], all_of=listed('all'),
+                               any_of=listed('any'), none_of=listed('none'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e), 'attributes': index.attribute_names}), 400
+        total = index.count_of(bits)
+        rows = index.rows(bits, skip, per_page)
+        
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            found = (snapshot.find(str(index.ids[row])) for row in rows)
+            markets = [snapshot.document(row, LIST_FIELDS) for row in found if row is not None]
+        else:
+            # Index rows are in _id order, so sorting on _id keeps the page in order
+            markets = list(db.markets.find({'_id': {'$in': [index.ids[row] for row in rows]}},
+                                           LIST_PROJECTION).sort('_id', 1))
+        return jsonify({
+            'success': True,
+            'markets': markets,
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'total_pages': math.ceil(total / per_page),
+            'attributes': index.attribute_names
+        })
+    except UNAVAILABLE_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error in filter_markets: {str(e)}", file=sys.stderr)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def count_markets_by_state():
+    """Aggregate market counts per state, backfilling state fields if none are set"""
+    db = get_read_db()
+    pipeline = [
+        # First try to group by state if it exists
+        {'$group': {'_id': '$state', 'count': {'$sum': 1}}}
+    ]
+    state_counts = list(db.markets.aggregate(pipeline))
+    
+    # If we have no results with state fields or only null state values,
+    # try to extract states from the market_address field and count those
+    if not state_counts or (len(state_counts) == 1 and state_counts[0]['_id'] is None):
+        print("No state fields found, attempting to extract from addresses", file=sys.stderr)
+        
+        # First update all market records with state information
+        # This is similar to the update_states endpoint but simplified;
+        # the backfill and the recount go to the primary
         db = get_db()
-        pipeline = [
-            # First try to group by state if it exists
-            {'$group': {'_id': '$state', 'count': {'$sum': 1}}}
-        ]
-        state_counts = list(db.markets.aggregate(pipeline))
-        
-        # If we have no results with state fields or only null state values,
-        # try to extract states from Market_Address field and count those
-        if not state_counts or (len(state_counts) == 1 and state_counts[0]['_id'] is None):
-            print("No state fields found, attempting to extract from addresses", file=sys.stderr)
-            
-            # First update all market records with state information
-            # This is similar to the update_states endpoint but simplified
-            updated_count = 0
-            markets = list(db.markets.find({}))
-            updates = []
-            
-            for market in markets:
-                if not isinstance(market, dict):
-                    continue
-                    
-                # Check for both possible address field names
-                address = market.get('Address', market.get('Market_Address', ''))
-                if not address or not isinstance(address, str):
-                    continue
-                    
-                state = extract_state(address)
-                if state:
-                    updates.append(
-                        UpdateOne(
-                            {'_id': market.get('_id')},
-                            {'$set': {'state': state}}
-                        )
+        updated_count = 0
+        markets = list(db.markets.find({}))
+        updates = []
+        
+        for market in markets:
+            if not isinstance(market, dict):
+                continue
+                
+            address = market.get('market_address')
+            if not address or not isinstance(address, str):
+                continue
+                
+            state = extract_state(address)
+            if state:
+                updates.append(
+                    UpdateOne(
+                        {'_id': market.get('_id')},
+                        {'$set': {'state': state}}
                     )
+                )
+        
+        if updates:
+            result = db.markets.bulk_write(updates)
+            bump_dataset_version(db)
+            rebuild_rollups(db)
+            updated_count = result.modified_count
+            print(f"Updated {updated_count} markets with state information", file=sys.stderr)
             
-            if updates:
-                result = db.markets.bulk_write(updates)
-                updated_count = result.modified_count
-                print(f"Updated {updated_count} markets with state information", file=sys.stderr)
-                
-                # Now try the aggregation again
-                state_counts = list(db.markets.aggregate(pipeline))
+            # Now try the aggregation again
+            state_counts = list(db.markets.aggregate(pipeline))
+    return state_counts
+
+@api.route('/markets/state-counts', methods=['GET'])
+@resilient_read
+def get_state_counts():
+    """Get the count of markets by state"""
+    try:
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            state_counts = snapshot.state_counts()
+        else:
+            # Concurrent requests share one aggregation (and at most one backfill)
+            state_counts = single_flight.do(('state-counts',), count_markets_by_state)
         
         return jsonify({
             'success': True,
             'data': state_counts
         })
         
+    except UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         print(f"Error in get_state_counts: {str(e)}", file=sys.stderr)
         return jsonify({
@@ -546,6 +766,36 @@ def get_state_counts():
             'message': 'Failed to load state counts. Please try again later.'
         }), 500
 
+@api.route('/markets/rollups/<string:level>', methods=['GET'])
+@resilient_read
+def get_rollups(level):
+    """Market counts per state, city or ZIP code, sorted and cut to the top N (see rollups.py)"""
+    try:
+        try:
+            sort, descending, limit = parse_rollup_query(level, request.args.get('sort'),
+                                                         request.args.get('order'), request.args.get('limit'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        state = request.args.get('state', '').strip().upper() or None
+        
+        rollups = rollup_cache.get(get_read_db())[level]
+        total, top = top_rollups(rollups, level, sort, descending, limit, state)
+        return jsonify({
+            'success': True,
+            'level': level,
+            'total': total,
+            'count': len(top),
+            'rollups': top
+        })
+    except UNAVAILABLE_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error in get_rollups: {str(e)}", file=sys.stderr)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/test-connection', methods=['GET'])
 def test_connection():
     """Test MongoDB connection and return basic stats"""
@@ -655,6 +905,8 @@ def debug_connection():
                 'count': markets_stats['count'],
                 'size': markets_stats['size']
             },
+            'api_reads': describe_reads(get_read_db()),
+            'snapshot': snapshot_store.status() if snapshot_store is not None else None,
             'mongodb_uri': os.getenv('MONGODB_URI', 'Not set')
         })
         
@@ -665,6 +917,19 @@ def debug_connection():
             'mongodb_uri': os.getenv('MONGODB_URI', 'Not set')
         }), 500
 
+@app.route('/debug/slow-queries', methods=['GET'])
+def debug_slow_queries():
+    """Recent slow MongoDB operations with their query shape and explain summary"""
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be an integer'}), 400
+    limit = max(1, min(limit, slow_query_log.entries.maxlen))
+    return jsonify({
+        'success': True,
+        **slow_query_log.report(limit)
+    })
+
 @app.route('/debug/markets/sample', methods=['GET'])
 def debug_markets_sample():
     """Debug endpoint to get a sample of markets data"""
@@ -694,10 +959,29 @@ def debug_markets_sample():
         }), 500
 
 @api.route('/markets/<string:id>', methods=['GET'])
+@resilient_read
 def get_market_by_id(id):
-    """Get market details by ID"""
+    """Get market details by ID, with ?nearby=N its N nearest markets (precomputed, see nearby.py)"""
     try:
-        db = get_db()
+        nearby = max(0, min(request.args.get('nearby', type=int, default=0), NEARBY_K))
+        
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            row = snapshot.find(id)
+            if row is None:
+                # A duplicate merged away by scripts/dedup_markets.py (see dedup.py)
+                row = snapshot.merged_into(id)
+            if row is None:
+                return jsonify({"success": False, "error": "Market not found"}), 404
+            market = snapshot.document(row)
+            if nearby:
+                market['nearby'] = nearby_markets(get_read_db(), market['_id'], nearby, snapshot)
+            return jsonify({
+                "success": True,
+                "market": market
+            })
+        
+        db = get_read_db()
         
         # Try to find the market by ID first
         market = None
@@ -711,17 +995,20 @@ def get_market_by_id(id):
             # If there's an error with ObjectId, continue with other lookup methods
             pass
             
-        # If not found by ObjectId, try looking up by the usda_listing_id or other fields
+        # If not found by ObjectId, try looking up by the USDA listing id
         if not market:
-            market = db.markets.find_one({"usda_listing_id": id})
-            
-        # If still not found, try any other identifier that might be stored
+            market = db.markets.find_one({"USDA_listing_id": id})
+        
+        # Then the market a duplicate was merged into (scripts/dedup_markets.py)
         if not market:
-            market = db.markets.find_one({"id": id})
+            market = db.markets.find_one({"merged_ids": id})
             
         if not market:
             return jsonify({"success": False, "error": "Market not found"}), 404
         
+        if nearby:
+            market["nearby"] = nearby_markets(db, market["_id"], nearby)
+        
         # Convert ObjectId to string for JSON serialization
         market["_id"] = str(market["_id"])
         
@@ -729,6 +1016,8 @@ def get_market_by_id(id):
             "success": True,
             "market": market
         })
+    except UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         print(f"Error in get_market_by_id: {str(e)}", file=sys.stderr)
         return jsonify({
@@ -740,6 +1029,23 @@ def get_market_by_id(id):
 # Register the blueprint
 app.register_blueprint(api)
 
+def warm_caches():
+    """Build in-process caches in the background so the first request is fast"""
+    def build():
+        try:
+            db = get_read_db()
+            autocomplete_cache.get(db)
+            fuzzy_cache.get(db)
+            attribute_cache.get(db)
+            rollup_cache.get(db)
+            zip_cache.get(db)
+        except Exception as e:
+            print(f"Warning: Error warming caches: {str(e)}", file=sys.stderr)
+    threading.Thread(target=build, name='warm-caches', daemon=True).start()
+
+if os.getenv('WARM_CACHES', 'true').lower() not in ('0', 'false', 'no'):
+    warm_caches()
+
 if __name__ == '__main__':
     # Get port from environment variable or default to 5000
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,148 @@
+"""
+Bitmap index over market attributes for multi-filter queries.
+
+USDA exports carry yes/no columns (payment types such as SNAP or Credit,
+products such as Organic or Eggs) that pass through canonicalize_market()
+as strings like 'Y', 'N', 'yes' or 'false'. Every top-level field whose
+values all read as booleans becomes an attribute, together with has_image.
+Each attribute and each state is held as a numpy packed bitset over the
+markets in _id order (one bit per market, so 1M markets take 125 KB per
+bitset).
+
+GET /api/markets/filter combines them:
+
+    state=CA,OR        market in any of these states
+    all=snap,organic   has every one of these attributes
+    any=eggs,cheese    has at least one of them
+    none=wine          has none of them
+
+These are ANDed together and evaluate as a handful of vectorised
+bitwise operations. Only the requested page of documents is read.
+Attribute names are matched case-insensitively, and the response lists
+the ones available. The index is rebuilt when the dataset version
+changes (market_cache.py).
+"""
+import numpy as np
+
+from market_cache import DatasetCache
+
+TRUE_VALUES = frozenset({'y', 'yes', 'true', 't', '1'})
+FALSE_VALUES = frozenset({'n', 'no', 'false', 'f', '0'})
+
+# Never attributes, even if every value happened to read as a boolean
+SKIPPED_FIELDS = frozenset({'_id', 'location', 'latitude', 'longitude', 'USDA_listing_id', 'zipCode',
+                            'schema_version', 'rating'})
+
+# Set bits per byte value
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+def as_flag(value):
+    """True/False for a boolean-looking value, None for anything else"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in TRUE_VALUES:
+            return True
+        if text in FALSE_VALUES:
+            return False
+    return None
+
+class AttributeIndex:
+    """Packed bitsets per attribute and per state, over markets in _id order"""
+
+    def __init__(self, ids, attributes, states):
+        self.ids = ids
+        self.count = len(ids)
+        self.attributes = {name: np.packbits(flags) for name, flags in attributes.items()}
+        self.states = {state: np.packbits(flags) for state, flags in states.items()}
+        self._names = {name.lower(): name for name in self.attributes}
+
+    @classmethod
+    def from_markets(cls, markets):
+        """Build from market documents sorted by _id, discovering the attribute fields"""
+        ids = []
+        true_rows = {}
+        seen = set()
+        rejected = set(SKIPPED_FIELDS)
+        state_rows = {}
+        for row, market in enumerate(markets):
+            ids.append(market['_id'])
+            state = market.get('state')
+            if isinstance(state, str):
+                state_rows.setdefault(state, []).append(row)
+            for field, value in market.items():
+                if field in rejected or value is None:
+                    continue
+                flag = as_flag(value)
+                if flag is None:
+                    rejected.add(field)
+                    continue
+                seen.add(field)
+                if flag:
+                    true_rows.setdefault(field, []).append(row)
+
+        def flags(rows):
+            array = np.zeros(len(ids), dtype=bool)
+            array[rows] = True
+            return array
+
+        attributes = {field: flags(true_rows[field]) for field in sorted(seen - rejected) if field in true_rows}
+        return cls(ids, attributes, {state: flags(rows) for state, rows in state_rows.items()})
+
+    @property
+    def attribute_names(self):
+        return sorted(self.attributes)
+
+    def resolve(self, names):
+        """Attribute field names for case-insensitive names; ValueError for unknown ones"""
+        resolved = []
+        for name in names:
+            field = self._names.get(name.lower())
+            if field is None:
+                raise ValueError(f"Unknown attribute {name}")
+            resolved.append(field)
+        return resolved
+
+    def match(self, states=(), all_of=(), any_of=(), none_of=()):
+        """Packed bitset of the markets matching every given condition"""
+        bits = np.full((self.count + 7) // 8, 0xFF, dtype=np.uint8)
+        if states:
+            empty = np.zeros_like(bits)
+            bits &= np.bitwise_or.reduce([self.states.get(state, empty) for state in states])
+        for field in self.resolve(all_of):
+            bits &= self.attributes[field]
+        if any_of:
+            bits &= np.bitwise_or.reduce([self.attributes[field] for field in self.resolve(any_of)])
+        for field in self.resolve(none_of):
+            bits &= ~self.attributes[field]
+        # Clear the padding bits past the last market
+        if self.count % 8:
+            bits[-1] &= 0xFF << (8 - self.count % 8) & 0xFF
+        return bits
+
+    @staticmethod
+    def count_of(bits):
+        return int(np.count_nonzero(np.unpackbits(bits)))
+
+    @staticmethod
+    def rows(bits, skip=0, limit=None):
+        """Row numbers set in bits, in _id order, from the skip-th on"""
+        # Locate the page with per-byte counts and only unpack the bytes that hold it
+        occupied = np.flatnonzero(bits)
+        ends = np.cumsum(POPCOUNT[bits[occupied]], dtype=np.int64)
+        first = int(np.searchsorted(ends, skip, side='right'))
+        last = len(occupied) if limit is None else int(np.searchsorted(ends, skip + limit, side='left')) + 1
+        chosen = occupied[first:last]
+        byte, bit = np.nonzero(np.unpackbits(bits[chosen]).reshape(-1, 8))
+        rows = chosen[byte] * 8 + bit
+        before = int(ends[first - 1]) if first else 0
+        return rows[skip - before:][:limit]
+
+def build_attribute_index(db):
+    """Build the attribute index from the markets collection"""
+    return AttributeIndex.from_markets(db.markets.find({}).sort('_id', 1))
+
+attribute_cache = DatasetCache('attribute index', build_attribute_index)
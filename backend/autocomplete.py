@@ -0,0 +1,128 @@
+"""
+Typeahead suggestions served from an in-memory prefix index.
+
+Every suggestion (market name, city or state) is indexed under each of its
+word starts, so "green" matches both "Greenmarket" and "Union Square Green
+Market". Keys live in one sorted list searched with bisect; the weights of
+a matching key range are ranked with numpy, so a lookup costs two binary
+searches plus a partial sort of the range.
+"""
+from bisect import bisect_left
+import re
+import unicodedata
+
+import numpy as np
+
+from market_cache import DatasetCache
+from market_fields import STATE_NAMES
+
+MAX_SUGGESTIONS = 20
+
+_NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    if not isinstance(text, str):
+        return ''
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_WORD_RE.sub(' ', text.lower()).strip()
+
+class PrefixIndex:
+    """Sorted-array prefix index returning the top-weighted suggestions"""
+
+    def __init__(self, suggestions):
+        # suggestions: list of dicts with at least 'text', 'type' and 'weight'
+        self.suggestions = suggestions
+        pairs = []
+        for i, suggestion in enumerate(suggestions):
+            words = normalize(suggestion['text']).split()
+            keys = {' '.join(words[start:]) for start in range(len(words))}
+            keys.update(normalize(alias) for alias in suggestion.pop('aliases', ()))
+            pairs.extend((key, i) for key in keys if key)
+        pairs.sort()
+        self._keys = [key for key, _ in pairs]
+        self._rows = np.fromiter((row for _, row in pairs), dtype=np.int32, count=len(pairs))
+        self._weights = np.array([s['weight'] for s in suggestions], dtype=np.float64)[self._rows] \
+            if pairs else np.zeros(0)
+
+    def __len__(self):
+        return len(self.suggestions)
+
+    def search(self, prefix, limit=8):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + '\uffff', lo)
+        if lo == hi:
+            return []
+
+        rows = self._rows[lo:hi]
+        # Weights are whole numbers, so subtracting the fractional key
+        # position breaks ties alphabetically without reordering weights
+        scores = self._weights[lo:hi] - np.arange(hi - lo) / (hi - lo + 1)
+        # A suggestion can match through several of its word starts, so
+        # over-fetch before de-duplicating
+        take = min(len(rows), limit * 3)
+        if take < len(rows):
+            top = np.argpartition(-scores, take - 1)[:take]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        seen = set()
+        for row in rows[top]:
+            if row in seen:
+                continue
+            seen.add(row)
+            suggestion = dict(self.suggestions[row])
+            suggestion.pop('weight', None)
+            results.append(suggestion)
+            if len(results) == limit:
+                break
+        return results
+
+def build_suggestions(markets):
+    """Turn market documents into market, city and state suggestions"""
+    suggestions = []
+    city_counts = {}
+    state_counts = {}
+
+    for market in markets:
+        name = market.get('market_name')
+        state = market.get('state')
+        city = market.get('city')
+
+        if isinstance(name, str) and name.strip():
+            suggestion = {'text': name.strip(), 'type': 'market', 'id': str(market['_id']), 'weight': 1.0}
+            if state:
+                suggestion['state'] = state
+            suggestions.append(suggestion)
+        if isinstance(city, str) and city.strip():
+            key = (city.strip().title(), state)
+            city_counts[key] = city_counts.get(key, 0) + 1
+        if state:
+            state_counts[state] = state_counts.get(state, 0) + 1
+
+    for (city, state), count in city_counts.items():
+        suggestion = {'text': f"{city}, {state}" if state else city, 'type': 'city',
+                      'city': city, 'count': count, 'weight': float(count)}
+        if state:
+            suggestion['state'] = state
+        suggestions.append(suggestion)
+
+    for state, count in state_counts.items():
+        suggestions.append({'text': STATE_NAMES.get(state, state), 'type': 'state', 'state': state,
+                            'count': count, 'weight': float(count), 'aliases': [state]})
+
+    return suggestions
+
+def build_autocomplete_index(db):
+    """Build the prefix index from the markets collection"""
+    projection = {'market_name': 1, 'city': 1, 'state': 1}
+    return PrefixIndex(build_suggestions(db.markets.find({}, projection)))
+
+autocomplete_cache = DatasetCache('autocomplete', build_autocomplete_index)
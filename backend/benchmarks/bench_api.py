@@ -0,0 +1,480 @@
+"""
+Benchmark and load-test every route of the `api` blueprint.
+
+Seeds a synthetic markets dataset (generate_markets.py), then runs two phases:
+
+  client  each route through the Flask test client in this process:
+          latency percentiles, requests/s and memory allocated per request
+  http    a concurrent HTTP load against gunicorn: latency percentiles,
+          requests/s, error count and worker RSS per route
+
+Data lives either in a local mongod (MONGODB_URI, default localhost) or,
+with --stand-in, in an in-memory mongomock database (pip install mongomock).
+The stand-in has no $text or $near support, so the routes that need them
+only run against mongod.
+
+    python backend/benchmarks/bench_api.py --stand-in --scale 10000
+    python backend/benchmarks/bench_api.py --scale 100000 --concurrency 16 --duration 10
+    python backend/benchmarks/bench_api.py --stand-in --save-baseline
+    python backend/benchmarks/bench_api.py --stand-in --fail-on-regression
+
+Results are compared with the stored baseline for the same data store and
+scale in benchmarks/baselines/ (p95 latency up or throughput down by more
+than --tolerance counts as a regression, and so does a scenario the
+baseline has no numbers for; --fail-on-regression also fails without a
+baseline). A baseline recorded on a different machine type or CPU count,
+or with other --concurrency, --workers or --threads, is not compared
+against, and --fail-on-regression fails instead. Seeding replaces the markets collection, so it refuses to run
+against a non-local MongoDB.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import quote_plus
+
+import numpy as np
+from bson import ObjectId
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+REPO_DIR = os.path.abspath(os.path.join(BACKEND_DIR, '..'))
+BASELINE_DIR = os.path.join(BENCH_DIR, 'baselines')
+
+sys.path.insert(0, BACKEND_DIR)
+
+from generate_markets import generate_records  # noqa: E402
+from market_fields import add_derived_fields  # noqa: E402
+from market_schema import canonicalize_market  # noqa: E402
+from market_cache import bump_dataset_version  # noqa: E402
+from indexes import reconcile_indexes  # noqa: E402
+from nearby import rebuild_nearby  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from viewport import rebuild_clusters  # noqa: E402
+
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+def seed_markets(db, count, seed=42, batch_size=5000):
+    """Replace the markets collection with `count` synthetic markets"""
+    db.markets.drop()
+    batch = []
+    for i, record in enumerate(generate_records(count, seed)):
+        # Deterministic ids, so a stand-in seeded in another process has the same ones
+        record['_id'] = ObjectId(f"{seed:08x}{i:016x}"[-24:])
+        batch.append(canonicalize_market(record))
+        if len(batch) >= batch_size:
+            db.markets.insert_many(add_derived_fields(batch))
+            batch = []
+    if batch:
+        db.markets.insert_many(add_derived_fields(batch))
+    bump_dataset_version(db)
+    reconcile_indexes(db)
+    rebuild_clusters(db)
+    rebuild_nearby(db, full=True)
+    rebuild_rollups(db)
+
+def use_stand_in(app_module, count, seed=42):
+    """Point the app at a seeded in-memory mongomock database"""
+    try:
+        import mongomock
+    except ImportError:
+        print("Error: --stand-in needs mongomock (pip install mongomock)")
+        sys.exit(1)
+    client = mongomock.MongoClient()
+    seed_markets(client.farmers_market, count, seed)
+    app_module._client = client
+    return client.farmers_market
+
+def sample_dataset(db, size=500):
+    """Ids, names and coordinates of a sample of markets, used to build request URLs"""
+    total = db.markets.count_documents({})
+    projection = {'market_name': 1, 'USDA_listing_id': 1, 'state': 1, 'zipCode': 1, 'latitude': 1, 'longitude': 1}
+    sample = list(db.markets.find({}, projection).limit(size))
+    return {
+        'total': total,
+        'ids': [str(m['_id']) for m in sample],
+        'listing_ids': [m['USDA_listing_id'] for m in sample if m.get('USDA_listing_id')],
+        'names': [m['market_name'] for m in sample if m.get('market_name')],
+        'states': sorted({m['state'] for m in sample if m.get('state')}),
+        'zips': sorted({m['zipCode'] for m in sample if m.get('zipCode')}),
+        'points': [(m['latitude'], m['longitude']) for m in sample if m.get('latitude') is not None],
+    }
+
+def misspell(text, rng):
+    """Drop one character from the longest word"""
+    words = text.split()
+    longest = max(range(len(words)), key=lambda i: len(words[i]))
+    word = words[longest]
+    if len(word) > 4:
+        j = rng.randrange(1, len(word) - 1)
+        words[longest] = word[:j] + word[j + 1:]
+    return ' '.join(words)
+
+def viewport_around(point, half_width=0.05):
+    """bbox (minLng, minLat, maxLng, maxLat) of a street-level map view centred on a (lat, lng) point"""
+    lat, lng = point
+    return lng - half_width, lat - half_width / 2, lng + half_width, lat + half_width / 2
+
+def build_scenarios(data):
+    """name -> (URL builder, needs real MongoDB)"""
+    deep_page = max(1, data['total'] // 20 // 2)
+    return {
+        'markets_page': (lambda rng: f"/api/markets?page={rng.randint(1, 5)}&per_page=20", False),
+        'markets_deep_page': (lambda rng: f"/api/markets?page={deep_page}&per_page=20", False),
+        'markets_state': (lambda rng: f"/api/markets?state={rng.choice(data['states'])}&per_page=20", False),
+        'markets_with_images': (lambda rng: "/api/markets?with_images=1&per_page=20", False),
+        'markets_compact': (lambda rng: f"/api/markets?page={rng.randint(1, 5)}&per_page=100&format=compact", False),
+        'search_text': (lambda rng: f"/api/markets/search?q={quote_plus(rng.choice(data['names']).split()[0])}", True),
+        'search_radius': (lambda rng: "/api/markets/search?lat={}&lng={}&radius=10".format(
+            *rng.choice(data['points'])), True),
+        'search_zip': (lambda rng: f"/api/markets/search?zip={rng.choice(data['zips'])}&radius=25", True),
+        'search_facets': (lambda rng: f"/api/markets/search?state={rng.choice(data['states'])}"
+                                      "&facets=state,city,has_image,rating", False),
+        'search_fuzzy': (lambda rng: "/api/markets/search?mode=fuzzy&limit=20&q={}".format(
+            quote_plus(misspell(rng.choice(data['names']), rng))), False),
+        'filter_attributes': (lambda rng: f"/api/markets/filter?state={rng.choice(data['states'])}"
+                                          "&all=has_image&per_page=20", False),
+        'autocomplete': (lambda rng: f"/api/markets/autocomplete?q={quote_plus(rng.choice(data['names'])[:3])}", False),
+        'state_counts': (lambda rng: "/api/markets/state-counts", False),
+        'rollups_cities': (lambda rng: f"/api/markets/rollups/city?state={rng.choice(data['states'])}&limit=20", False),
+        'market_by_object_id': (lambda rng: f"/api/markets/{rng.choice(data['ids'])}", False),
+        'market_by_listing_id': (lambda rng: f"/api/markets/{rng.choice(data['listing_ids'])}", False),
+        'market_with_nearby': (lambda rng: f"/api/markets/{rng.choice(data['ids'])}?nearby=5", False),
+        'viewport_clusters': (lambda rng: "/api/markets/viewport?bbox=-125,24,-66,50&zoom={}".format(
+            rng.randint(3, 6)), False),
+        'viewport_geojson': (lambda rng: "/api/markets/viewport?bbox=-125,24,-66,50&zoom={}&format=geojson".format(
+            rng.randint(3, 6)), False),
+        'viewport_markets': (lambda rng: "/api/markets/viewport?bbox={},{},{},{}&zoom=13".format(
+            *viewport_around(rng.choice(data['points']))), True),
+    }
+
+def check_coverage(app, scenarios, rng):
+    """Warn about api blueprint routes that no scenario requests"""
+    adapter = app.url_map.bind('localhost')
+    covered = {adapter.match(builder(rng).split('?')[0])[0] for builder, _ in scenarios.values()}
+    routes = {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint.startswith('api.')}
+    for endpoint in sorted(routes - covered):
+        print(f"Warning: no benchmark scenario for {endpoint}")
+
+def summarize(latencies, elapsed, errors=0):
+    samples = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(float(np.percentile(samples, 50)), 2) if len(samples) else None,
+        'p95_ms': round(float(np.percentile(samples, 95)), 2) if len(samples) else None,
+        'p99_ms': round(float(np.percentile(samples, 99)), 2) if len(samples) else None,
+    }
+
+def rss_mb(pid='self'):
+    """Resident set size of a process in MB (Linux /proc), None elsewhere"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+def child_pids(parent):
+    pids = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == parent:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return pids
+
+def run_client_phase(app, scenarios, args):
+    """Drive each route through the Flask test client, one request at a time"""
+    client = app.test_client()
+    results = {}
+    for name, (builder, _) in scenarios.items():
+        rng = random.Random(args.seed)
+        for _ in range(args.warmup):
+            client.get(builder(rng))
+
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            url = builder(rng)
+            t0 = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - t0)
+            errors += response.status_code >= 400
+        result = summarize(latencies, time.perf_counter() - started, errors)
+
+        # Separate pass: tracemalloc slows requests down too much to time them
+        tracemalloc.start()
+        peaks = []
+        for _ in range(args.memory_requests):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            client.get(builder(rng))
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        result['peak_alloc_kb'] = round(float(np.median(peaks)) / 1024, 1)
+        result['rss_mb'] = rss_mb()
+        results[name] = result
+        print_row('client', name, result)
+    return results
+
+def start_gunicorn(args, port):
+    """Start gunicorn on the production entry point (or the stand-in app) and wait for it"""
+    env = dict(os.environ, WARM_CACHES='0')
+    if args.stand_in:
+        env.update(BENCH_SCALE=str(args.scale), BENCH_SEED=str(args.seed))
+        chdir, target = BENCH_DIR, 'stand_in_wsgi:app'
+    else:
+        chdir, target = REPO_DIR, 'wsgi_app:app'
+    command = [sys.executable, '-m', 'gunicorn', '--chdir', chdir, '--bind', f'127.0.0.1:{port}',
+               '--workers', str(args.workers), '--threads', str(args.threads),
+               '--log-level', 'warning', '--preload', target]
+    process = subprocess.Popen(command, env=env)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/api/markets?per_page=1')
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not answer within {args.startup_timeout}s")
+
+def load_route(host, port, builder, concurrency, duration, seed):
+    """Hit one route from `concurrency` threads for `duration` seconds"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(worker_id):
+        rng = random.Random(seed + worker_id)
+        connection = http.client.HTTPConnection(host, port, timeout=30)
+        local, local_errors = [], 0
+        while time.perf_counter() < stop_at:
+            url = builder(rng)
+            t0 = time.perf_counter()
+            try:
+                connection.request('GET', url)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    local_errors += 1
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                connection.close()
+                continue
+            local.append(time.perf_counter() - t0)
+        connection.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started, errors[0])
+
+def run_http_phase(scenarios, args):
+    """Concurrent load against gunicorn (or --url), one route at a time"""
+    process = None
+    if args.url:
+        host, _, port = args.url.replace('http://', '').rstrip('/').partition(':')
+        port = int(port or 80)
+    else:
+        host, port = '127.0.0.1', args.port
+        process = start_gunicorn(args, port)
+    results = {}
+    try:
+        for name, (builder, _) in scenarios.items():
+            # Warm every worker's caches before measuring
+            load_route(host, port, builder, args.concurrency, min(1.0, args.duration), args.seed)
+            result = load_route(host, port, builder, args.concurrency, args.duration, args.seed)
+            if process is not None:
+                workers = [rss_mb(pid) for pid in child_pids(process.pid)]
+                workers = [rss for rss in workers if rss is not None]
+                result['rss_mb'] = round(sum(workers), 1) if workers else None
+            results[name] = result
+            print_row('http', name, result)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+    return results
+
+def print_row(phase, name, result):
+    memory = f"alloc {result['peak_alloc_kb']:>8.1f}KB" if 'peak_alloc_kb' in result else ' ' * 19
+    rss = f"rss {result['rss_mb']}MB" if result.get('rss_mb') is not None else ''
+    print(f"{phase:<6} {name:<22} {result['throughput_rps'] or 0:>9.1f} req/s  "
+          f"p50 {result['p50_ms'] or 0:>8.2f}  p95 {result['p95_ms'] or 0:>8.2f}  "
+          f"p99 {result['p99_ms'] or 0:>8.2f}ms  errors {result['errors']:<4} {memory} {rss}")
+    sys.stdout.flush()
+
+def baseline_path(args):
+    return os.path.join(BASELINE_DIR, f"{'stand-in' if args.stand_in else 'mongod'}-{args.scale}.json")
+
+# Numbers only compare between runs on the same kind of host with the same load settings
+COMPARABLE_META = ('machine', 'cpus', 'concurrency', 'workers', 'threads')
+
+def baseline_mismatch(report, baseline):
+    """Describe how the baseline's host or settings differ from this run's, or None"""
+    differences = [f"{key} {baseline.get('meta', {}).get(key)} (now {report['meta'].get(key)})"
+                   for key in COMPARABLE_META if baseline.get('meta', {}).get(key) != report['meta'].get(key)]
+    return ', '.join(differences) or None
+
+def compare_with_baseline(report, baseline, tolerance):
+    """
+    Return the routes whose p95 latency or throughput regressed past the
+    tolerance, and those the baseline has no numbers for
+    """
+    regressions = []
+    for phase in ('client', 'http'):
+        for name, current in report.get(phase, {}).items():
+            previous = baseline.get(phase, {}).get(name)
+            if not previous:
+                regressions.append(f"{phase} {name}: no baseline (re-record with --save-baseline)")
+                continue
+            if not current['requests']:
+                continue
+            if previous.get('p95_ms') and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{phase} {name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+            if previous.get('throughput_rps') and \
+                    current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+                regressions.append(f"{phase} {name}: {previous['throughput_rps']} -> "
+                                   f"{current['throughput_rps']} req/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stand-in', action='store_true', help='use an in-memory mongomock database')
+    parser.add_argument('--scale', type=int, default=10000, help='synthetic markets to seed (0 keeps existing data)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--phase', choices=('client', 'http', 'both'), default='both')
+    parser.add_argument('--routes', help='comma-separated scenario names to run')
+    parser.add_argument('--requests', type=int, default=200, help='timed test-client requests per route')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--memory-requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8, help='HTTP load threads')
+    parser.add_argument('--duration', type=float, default=5, help='seconds of HTTP load per route')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--startup-timeout', type=float, default=600,
+                        help='seconds to wait for gunicorn; the stand-in seeds its data first')
+    parser.add_argument('--url', help='load an already running server instead of starting gunicorn')
+    parser.add_argument('--allow-remote', action='store_true', help='seed a non-local MONGODB_URI')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    os.environ['WARM_CACHES'] = '0'
+    # The load comes from one IP; measure the handlers, not the rate limiter's 429s
+    os.environ['RATE_LIMIT_PER_MINUTE'] = '0'
+    os.environ['MAX_IN_FLIGHT_COST'] = '0'
+    if not args.stand_in:
+        from dotenv import load_dotenv
+        from pymongo import uri_parser
+        load_dotenv()
+        os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
+        hosts = {host for host, _ in uri_parser.parse_uri(os.environ['MONGODB_URI'])['nodelist']}
+        if args.scale and not hosts <= LOCAL_HOSTS and not args.allow_remote:
+            print(f"Error: refusing to replace the markets collection on {', '.join(sorted(hosts))}; "
+                  "use a local mongod, --scale 0 or --allow-remote")
+            sys.exit(1)
+
+    import app as app_module
+
+    started = time.perf_counter()
+    if args.stand_in:
+        db = use_stand_in(app_module, args.scale, args.seed)
+    else:
+        db = app_module.get_db()
+        if args.scale:
+            seed_markets(db, args.scale, args.seed)
+    data = sample_dataset(db)
+    print(f"Seeded {data['total']} markets in {time.perf_counter() - started:.1f}s")
+    if not data['names']:
+        print("Error: no markets to benchmark")
+        sys.exit(1)
+
+    scenarios = build_scenarios(data)
+    check_coverage(app_module.app, scenarios, random.Random(args.seed))
+    if args.stand_in:
+        scenarios = {name: s for name, s in scenarios.items() if not s[1]}
+    if args.routes:
+        scenarios = {name: s for name, s in scenarios.items() if name in args.routes.split(',')}
+
+    report = {
+        'meta': {
+            'at': datetime.utcnow().isoformat() + 'Z',
+            'store': 'stand-in' if args.stand_in else 'mongod',
+            'markets': data['total'],
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'threads': args.threads,
+        },
+    }
+    if args.phase in ('client', 'both'):
+        report['client'] = run_client_phase(app_module.app, scenarios, args)
+    if args.phase in ('http', 'both'):
+        report['http'] = run_http_phase(scenarios, args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    path = baseline_path(args)
+    regressions = []
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"Saved baseline {os.path.relpath(path, REPO_DIR)}")
+    elif os.path.exists(path):
+        with open(path) as f:
+            baseline = json.load(f)
+        mismatch = baseline_mismatch(report, baseline)
+        if mismatch:
+            print(f"\nNot comparing with {os.path.relpath(path, REPO_DIR)}, recorded with {mismatch}; "
+                  "re-record it on this host with --save-baseline")
+            if args.fail_on_regression:
+                sys.exit(1)
+            return
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        print(f"\nCompared with {os.path.relpath(path, REPO_DIR)} (tolerance {args.tolerance:.0%}): "
+              f"{len(regressions)} regression(s)")
+        for line in regressions:
+            print(f"  {line}")
+    elif args.fail_on_regression:
+        print(f"Error: no baseline at {os.path.relpath(path, REPO_DIR)}; record one with --save-baseline")
+        sys.exit(1)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Throughput and accuracy of duplicate market detection (dedup.py).
+
+Synthetic markets (generate_markets.py, put through canonicalize_market)
+get a share of planted duplicates of the kinds the loaders produce:
+
+    reimport   the same row loaded twice (same USDA_listing_id)
+    variant    no listing id, the name respelled (case, a dropped letter,
+               "Market" -> "Mkt"), a position up to ~50 m off
+    reformat   no listing id, the address rewritten (full state name,
+               ZIP+4) and optional fields missing
+
+Each step of find_duplicates() is timed, and its groups are scored
+against the planted ones as pair precision and recall. With --stand-in
+the markets are also loaded into mongomock (pip install mongomock) and
+plan_merges() plus apply_merges() are run end to end. mongomock scans the
+collection for every operation, so those two timings only show the
+path works, not what a mongod would take.
+
+    python backend/benchmarks/bench_dedup.py
+    python backend/benchmarks/bench_dedup.py --counts 100000 1000000 --duplicates 0.05
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from bson import ObjectId
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dedup import (DEDUP_MIN_SCORE, apply_merges, candidate_pairs, connected_groups,  # noqa: E402
+                   find_duplicates, market_signatures, plan_merges, score_pairs)
+from generate_markets import generate_records  # noqa: E402
+from market_fields import STATE_NAMES  # noqa: E402
+from market_schema import canonicalize_market  # noqa: E402
+
+KINDS = ('reimport', 'variant', 'reformat')
+
+def respell(name, rng):
+    choice = rng.randrange(3)
+    if choice == 0:
+        return name.upper() if rng.random() < 0.5 else name.lower()
+    if choice == 1 and 'Market' in name:
+        return name.replace('Market', 'Mkt', 1)
+    words = name.split()
+    longest = max(range(len(words)), key=lambda i: len(words[i]))
+    word = words[longest]
+    if len(word) > 4:
+        cut = rng.randrange(1, len(word) - 1)
+        words[longest] = word[:cut] + word[cut + 1:]
+    return ' '.join(words)
+
+def plant(original, kind, rng):
+    """A duplicate of a canonical market as one of the loaders would have stored it"""
+    copy = {field: value for field, value in original.items() if field not in ('_id', 'location')}
+    if kind != 'reimport':
+        copy.pop('USDA_listing_id', None)
+    if kind == 'variant':
+        copy['market_name'] = respell(copy.get('market_name', ''), rng)
+        if 'latitude' in copy:
+            copy['latitude'] += rng.uniform(-0.0004, 0.0004)
+            copy['longitude'] += rng.uniform(-0.0004, 0.0004)
+    if kind == 'reformat':
+        address = copy.get('market_address', '')
+        state = copy.get('state')
+        if state and address.endswith(f"{state} {copy.get('zipCode')}"):
+            address = address[:-len(f"{state} {copy['zipCode']}")] + \
+                f"{STATE_NAMES[state]} {copy['zipCode']}-{rng.randrange(10000):04d}"
+        copy['market_address'] = address
+        for field in ('phone_number', 'website', 'rating', 'google_maps_link'):
+            copy.pop(field, None)
+    return canonicalize_market(copy)
+
+def load_markets(count, share, seed):
+    """(markets with planted duplicates, group label of each market: the row of its original)"""
+    rng = random.Random(seed)
+    markets = []
+    for i, record in enumerate(generate_records(count, seed)):
+        record['_id'] = ObjectId(f"{seed:08x}{i:016x}"[-24:])
+        markets.append(canonicalize_market(record))
+    truth = list(range(count))
+    for n, original in enumerate(rng.sample(range(count), int(count * share))):
+        duplicate = plant(markets[original], KINDS[n % len(KINDS)], rng)
+        duplicate['_id'] = ObjectId(f"{seed + 1:08x}{n:016x}"[-24:])
+        markets.append(duplicate)
+        truth.append(original)
+    return markets, truth
+
+def pairs_of(groups):
+    pairs = set()
+    for rows in groups:
+        rows = sorted(rows)
+        pairs.update((a, b) for i, a in enumerate(rows) for b in rows[i + 1:])
+    return pairs
+
+def accuracy(found, truth):
+    expected = {}
+    for row, original in enumerate(truth):
+        expected.setdefault(original, []).append(row)
+    actual = pairs_of(rows for rows, _ in found)
+    planted = pairs_of(rows for rows in expected.values() if len(rows) > 1)
+    hits = len(actual & planted)
+    return hits / len(actual) if actual else 1.0, hits / len(planted) if planted else 1.0
+
+def timed(label, count, function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<12} {elapsed * 1000:9.1f} ms  {count / elapsed:12,.0f}/s")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--duplicates', type=float, default=0.05, help='planted duplicates per market')
+    parser.add_argument('--min-score', type=float, default=DEDUP_MIN_SCORE)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--stand-in', action='store_true', help='also time plan_merges and apply_merges on mongomock')
+    args = parser.parse_args()
+
+    for count in args.counts:
+        markets, truth = load_markets(count, args.duplicates, args.seed)
+        print(f"\n{count} markets + {len(markets) - count} planted duplicates")
+        a, b, same_listing, _ = timed('candidates', len(markets), candidate_pairs, markets)
+        print(f"  {len(a)} candidate pairs ({same_listing.sum()} by listing id)")
+        signed = timed('signatures', len(markets), market_signatures, markets)
+        scores = timed('scoring', len(a), score_pairs, signed, a, b)
+        duplicate = (scores >= args.min_score) | same_listing
+        timed('grouping', int(duplicate.sum()), connected_groups, len(markets), a[duplicate], b[duplicate])
+        found = timed('total', len(markets), find_duplicates, markets, args.min_score)
+        precision, recall = accuracy(found, truth)
+        print(f"  {len(found)} groups  precision {precision:.3f}  recall {recall:.3f}")
+        scored = np.asarray(truth)[a] == np.asarray(truth)[b]
+        if scored.any() and (~scored).any():
+            print(f"  median score: planted pairs {np.median(scores[scored]):.2f}, "
+                  f"other candidates {np.median(scores[~scored]):.2f}")
+
+        if args.stand_in:
+            try:
+                import mongomock
+            except ImportError:
+                print("Error: --stand-in needs mongomock (pip install mongomock)")
+                sys.exit(1)
+            db = mongomock.MongoClient().farmers_market
+            db.markets.insert_many(markets)
+            decisions = timed('plan', len(markets), plan_merges, db, args.min_score)
+            timed('apply', len(decisions), apply_merges, db, decisions)
+            print(f"  {db.markets.count_documents({})} markets left")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark the trigram fuzzy search on the real dataset and a scaled-up
+synthetic copy of it.
+
+    python backend/benchmarks/bench_fuzzy_search.py                 # markets collection
+    python backend/benchmarks/bench_fuzzy_search.py --csv uploads/farmers_market.csv
+    python backend/benchmarks/bench_fuzzy_search.py --scale 100     # 100x synthetic copy
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fuzzy_search import TrigramIndex  # noqa: E402
+from market_schema import canonicalize_market  # noqa: E402
+
+def load_markets(csv_path=None):
+    """Load markets from a CSV export or from the markets collection"""
+    if csv_path:
+        df = pd.read_csv(csv_path)
+        markets = [canonicalize_market(record) for record in df.to_dict('records')]
+    else:
+        from pymongo import MongoClient
+        from dotenv import load_dotenv
+        load_dotenv()
+        client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market'))
+        markets = list(client.farmers_market.markets.find({}))
+    for i, market in enumerate(markets):
+        market.setdefault('_id', i)
+    return markets
+
+def misspell(text, rng):
+    """Drop, swap or replace one character in a random word"""
+    words = text.split()
+    if not words:
+        return text
+    i = rng.randrange(len(words))
+    word = words[i]
+    if len(word) > 3:
+        j = rng.randrange(1, len(word) - 1)
+        op = rng.choice(('drop', 'swap', 'replace'))
+        if op == 'drop':
+            word = word[:j] + word[j + 1:]
+        elif op == 'swap':
+            word = word[:j - 1] + word[j] + word[j - 1] + word[j + 1:]
+        else:
+            word = word[:j] + rng.choice('aeiou') + word[j + 1:]
+    words[i] = word
+    return ' '.join(words)
+
+def scale_markets(markets, scale, rng):
+    """Replicate markets with misspelled names and jittered coordinates"""
+    if scale <= 1:
+        return markets
+    scaled = list(markets)
+    for copy in range(1, scale):
+        for market in markets:
+            clone = dict(market)
+            clone['_id'] = f"{market['_id']}-{copy}"
+            if clone.get('market_name'):
+                clone['market_name'] = misspell(clone['market_name'], rng)
+            for field in ('latitude', 'longitude'):
+                if isinstance(clone.get(field), (int, float)):
+                    clone[field] = clone[field] + rng.uniform(-0.5, 0.5)
+            scaled.append(clone)
+    return scaled
+
+def percentile(samples, pct):
+    return float(np.percentile(samples, pct)) * 1000
+
+def run(markets, label, queries, rng):
+    started = time.perf_counter()
+    index = TrigramIndex.from_markets(markets)
+    build_s = time.perf_counter() - started
+
+    timings, hits = [], 0
+    for query in queries:
+        started = time.perf_counter()
+        results = index.search(query, limit=20)
+        timings.append(time.perf_counter() - started)
+        hits += bool(results)
+
+    state_timings = []
+    for query in queries[:100]:
+        started = time.perf_counter()
+        index.search(query, limit=20, state='CA', lat=37.77, lng=-122.42, radius_miles=100)
+        state_timings.append(time.perf_counter() - started)
+
+    print(f"\n{label}: {len(index)} markets, {len(index.vocab)} trigrams, built in {build_s:.2f}s")
+    print(f"  text only     p50 {percentile(timings, 50):.2f}ms  p95 {percentile(timings, 95):.2f}ms  "
+          f"p99 {percentile(timings, 99):.2f}ms  hit rate {hits / len(queries):.0%}")
+    print(f"  state+radius  p50 {percentile(state_timings, 50):.2f}ms  p95 {percentile(state_timings, 95):.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', help='CSV file to load instead of the markets collection')
+    parser.add_argument('--scale', type=int, default=100, help='synthetic copies of the dataset (default 100)')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    markets = load_markets(args.csv)
+    if not markets:
+        print("No markets to benchmark")
+        return
+
+    sources = [m.get('market_name') or m.get('market_address') for m in markets]
+    sources = [s for s in sources if isinstance(s, str) and s]
+    queries = [misspell(rng.choice(sources), rng) for _ in range(args.queries)]
+
+    run(markets, 'full dataset', queries, rng)
+    if args.scale > 1:
+        run(scale_markets(markets, args.scale, rng), f'{args.scale}x synthetic', queries, rng)
+
+if __name__ == '__main__':
+    main()
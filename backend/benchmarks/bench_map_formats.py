@@ -0,0 +1,102 @@
+"""
+Payload size and client parse time of the map response formats.
+
+The same synthetic markets (generate_markets.py, put through the import
+path) are encoded as each endpoint would send them:
+
+    json-search   full documents, as /api/markets/search returns them
+    json-list     LIST_FIELDS documents, as /api/markets returns them
+    geojson       format=geojson
+    compact       format=compact
+
+Sizes are raw and gzipped (the level a proxy typically uses). Parse time
+is json.loads plus turning the result into (id, lng, lat) rows, which is
+what a map layer does with it.
+
+    python backend/benchmarks/bench_map_formats.py
+    python backend/benchmarks/bench_map_formats.py --counts 100 500 5000
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from itertools import accumulate
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from generate_markets import generate_records  # noqa: E402
+from map_formats import MAP_COORDINATE_PRECISION, to_compact, to_geojson  # noqa: E402
+from market_fields import add_derived_fields  # noqa: E402
+from market_schema import LIST_FIELDS, canonicalize_market  # noqa: E402
+
+def load_markets(count, seed):
+    markets = []
+    for i, record in enumerate(generate_records(count, seed)):
+        record['_id'] = str(ObjectId(f"{seed:08x}{i:016x}"[-24:]))
+        markets.append(canonicalize_market(record))
+    return add_derived_fields(markets)
+
+def encode(payload):
+    # Flask's jsonify outside debug mode: compact separators, sorted keys
+    return json.dumps(payload, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+def points_from_documents(body):
+    return [(market.get('_id', market.get('USDA_listing_id')), market.get('longitude'), market.get('latitude'))
+            for market in json.loads(body)['markets']]
+
+def points_from_geojson(body):
+    return [(feature['id'], *feature['geometry']['coordinates']) for feature in json.loads(body)['features']]
+
+def points_from_compact(body):
+    payload = json.loads(body)
+    scale = 10 ** payload['precision']
+    columns = payload['markets']
+    lngs = [value / scale for value in accumulate(columns['lng'])]
+    lats = [value / scale for value in accumulate(columns['lat'])]
+    return list(zip(columns['id'], lngs, lats))
+
+def parse_ms(parse, body, min_seconds=0.2):
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        parse(body)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return elapsed / runs * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', type=int, nargs='+', default=[500, 5000])
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    for count in args.counts:
+        markets = load_markets(count, args.seed)
+        listed = [{field: market[field] for field in LIST_FIELDS if field in market} for market in markets]
+        bodies = {
+            'json-search': (encode({'success': True, 'count': count, 'markets': markets}), points_from_documents),
+            'json-list': (encode({'success': True, 'count': count, 'markets': listed}), points_from_documents),
+            'geojson': (encode({'success': True, 'count': count, **to_geojson(markets)}), points_from_geojson),
+            'compact': (encode({'success': True, 'count': count, 'format': 'compact',
+                                'precision': MAP_COORDINATE_PRECISION, 'markets': to_compact(markets)}),
+                        points_from_compact),
+        }
+        # The map formats must give back the same positions, to the quantisation step
+        expected = points_from_geojson(bodies['geojson'][0])
+        for (market_id, lng, lat), (got_id, got_lng, got_lat) in zip(expected, points_from_compact(bodies['compact'][0])):
+            assert market_id == got_id and abs(lng - got_lng) < 1e-5 and abs(lat - got_lat) < 1e-5
+
+        baseline = len(bodies['json-search'][0])
+        print(f"\n{count} markets")
+        for label, (body, parse) in bodies.items():
+            zipped = len(gzip.compress(body, compresslevel=6))
+            print(f"  {label:<12} {len(body) / 1024:9.1f} KB ({len(body) / baseline:6.1%})  "
+                  f"gzip {zipped / 1024:8.1f} KB  parse {parse_ms(parse, body):7.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Memory and speed of holding markets in-process as dicts vs MarketStore.
+
+For each scale the same synthetic markets (generate_markets.py, put
+through the import path) are held three ways:
+
+    documents   full pymongo-style dicts, as find() returns them
+    projected   dicts with only the list fields (LIST_PROJECTION)
+    store       market_store.MarketStore
+
+Memory is what tracemalloc sees retained after building, including the
+{id: document} index a dict cache needs for lookups. Lookup and
+serialization times are for random ids and 20-market pages.
+
+    python backend/benchmarks/bench_market_store.py                 # 10k and 1M
+    python backend/benchmarks/bench_market_store.py --scales 10000 100000
+
+1M full documents need about 3 GB of RAM; pass --skip-documents to leave
+that representation out.
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from generate_markets import generate_records  # noqa: E402
+from market_fields import add_derived_fields  # noqa: E402
+from market_schema import LIST_FIELDS, canonicalize_market  # noqa: E402
+from market_store import MarketStore  # noqa: E402
+
+PAGE_SIZE = 20
+
+def iter_markets(count, seed=42, batch_size=5000):
+    """Markets as the importer stores them, with deterministic ObjectIds"""
+    batch = []
+    for i, record in enumerate(generate_records(count, seed)):
+        record['_id'] = ObjectId(f"{seed:08x}{i:016x}"[-24:])
+        batch.append(canonicalize_market(record))
+        if len(batch) >= batch_size:
+            yield from add_derived_fields(batch)
+            batch = []
+    yield from add_derived_fields(batch)
+
+def measure(build):
+    """(result, retained bytes, build seconds)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, retained, elapsed
+
+def per_call_us(fn, args):
+    started = time.perf_counter()
+    for arg in args:
+        fn(arg)
+    return (time.perf_counter() - started) / len(args) * 1e6
+
+def bench_dicts(label, count, seed, project, ids, pages):
+    def build():
+        markets = []
+        index = {}
+        for market in iter_markets(count, seed):
+            key = str(market['_id'])
+            if project:
+                market = {field: market[field] for field in LIST_FIELDS if field in market}
+            else:
+                market['_id'] = key
+            markets.append(market)
+            index[key] = market
+        return markets, index
+
+    (markets, index), retained, elapsed = measure(build)
+    lookup = per_call_us(index.get, ids)
+    page = per_call_us(lambda start: json.dumps(markets[start:start + PAGE_SIZE]).encode('utf-8'), pages)
+    report(label, count, retained, elapsed, lookup, page)
+
+def bench_store(count, seed, ids, pages):
+    store, retained, elapsed = measure(lambda: MarketStore.from_markets(iter_markets(count, seed)))
+    lookup = per_call_us(store.row_of, ids)
+    page = per_call_us(lambda start: store.json_rows(range(start, min(start + PAGE_SIZE, count))), pages)
+    report('store', count, retained, elapsed, lookup, page)
+    return store
+
+def report(label, count, retained, elapsed, lookup_us, page_us):
+    print(f"  {label:<10} {retained / 1e6:9.1f} MB  {retained / count:7.0f} B/market  "
+          f"build {elapsed:6.1f}s  lookup {lookup_us:6.2f}us  page {page_us:7.1f}us")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 1000000])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--skip-documents', action='store_true', help='do not hold full documents')
+    args = parser.parse_args()
+
+    for count in args.scales:
+        rng = random.Random(args.seed)
+        ids = [f"{args.seed:08x}{rng.randrange(count):016x}"[-24:] for _ in range(args.lookups)]
+        pages = [rng.randrange(max(1, count - PAGE_SIZE)) for _ in range(1000)]
+        print(f"\n{count} markets")
+        if not args.skip_documents:
+            bench_dicts('documents', count, args.seed, False, ids, pages)
+            gc.collect()
+        bench_dicts('projected', count, args.seed, True, ids, pages)
+        gc.collect()
+        store = bench_store(count, args.seed, ids, pages)
+        # Same answers as the dicts would give
+        for market in itertools.islice(iter_markets(count, args.seed), 100):
+            row = store.row_of(str(market['_id']))
+            expected = {field: market[field] for field in LIST_FIELDS if field in market}
+            got = store.document(row)
+            assert got == expected, (got, expected)
+        del store
+        gc.collect()
+
+if __name__ == '__main__':
+    main()
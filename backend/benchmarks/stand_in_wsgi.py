@@ -0,0 +1,18 @@
+"""
+WSGI entry point that serves the app from a seeded in-memory database.
+
+bench_api.py --stand-in runs it under gunicorn with --preload, so the
+synthetic dataset is built once in the master and shared by the workers.
+BENCH_SCALE and BENCH_SEED pick the dataset.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as app_module  # noqa: E402
+from bench_api import use_stand_in  # noqa: E402
+
+use_stand_in(app_module, int(os.getenv('BENCH_SCALE', 10000)), int(os.getenv('BENCH_SEED', 42)))
+app = app_module.app
@@ -1,7 +1,16 @@
 import pandas as pd
-from pymongo import MongoClient, GEOSPHERE
+from pymongo import MongoClient
 import os
 from dotenv import load_dotenv
+from market_fields import add_derived_fields
+from market_schema import canonicalize_market
+from indexes import reconcile_indexes
+from market_cache import bump_dataset_version
+from profiling import profile_job
+from nearby import rebuild_nearby
+from rollups import rebuild_rollups
+from snapshot import refresh_snapshot
+from viewport import rebuild_clusters
 
 # Load environment variables
 load_dotenv()
@@ -30,8 +39,11 @@ def prepare_data():
             axis=1
         )
         
-        # Convert DataFrame to list of dictionaries
-        markets = df.to_dict('records')
+        # Convert DataFrame to list of dictionaries in the canonical schema
+        markets = [canonicalize_market(record) for record in df.to_dict('records')]
+        
+        # Precompute place_id, image_url and has_image once at import
+        add_derived_fields(markets)
         print(f"Prepared {len(markets)} markets for import")
         return markets
         
@@ -62,9 +74,14 @@ def import_to_mongodb():
         # Insert data
         if markets:
             collection.insert_many(markets)
+            bump_dataset_version(db)
             
-            # Create geospatial index for location-based searches
-            collection.create_index([("location", GEOSPHERE)])
+            # Create the declared index set (includes the 2dsphere index)
+            reconcile_indexes(db)
+            rebuild_clusters(db)
+            rebuild_nearby(db)
+            rebuild_rollups(db)
+            refresh_snapshot(db)
             print(f"Successfully imported {len(markets)} markets to MongoDB Atlas")
         else:
             print("No data to import")
@@ -75,4 +92,5 @@ def import_to_mongodb():
         client.close()
 
 if __name__ == "__main__":
-    import_to_mongodb() 
\ No newline at end of file
+    with profile_job('clean_data'):
+        import_to_mongodb() 
\ No newline at end of file
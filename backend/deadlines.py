@@ -0,0 +1,84 @@
+"""
+Time budgets for API requests.
+
+Every request to the `api` blueprint runs inside pymongo.timeout() with
+REQUEST_TIME_BUDGET_MS, so each query, cursor batch and aggregation gets
+maxTimeMS set to whatever is left of the budget, and server selection and
+socket reads stop waiting at the same deadline. When the budget runs out
+the request gets a 503 with Retry-After instead of holding the worker
+until gunicorn kills it. Keep the budget below gunicorn's --timeout (30s).
+
+A client can ask for a shorter budget with X-Request-Budget-Ms.
+client_timeouts() bounds operations outside requests (scripts, cache
+builds) through the MongoClient options.
+
+pymongo.timeout() needs pymongo 4.2 or later. On older installs requests
+run without a budget and only the MongoClient timeouts apply.
+"""
+import os
+import sys
+
+import pymongo
+from flask import g, jsonify, request
+from pymongo.errors import ExecutionTimeout, NetworkTimeout, ServerSelectionTimeoutError, WTimeoutError
+
+from metrics import Counter, REGISTRY
+
+REQUEST_TIME_BUDGET_MS = int(os.getenv('REQUEST_TIME_BUDGET_MS', 10000))
+RETRY_AFTER_SECONDS = int(os.getenv('REQUEST_RETRY_AFTER_SECONDS', 5))
+
+# Raised by pymongo when a deadline passes (or no server can be reached in time).
+# Handlers re-raise these from their generic `except Exception` so the 503 handler sees them.
+TIMEOUT_ERRORS = (ExecutionTimeout, NetworkTimeout, ServerSelectionTimeoutError, WTimeoutError)
+
+REQUEST_TIMEOUTS = Counter(
+    'http_request_timeouts_total', 'Requests that ran out of time budget', ('route', 'error'))
+REGISTRY.append(REQUEST_TIMEOUTS)
+
+def client_timeouts():
+    """Timeout options for MongoClient"""
+    return {
+        'serverSelectionTimeoutMS': int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        'connectTimeoutMS': int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 5000)),
+        'socketTimeoutMS': int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', 20000)),
+    }
+
+def request_budget_ms():
+    budget = REQUEST_TIME_BUDGET_MS
+    requested = request.headers.get('X-Request-Budget-Ms', type=int)
+    if requested is not None and 0 < requested < budget:
+        budget = requested
+    return budget
+
+def init_deadlines(app):
+    """Apply the time budget to api blueprint requests and turn expiry into a 503"""
+
+    @app.before_request
+    def start_deadline():
+        if request.blueprint == 'api' and REQUEST_TIME_BUDGET_MS > 0 and hasattr(pymongo, 'timeout'):
+            deadline = pymongo.timeout(request_budget_ms() / 1000)
+            deadline.__enter__()
+            g.deadline = deadline
+
+    @app.teardown_request
+    def end_deadline(exc):
+        deadline = g.pop('deadline', None)
+        if deadline is not None:
+            deadline.__exit__(None, None, None)
+
+    @app.errorhandler(ExecutionTimeout)
+    @app.errorhandler(NetworkTimeout)
+    @app.errorhandler(ServerSelectionTimeoutError)
+    @app.errorhandler(WTimeoutError)
+    def timed_out(e):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_TIMEOUTS.inc(route, type(e).__name__)
+        print(f"Request {request.full_path} timed out: {type(e).__name__}: {str(e)[:200]}", file=sys.stderr)
+        response = jsonify({
+            'success': False,
+            'error': 'Request timed out',
+            'message': 'The server is busy. Please try again shortly.'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return response
@@ -0,0 +1,281 @@
+"""
+Duplicate market detection and merging.
+
+The USDA exports and the several loaders have left the same market in the
+collection more than once, under different _ids and sometimes with
+different fields filled in. find_duplicates() proposes merges in three
+steps.
+
+Blocking. Two markets are compared only if one of these holds:
+  - they share a USDA_listing_id (such pairs count as duplicates outright);
+  - they lie within DEDUP_MAX_MILES of each other and are in the same
+    state, found with the grid of nearby.PointIndex;
+  - neither has a position and they share state and ZIP code (blocks
+    larger than DEDUP_MAX_BLOCK are skipped). With nothing else to go on,
+    such pairs must have matching streets too: two markets named
+    "Farmers Market" in one ZIP code are more often two markets.
+
+Scoring. Names and addresses become DEDUP_SIGNATURE_BITS-bit sets of
+hashed trigrams (the trigrams fuzzy search uses). A batch of pairs is
+scored at once as the Jaccard similarity of their bit sets:
+
+    score = NAME_WEIGHT * name similarity + (1 - NAME_WEIGHT) * address similarity
+
+Addresses are compared up to the first comma (the street): markets close
+enough to be blocked together share the rest of their address anyway. When either
+market lacks an address, the name similarity is the score.
+Pairs scoring at least DEDUP_MIN_SCORE are duplicates, except unplaced
+pairs whose streets are missing or less similar than DEDUP_MIN_SCORE.
+
+Merging. Duplicates are grouped transitively. Each group keeps its most
+complete market, ties going to the oldest _id. The kept market gets any
+field it lacks from the others and lists their _ids (and those they had
+merged themselves) in merged_ids, where GET /api/markets/<id> finds them.
+apply_merges() writes the decisions with batched bulk_write calls.
+scripts/dedup_markets.py runs all of this, and
+benchmarks/bench_dedup.py measures throughput and accuracy on synthetic
+markets with planted duplicates.
+"""
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+from pymongo import DeleteMany, UpdateOne
+
+from attribute_index import POPCOUNT
+from fuzzy_search import trigrams
+from nearby import PointIndex, chord_for_miles, unit_vectors
+
+DEDUP_MAX_MILES = float(os.getenv('DEDUP_MAX_MILES', 0.25))
+DEDUP_MIN_SCORE = float(os.getenv('DEDUP_MIN_SCORE', 0.75))
+DEDUP_MAX_BLOCK = int(os.getenv('DEDUP_MAX_BLOCK', 500))
+DEDUP_SIGNATURE_BITS = 256
+NAME_WEIGHT = 0.6
+
+# What blocking and scoring read; merging fetches the whole documents
+DEDUP_PROJECTION = {'market_name': 1, 'market_address': 1, 'state': 1, 'zipCode': 1,
+                    'USDA_listing_id': 1, 'latitude': 1, 'longitude': 1}
+
+def _filled(value):
+    return value is not None and value != '' and value != [] and value != {}
+
+def signatures(texts, bits=DEDUP_SIGNATURE_BITS):
+    """Trigram bit sets of texts as a len(texts) x bits/8 uint8 matrix"""
+    rows, positions = [], []
+    cache = {}
+    for row, text in enumerate(texts):
+        hashed = cache.get(text)
+        if hashed is None:
+            # crc32 is stable across processes, unlike hash() on str
+            hashed = [zlib.crc32(gram.encode('utf-8')) % bits for gram in trigrams(text)]
+            cache[text] = hashed
+        rows.extend([row] * len(hashed))
+        positions.extend(hashed)
+    matrix = np.zeros((len(texts), bits // 8), dtype=np.uint8)
+    positions = np.asarray(positions, dtype=np.int64)
+    np.bitwise_or.at(matrix, (np.asarray(rows, dtype=np.int64), positions // 8),
+                     (1 << (7 - positions % 8)).astype(np.uint8))
+    return matrix
+
+def similarity(matrix, a, b):
+    """Jaccard similarity of the bit sets in rows a and b (arrays of equal length)"""
+    left, right = matrix[a], matrix[b]
+    shared = POPCOUNT[left & right].sum(axis=1, dtype=np.int32)
+    either = POPCOUNT[left | right].sum(axis=1, dtype=np.int32)
+    return np.divide(shared, either, out=np.zeros(len(a)), where=either > 0)
+
+def _pairs_within_groups(keys, max_block=None):
+    """(a, b) row pairs, a < b, of rows that share a key; None keys never match"""
+    groups = {}
+    for row, key in enumerate(keys):
+        if key is not None:
+            groups.setdefault(key, []).append(row)
+    firsts, seconds = [], []
+    skipped = 0
+    for rows in groups.values():
+        if len(rows) < 2:
+            continue
+        if max_block is not None and len(rows) > max_block:
+            skipped += 1
+            continue
+        i, j = np.triu_indices(len(rows), k=1)
+        rows = np.asarray(rows, dtype=np.int64)
+        firsts.append(rows[i])
+        seconds.append(rows[j])
+    if skipped:
+        print(f"Warning: skipped {skipped} blocks larger than {max_block} markets", file=sys.stderr)
+    if not firsts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+def candidate_pairs(markets, max_miles=DEDUP_MAX_MILES, max_block=DEDUP_MAX_BLOCK):
+    """(a, b, same listing, unplaced) arrays of the row pairs worth scoring, a < b, each pair once"""
+    count = len(markets)
+    states = [market.get('state') for market in markets]
+
+    # Same listing id
+    listing_a, listing_b = _pairs_within_groups([market.get('USDA_listing_id') or None for market in markets],
+                                                max_block)
+
+    # Close together and not in different states
+    positioned = np.array([isinstance(market.get('latitude'), (int, float))
+                           and isinstance(market.get('longitude'), (int, float)) for market in markets], dtype=bool)
+    rows = np.flatnonzero(positioned)
+    if len(rows) > 1:
+        max_chord = chord_for_miles(max_miles)
+        # One radius per grid cell, so every close pair is in neighbouring cells
+        index = PointIndex(unit_vectors([markets[row]['latitude'] for row in rows],
+                                        [markets[row]['longitude'] for row in rows]), cell_size=max_chord)
+        near_a, near_b = index.pairs_within(max_chord)
+        near_a, near_b = rows[near_a], rows[near_b]
+        state_codes = {state: code for code, state in enumerate(sorted({s for s in states if s}), start=1)}
+        codes = np.array([state_codes.get(state, 0) for state in states], dtype=np.int32)
+        compatible = (codes[near_a] == codes[near_b]) | (codes[near_a] == 0) | (codes[near_b] == 0)
+        near_a, near_b = near_a[compatible], near_b[compatible]
+    else:
+        near_a = near_b = np.empty(0, dtype=np.int64)
+
+    # No position: same state and ZIP code
+    unplaced_a, unplaced_b = _pairs_within_groups(
+        [None if positioned[row] or not market.get('zipCode') else (market.get('state'), market['zipCode'])
+         for row, market in enumerate(markets)], max_block)
+
+    a = np.concatenate([listing_a, near_a, unplaced_a])
+    b = np.concatenate([listing_b, near_b, unplaced_b])
+    low, high = np.minimum(a, b), np.maximum(a, b)
+    pair_keys, first = np.unique(low * count + high, return_index=True)
+    same_listing = np.zeros(len(a), dtype=bool)
+    same_listing[:len(listing_a)] = True
+    unplaced = np.zeros(len(a), dtype=bool)
+    unplaced[len(listing_a) + len(near_a):] = True
+    return pair_keys // count, pair_keys % count, same_listing[first], unplaced[first]
+
+def street(address):
+    """The part of an address before the city, which tells neighbouring markets apart"""
+    return address.split(',')[0] if isinstance(address, str) else ''
+
+def market_signatures(markets):
+    """(name bit sets, street bit sets, whether each market has a street)"""
+    streets = [street(market.get('market_address')) for market in markets]
+    return (signatures([market.get('market_name') or '' for market in markets]), signatures(streets),
+            np.array([bool(text.strip()) for text in streets], dtype=bool))
+
+def score_pairs(signed, a, b, batch_size=65536):
+    """Duplicate score of each (a[i], b[i]) pair from market_signatures(), batch_size pairs at a time"""
+    names, addresses, has_address = signed
+    scores = np.empty(len(a), dtype=np.float64)
+    for start in range(0, len(a), batch_size):
+        left, right = a[start:start + batch_size], b[start:start + batch_size]
+        name = similarity(names, left, right)
+        address = similarity(addresses, left, right)
+        both = has_address[left] & has_address[right]
+        scores[start:start + batch_size] = np.where(both, NAME_WEIGHT * name + (1 - NAME_WEIGHT) * address, name)
+    return scores
+
+def connected_groups(count, a, b):
+    """Label of each row's group when pairs (a, b) join rows; a label is the group's smallest row"""
+    labels = np.arange(count)
+    while len(a):
+        low = np.minimum(labels[a], labels[b])
+        before = labels.copy()
+        np.minimum.at(labels, a, low)
+        np.minimum.at(labels, b, low)
+        # Pointer jumping: follow labels to their own labels
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, before):
+            break
+    return labels
+
+def find_duplicates(markets, min_score=DEDUP_MIN_SCORE, max_miles=DEDUP_MAX_MILES):
+    """Groups of duplicate rows among markets: a list of (rows, lowest pair score), rows in input order"""
+    a, b, same_listing, unplaced = candidate_pairs(markets, max_miles)
+    signed = market_signatures(markets)
+    scores = score_pairs(signed, a, b)
+    # Without positions, a name alone is not enough: the streets have to match
+    _, streets, has_street = signed
+    unplaced = np.flatnonzero(unplaced)
+    street_match = has_street[a[unplaced]] & has_street[b[unplaced]] & \
+        (similarity(streets, a[unplaced], b[unplaced]) >= min_score)
+    scores[unplaced[~street_match]] = 0.0
+    scores[same_listing] = 1.0
+    duplicate = scores >= min_score
+    a, b, scores = a[duplicate], b[duplicate], scores[duplicate]
+    labels = connected_groups(len(markets), a, b)
+    grouped = np.flatnonzero(labels != np.arange(len(markets)))
+    members = {}
+    for row in grouped.tolist():
+        members.setdefault(int(labels[row]), [int(labels[row])]).append(row)
+    lowest = {}
+    for label, score in zip(labels[a].tolist(), scores.tolist()):
+        lowest[label] = min(lowest.get(label, 1.0), score)
+    return [(rows, lowest[label]) for label, rows in sorted(members.items())]
+
+def merge_decision(documents, score):
+    """Which of a group's documents to keep, the fields it gains, and the _ids to remove"""
+    documents = sorted(documents, key=lambda document: str(document['_id']))
+    keep = max(documents, key=lambda document: sum(_filled(value) for value in document.values()))
+    gained = {}
+    for document in documents:
+        if document is keep:
+            continue
+        for field, value in document.items():
+            if field not in ('_id', 'merged_ids') and _filled(value) and not _filled(keep.get(field)):
+                gained.setdefault(field, value)
+    # has_image is always filled, so it has to follow a gained image_url
+    if gained.get('image_url'):
+        gained['has_image'] = True
+    removed = [document for document in documents if document is not keep]
+    return {
+        'keep': keep['_id'],
+        'remove': [document['_id'] for document in removed],
+        # Earlier merges into a removed market carry over, so their ids still resolve
+        'merged_ids': [str(document['_id']) for document in removed] +
+                      [merged_id for document in removed for merged_id in document.get('merged_ids') or []],
+        'set': gained,
+        'score': round(score, 3),
+    }
+
+def plan_merges(db, min_score=DEDUP_MIN_SCORE, max_miles=DEDUP_MAX_MILES, batch_size=5000):
+    """Merge decisions for the markets collection, without changing it"""
+    started = time.time()
+    markets = list(db.markets.find({}, DEDUP_PROJECTION).sort('_id', 1))
+    groups = find_duplicates(markets, min_score, max_miles)
+    print(f"Found {len(groups)} duplicate groups covering {sum(len(rows) for rows, _ in groups)} "
+          f"of {len(markets)} markets in {time.time() - started:.1f}s", file=sys.stderr)
+
+    decisions = []
+    for start in range(0, len(groups), batch_size):
+        batch = groups[start:start + batch_size]
+        ids = [markets[row]['_id'] for rows, _ in batch for row in rows]
+        documents = {document['_id']: document for document in db.markets.find({'_id': {'$in': ids}})}
+        for rows, score in batch:
+            found = [documents[markets[row]['_id']] for row in rows if markets[row]['_id'] in documents]
+            if len(found) > 1:
+                decisions.append(merge_decision(found, score))
+    return decisions
+
+def apply_merges(db, decisions, batch_size=1000):
+    """Write merge decisions: fill and annotate the kept markets, delete the rest"""
+    merged = removed = 0
+    operations = []
+    for decision in decisions:
+        update = {'$addToSet': {'merged_ids': {'$each': decision['merged_ids']}}}
+        if decision['set']:
+            update['$set'] = decision['set']
+        operations.append(UpdateOne({'_id': decision['keep']}, update))
+        operations.append(DeleteMany({'_id': {'$in': decision['remove']}}))
+        if len(operations) >= batch_size:
+            result = db.markets.bulk_write(operations, ordered=False)
+            merged, removed = merged + result.modified_count, removed + result.deleted_count
+            operations = []
+    if operations:
+        result = db.markets.bulk_write(operations, ordered=False)
+        merged, removed = merged + result.modified_count, removed + result.deleted_count
+    print(f"Merged {merged} markets, removed {removed} duplicates", file=sys.stderr)
+    return merged, removed
@@ -0,0 +1,117 @@
+"""
+Facet counts for the search filter sidebar.
+
+GET /api/markets/search?...&facets=state,has_image adds result counts per
+value of each listed field next to the results:
+
+    "facets": {"state": [{"value": "CA", "count": 812}, ...],
+               "has_image": [{"value": true, "count": 530}, ...]}
+
+Counts honour every search constraint (q, lat/lng/radius and the
+filters) except the facet's own filter. The state facet ignores ?state=,
+so the sidebar can still show how many results picking another state
+would give. Each facet lists its FACET_LIMIT most common values, and
+rating is counted in whole stars.
+
+Against MongoDB all facets come from one $facet aggregation; from a
+snapshot they are bincounts over the matching rows. Fuzzy search counts
+the matches it returns.
+"""
+import math
+import os
+
+import numpy as np
+
+FACET_LIMIT = int(os.getenv('FACET_LIMIT', 20))
+
+# Facet -> the field it counts and the search filter it ignores
+FACETS = {
+    'state': {'field': 'state', 'filter': 'state'},
+    'city': {'field': 'city', 'filter': None},
+    'has_image': {'field': 'has_image', 'filter': 'with_images'},
+    'rating': {'field': 'rating', 'filter': None},
+}
+
+def parse_facets(value):
+    """'state,city' -> ['state', 'city']; ValueError for a facet that does not exist"""
+    names = [name.strip() for name in (value or '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise ValueError(f"Unknown facet {', '.join(unknown)}; choose from {', '.join(FACETS)}")
+    return list(dict.fromkeys(names))
+
+def _bucket(name, value):
+    if name == 'rating' and isinstance(value, (int, float)):
+        return math.floor(value)
+    return value
+
+def _top(counts, limit):
+    """{value: count} -> the limit most common values, missing values dropped"""
+    entries = [(value, count) for value, count in counts.items() if value is not None]
+    entries.sort(key=lambda entry: (-entry[1], str(entry[0])))
+    return [{'value': value, 'count': count} for value, count in entries[:limit]]
+
+def _group_key(name, key):
+    if name == 'rating':
+        return {'$cond': [{'$isNumber': key}, {'$floor': key}, None]}
+    return key
+
+def facet_pipeline(base_stages, filters, names, limit=FACET_LIMIT):
+    """Aggregation computing every facet in one $facet stage.
+
+    base_stages select the search results without the sidebar filters;
+    filters maps a filter name ('state', 'with_images') to its $match clause.
+    """
+    facets = {}
+    for name in names:
+        match = {}
+        for filter_name, clause in filters.items():
+            if filter_name != FACETS[name]['filter']:
+                match.update(clause)
+        key = f"${FACETS[name]['field']}"
+        facets[name] = [
+            {'$match': match},
+            {'$group': {'_id': _group_key(name, key), 'count': {'$sum': 1}}},
+            {'$match': {'_id': {'$ne': None}}},
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$limit': limit},
+        ]
+    return list(base_stages) + [{'$facet': facets}]
+
+def mongo_facets(collection, base_stages, filters, names, limit=FACET_LIMIT):
+    if not names:
+        return {}
+    result = next(collection.aggregate(facet_pipeline(base_stages, filters, names, limit)), {})
+    return {name: [{'value': entry['_id'], 'count': entry['count']} for entry in result.get(name, [])]
+            for name in names}
+
+def snapshot_facets(snapshot, rows, filters, names, limit=FACET_LIMIT):
+    """Facets over snapshot rows; filters maps a filter name to a boolean mask over all rows"""
+    result = {}
+    for name in names:
+        selected = rows
+        for filter_name, mask in filters.items():
+            if filter_name != FACETS[name]['filter']:
+                selected = selected[mask[selected]]
+        counts = {}
+        for entry in snapshot.value_counts(FACETS[name]['field'], selected):
+            value = _bucket(name, entry['_id'])
+            counts[value] = counts.get(value, 0) + entry['count']
+        result[name] = _top(counts, limit)
+    return result
+
+def document_facets(documents, names, limit=FACET_LIMIT):
+    """Facets over documents already in hand (the fuzzy search matches)"""
+    result = {}
+    for name in names:
+        counts = {}
+        for document in documents:
+            value = _bucket(name, document.get(FACETS[name]['field']))
+            counts[value] = counts.get(value, 0) + 1
+        result[name] = _top(counts, limit)
+    return result
+
+def mask_of(rows, count):
+    mask = np.zeros(count, dtype=bool)
+    mask[rows] = True
+    return mask
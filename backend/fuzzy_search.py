@@ -0,0 +1,168 @@
+"""
+Typo-tolerant market search over an in-memory trigram inverted index.
+
+Market names and addresses are split into padded word trigrams (the
+scheme pg_trgm uses). Each trigram maps to a sorted array of market rows.
+Only the postings of the rarest query trigrams are scanned for candidates
+(a market sharing none of them cannot reach the minimum score), then the
+candidates are counted against every query trigram with np.searchsorted.
+
+The score is the share of the query's trigrams found in the name or the
+address, whichever is higher, so "farmer's markt" still matches "Farmers
+Market" and a misspelled town still matches the address.
+"""
+import numpy as np
+
+from autocomplete import normalize
+from market_cache import DatasetCache
+
+EARTH_RADIUS_MILES = 3958.8
+DEFAULT_MIN_SCORE = 0.45
+MAX_RESULTS = 200
+# Above 1/DENSE_FRACTION of all rows as candidates, count trigrams with bincount
+DENSE_FRACTION = 8
+
+def trigrams(text):
+    """Padded word trigrams of normalized text"""
+    grams = set()
+    for word in normalize(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def haversine_miles(lat, lng, lats, lngs):
+    """Vectorised great-circle distance from one point to arrays of points"""
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class _Postings:
+    """Compressed trigram -> rows postings (CSR layout, rows sorted per trigram)"""
+
+    def __init__(self, texts, vocab):
+        # Names and addresses repeat a lot, so trigrams are computed once per distinct text
+        cache = {}
+        per_row = []
+        for text in texts:
+            grams = cache.get(text)
+            if grams is None:
+                grams = np.array([vocab.setdefault(g, len(vocab)) for g in trigrams(text)], dtype=np.int32)
+                cache[text] = grams
+            per_row.append(grams)
+        self.counts = np.fromiter((len(g) for g in per_row), dtype=np.int32, count=len(per_row))
+        self._gram_ids = np.concatenate(per_row) if per_row else np.zeros(0, dtype=np.int32)
+        self._rows = np.repeat(np.arange(len(per_row), dtype=np.int32), self.counts)
+
+    def freeze(self, vocab_size):
+        order = np.argsort(self._gram_ids, kind='stable')
+        self.rows = self._rows[order]
+        self.offsets = np.zeros(vocab_size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self._gram_ids, minlength=vocab_size), out=self.offsets[1:])
+        del self._gram_ids, self._rows
+
+    def postings(self, gram_id):
+        return self.rows[self.offsets[gram_id]:self.offsets[gram_id + 1]]
+
+    def candidates(self, gram_ids, need):
+        """
+        Rows that can share at least `need` of the given trigrams.
+
+        A row missing every one of the (len - need + 1) rarest trigrams can
+        share at most need - 1, so only those postings are scanned.
+        """
+        if need > len(gram_ids):
+            return np.zeros(0, dtype=np.int32)
+        rarest = sorted(gram_ids, key=lambda g: self.offsets[g + 1] - self.offsets[g])
+        return np.unique(np.concatenate([self.postings(g) for g in rarest[:len(gram_ids) - need + 1]]))
+
+    def shared(self, gram_ids, rows, n_rows):
+        """Number of the given trigrams each of `rows` (sorted) contains"""
+        if len(rows) > n_rows // DENSE_FRACTION:
+            # Most rows are candidates: one bincount over the postings is cheaper
+            # than a binary search per trigram
+            hits = np.concatenate([self.postings(g) for g in gram_ids])
+            return np.bincount(hits, minlength=n_rows)[rows]
+        counts = np.zeros(len(rows), dtype=np.int32)
+        for gram_id in gram_ids:
+            postings = self.postings(gram_id)
+            if not len(postings):
+                continue
+            positions = np.minimum(np.searchsorted(postings, rows), len(postings) - 1)
+            counts += postings[positions] == rows
+        return counts
+
+class TrigramIndex:
+    """Trigram index over market names and addresses with optional state/radius filters"""
+
+    def __init__(self, ids, names, addresses, states, lats, lngs):
+        self.ids = list(ids)
+        self.states = np.array([s or '' for s in states], dtype=object)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.vocab = {}
+        self.names = _Postings(names, self.vocab)
+        self.addresses = _Postings(addresses, self.vocab)
+        self.names.freeze(len(self.vocab))
+        self.addresses.freeze(len(self.vocab))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_markets(cls, markets):
+        ids, names, addresses, states, lats, lngs = [], [], [], [], [], []
+        for market in markets:
+            ids.append(market['_id'])
+            names.append(market.get('market_name', ''))
+            addresses.append(market.get('market_address', ''))
+            states.append(market.get('state', ''))
+            lats.append(market.get('latitude', np.nan))
+            lngs.append(market.get('longitude', np.nan))
+        return cls(ids, names, addresses, states, lats, lngs)
+
+    def search(self, query, limit=50, min_score=DEFAULT_MIN_SCORE,
+               state=None, lat=None, lng=None, radius_miles=None):
+        """
+        Return a list of (id, score) pairs, best first.
+
+        score is the fraction of the query's trigrams present in the
+        market name or address (1.0 = every trigram matched).
+        """
+        query_grams = trigrams(query)
+        if not query_grams or not self.ids:
+            return []
+        gram_ids = [self.vocab[g] for g in query_grams if g in self.vocab]
+        need = max(1, int(np.ceil(min_score * len(query_grams) - 1e-9)))
+
+        rows = np.union1d(self.names.candidates(gram_ids, need), self.addresses.candidates(gram_ids, need))
+        if not len(rows):
+            return []
+        n_rows = len(self.ids)
+        shared = np.maximum(self.names.shared(gram_ids, rows, n_rows), self.addresses.shared(gram_ids, rows, n_rows))
+        scores = shared / len(query_grams)
+
+        mask = scores >= min_score
+        if state:
+            mask &= self.states[rows] == state.upper()
+        if lat is not None and lng is not None and radius_miles is not None:
+            distances = haversine_miles(lat, lng, self.lats[rows], self.lngs[rows])
+            mask &= distances <= radius_miles
+
+        rows, scores = rows[mask], scores[mask]
+        if not len(rows):
+            return []
+        limit = max(1, min(limit, MAX_RESULTS))
+        if len(rows) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            rows, scores = rows[top], scores[top]
+        # Best score first; shorter names win ties since they matched more tightly
+        order = np.lexsort((self.names.counts[rows], -scores))
+        return [(self.ids[row], float(score)) for row, score in zip(rows[order], scores[order])]
+
+def build_fuzzy_index(db):
+    """Build the trigram index from the markets collection"""
+    projection = {'market_name': 1, 'market_address': 1, 'state': 1, 'latitude': 1, 'longitude': 1}
+    return TrigramIndex.from_markets(db.markets.find({}, projection))
+
+fuzzy_cache = DatasetCache('fuzzy search', build_fuzzy_index)
@@ -0,0 +1,222 @@
+"""
+Generate a synthetic farmers market dataset for scale testing.
+
+Rows use the USDA export columns that load_csv.py and import_data.py read
+(listing_id, listing_name, location_address, location_x, location_y,
+update_time, ...). Markets are clustered around US population centres,
+weighted by metro population, with a rural share spread further out.
+Addresses come in the formats extract_state() has to cope with: "ST 12345",
+ZIP+4, full state names, a comma before the ZIP, no ZIP, and a few with no
+state at all. Rows are generated in vectorised chunks and streamed to disk,
+so a 10M-row file never has to fit in memory.
+
+    python backend/generate_markets.py --rows 1000000
+    python backend/generate_markets.py --rows 10000000 --output uploads/markets_10m.csv.gz
+    python backend/load_csv.py uploads/synthetic_markets.csv
+"""
+import argparse
+import csv
+import gzip
+import os
+import sys
+import time
+
+import numpy as np
+
+from market_fields import STATE_NAMES
+
+COLUMNS = ['listing_id', 'listing_name', 'location_address', 'location_x', 'location_y',
+           'update_time', 'phone_number', 'website', 'rating', 'google_maps_link']
+
+# city, state, latitude, longitude, metro population (millions), ZIP prefix
+POPULATION_CENTRES = [
+    ('New York', 'NY', 40.71, -74.01, 19.8, '100'), ('Los Angeles', 'CA', 34.05, -118.24, 13.2, '900'),
+    ('Chicago', 'IL', 41.88, -87.63, 9.5, '606'), ('Dallas', 'TX', 32.78, -96.80, 7.6, '752'),
+    ('Houston', 'TX', 29.76, -95.37, 7.1, '770'), ('Washington', 'DC', 38.91, -77.04, 6.3, '200'),
+    ('Philadelphia', 'PA', 39.95, -75.17, 6.2, '191'), ('Miami', 'FL', 25.76, -80.19, 6.1, '331'),
+    ('Atlanta', 'GA', 33.75, -84.39, 6.1, '303'), ('Boston', 'MA', 42.36, -71.06, 4.9, '021'),
+    ('Phoenix', 'AZ', 33.45, -112.07, 4.8, '850'), ('San Francisco', 'CA', 37.77, -122.42, 4.7, '941'),
+    ('Riverside', 'CA', 33.95, -117.40, 4.6, '925'), ('Detroit', 'MI', 42.33, -83.05, 4.4, '482'),
+    ('Seattle', 'WA', 47.61, -122.33, 4.0, '981'), ('Minneapolis', 'MN', 44.98, -93.27, 3.7, '554'),
+    ('San Diego', 'CA', 32.72, -117.16, 3.3, '921'), ('Tampa', 'FL', 27.95, -82.46, 3.2, '336'),
+    ('Denver', 'CO', 39.74, -104.99, 3.0, '802'), ('Baltimore', 'MD', 39.29, -76.61, 2.8, '212'),
+    ('St Louis', 'MO', 38.63, -90.20, 2.8, '631'), ('Charlotte', 'NC', 35.23, -80.84, 2.7, '282'),
+    ('Orlando', 'FL', 28.54, -81.38, 2.7, '328'), ('San Antonio', 'TX', 29.42, -98.49, 2.6, '782'),
+    ('Portland', 'OR', 45.52, -122.68, 2.5, '972'), ('Sacramento', 'CA', 38.58, -121.49, 2.4, '958'),
+    ('Pittsburgh', 'PA', 40.44, -79.99, 2.4, '152'), ('Austin', 'TX', 30.27, -97.74, 2.4, '787'),
+    ('Las Vegas', 'NV', 36.17, -115.14, 2.3, '891'), ('Cincinnati', 'OH', 39.10, -84.51, 2.3, '452'),
+    ('Kansas City', 'MO', 39.10, -94.58, 2.2, '641'), ('Columbus', 'OH', 39.96, -83.00, 2.1, '432'),
+    ('Indianapolis', 'IN', 39.77, -86.16, 2.1, '462'), ('Cleveland', 'OH', 41.50, -81.69, 2.1, '441'),
+    ('Nashville', 'TN', 36.16, -86.78, 2.0, '372'), ('Milwaukee', 'WI', 43.04, -87.91, 1.6, '532'),
+    ('Raleigh', 'NC', 35.78, -78.64, 1.4, '276'), ('Salt Lake City', 'UT', 40.76, -111.89, 1.3, '841'),
+    ('Richmond', 'VA', 37.54, -77.44, 1.3, '232'), ('Louisville', 'KY', 38.25, -85.76, 1.3, '402'),
+    ('New Orleans', 'LA', 29.95, -90.07, 1.3, '701'), ('Oklahoma City', 'OK', 35.47, -97.52, 1.4, '731'),
+    ('Hartford', 'CT', 41.77, -72.67, 1.2, '061'), ('Birmingham', 'AL', 33.52, -86.80, 1.1, '352'),
+    ('Honolulu', 'HI', 21.31, -157.86, 1.0, '968'), ('Albuquerque', 'NM', 35.08, -106.65, 0.9, '871'),
+    ('Omaha', 'NE', 41.26, -95.93, 1.0, '681'), ('Providence', 'RI', 41.82, -71.41, 1.7, '029'),
+    ('Little Rock', 'AR', 34.75, -92.29, 0.8, '722'), ('Des Moines', 'IA', 41.59, -93.62, 0.7, '503'),
+    ('Boise', 'ID', 43.62, -116.20, 0.8, '837'), ('Madison', 'WI', 43.07, -89.40, 0.7, '537'),
+    ('Wichita', 'KS', 37.69, -97.34, 0.6, '672'), ('Jackson', 'MS', 32.30, -90.18, 0.6, '392'),
+    ('Charleston', 'SC', 32.78, -79.93, 0.8, '294'), ('Portland', 'ME', 43.66, -70.26, 0.6, '041'),
+    ('Manchester', 'NH', 42.99, -71.46, 0.4, '031'), ('Wilmington', 'DE', 39.74, -75.55, 0.7, '198'),
+    ('Newark', 'NJ', 40.74, -74.17, 2.2, '071'), ('Charleston', 'WV', 38.35, -81.63, 0.2, '253'),
+    ('Burlington', 'VT', 44.48, -73.21, 0.2, '054'), ('Sioux Falls', 'SD', 43.54, -96.73, 0.3, '571'),
+    ('Fargo', 'ND', 46.88, -96.79, 0.3, '581'), ('Billings', 'MT', 45.78, -108.50, 0.2, '591'),
+    ('Cheyenne', 'WY', 41.14, -104.82, 0.1, '820'), ('Anchorage', 'AK', 61.22, -149.90, 0.4, '995'),
+    ('San Juan', 'PR', 18.47, -66.11, 2.0, '009'), ('Charlotte Amalie', 'VI', 18.34, -64.93, 0.1, '008'),
+]
+
+TOWNS = ['Fairview', 'Greenville', 'Franklin', 'Clinton', 'Springfield', 'Riverside', 'Salem',
+         'Madison', 'Georgetown', 'Ashland', 'Oakdale', 'Milford', 'Bristol', 'Dover', 'Hudson',
+         'Marion', 'Lexington', 'Newport', 'Jackson', 'Auburn', 'Kingston', 'Oxford', 'Winchester']
+ADJECTIVES = ['Green', 'Fresh', 'Harvest', 'Sunny', 'Organic', 'Heritage', 'Old Town', 'Community',
+              'Local', 'Golden', 'Valley', 'Hilltop', 'Riverfront', 'Downtown', 'Historic']
+NOUNS = ['Farmers Market', 'Market', 'Growers Market', 'Market Square', 'Farm Stand', 'Food Market',
+         'Produce Market', 'Harvest Market', 'Green Market', 'Market Days']
+DAYS = ['Saturday', 'Sunday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday Night', 'Weekend']
+STREETS = ['Main St', 'Market St', 'Oak Ave', 'Park Rd', 'Church St', 'Elm St', 'Broadway',
+           'Washington Ave', 'Maple Ave', 'Center St', 'Mill Rd', 'River Rd', '2nd St', 'Pine St']
+
+# How addresses are written, with their share of rows
+ADDRESS_FORMATS = [
+    ('{street}, {city}, {state} {zip}', 0.70),
+    ('{street}, {city}, {state} {zip}-{plus4}', 0.08),
+    ('{street}, {city}, {state_name} {zip}', 0.08),
+    ('{street}, {city}, {state}, {zip}', 0.06),
+    ('{street}, {city}, {state}', 0.06),
+    ('{street}, {city}', 0.02),
+]
+
+RURAL_SHARE = 0.3
+# Standard deviation of the scatter around a centre, in degrees of latitude
+URBAN_SPREAD = 0.25
+RURAL_SPREAD = 1.2
+MISSING_COORDINATES = 0.02
+
+def _chunk(rng, start, size, maps_link_rate):
+    """Generate `size` rows as a dict of column lists"""
+    weights = np.array([c[4] for c in POPULATION_CENTRES])
+    centre = rng.choice(len(POPULATION_CENTRES), size=size, p=weights / weights.sum())
+    rural = rng.random(size) < RURAL_SHARE
+    spread = np.where(rural, RURAL_SPREAD, URBAN_SPREAD)
+    base_lat = np.array([c[2] for c in POPULATION_CENTRES])[centre]
+    base_lng = np.array([c[3] for c in POPULATION_CENTRES])[centre]
+    lat = np.clip(base_lat + rng.normal(0, 1, size) * spread, -89.9, 89.9)
+    lng = base_lng + rng.normal(0, 1, size) * spread / np.cos(np.radians(lat))
+    lng = (lng + 180) % 360 - 180
+    no_coordinates = rng.random(size) < MISSING_COORDINATES
+
+    town = rng.integers(len(TOWNS), size=size)
+    template = rng.integers(5, size=size)
+    adjective = rng.integers(len(ADJECTIVES), size=size)
+    noun = rng.integers(len(NOUNS), size=size)
+    day = rng.integers(len(DAYS), size=size)
+    street_number = rng.integers(1, 10000, size=size)
+    street = rng.integers(len(STREETS), size=size)
+    zip_suffix = rng.integers(0, 100, size=size)
+    plus4 = rng.integers(0, 10000, size=size)
+    address_format = rng.choice(len(ADDRESS_FORMATS), size=size, p=[f[1] for f in ADDRESS_FORMATS])
+
+    minutes = rng.integers(0, 6 * 365 * 24 * 60, size=size)
+    updated = np.datetime_as_string(np.datetime64('2019-01-01T00:00') + minutes.astype('timedelta64[m]'))
+
+    has_phone = rng.random(size) < 0.4
+    phone = rng.integers(0, 10000000, size=size)
+    has_website = rng.random(size) < 0.3
+    has_rating = rng.random(size) < 0.5
+    rating = np.round(rng.uniform(3.0, 5.0, size), 1)
+    has_link = rng.random(size) < maps_link_rate
+    cid_link = rng.random(size) < 0.2
+    link_id = rng.integers(0, 2 ** 62, size=size)
+
+    columns = {name: [] for name in COLUMNS}
+    for i in range(size):
+        city, state, _, _, _, zip_prefix = POPULATION_CENTRES[centre[i]]
+        if rural[i]:
+            city = TOWNS[town[i]]
+        place = city if template[i] < 3 else TOWNS[town[i]]
+        name = (
+            f"{place} {NOUNS[noun[i]]}",
+            f"{ADJECTIVES[adjective[i]]} {NOUNS[noun[i]]}",
+            f"{place} {DAYS[day[i]]} Market",
+            f"{ADJECTIVES[adjective[i]]} {place} {NOUNS[noun[i]]}",
+            f"{NOUNS[noun[i]]} at {place} {STREETS[street[i]].split()[0]}",
+        )[template[i]]
+        address = ADDRESS_FORMATS[address_format[i]][0].format(
+            street=f"{street_number[i]} {STREETS[street[i]]}", city=city, state=state,
+            state_name=STATE_NAMES[state], zip=f"{zip_prefix}{zip_suffix[i]:02d}", plus4=f"{plus4[i]:04d}")
+        stamp = updated[i]
+
+        columns['listing_id'].append(start + i)
+        columns['listing_name'].append(name)
+        columns['location_address'].append(address)
+        columns['location_x'].append('' if no_coordinates[i] else f"{lng[i]:.6f}")
+        columns['location_y'].append('' if no_coordinates[i] else f"{lat[i]:.6f}")
+        columns['update_time'].append(f"{stamp[8:10]}-{stamp[5:7]}-{stamp[:4]} {stamp[11:16]}")
+        columns['phone_number'].append(f"(555) {phone[i] // 10000:03d}-{phone[i] % 10000:04d}"
+                                       if has_phone[i] else '')
+        columns['website'].append(f"https://www.{name.lower().replace(' ', '')[:40]}.org" if has_website[i] else '')
+        columns['rating'].append(rating[i] if has_rating[i] else '')
+        if not has_link[i]:
+            columns['google_maps_link'].append('')
+        elif cid_link[i]:
+            columns['google_maps_link'].append(f"https://maps.google.com/?cid={link_id[i]}")
+        else:
+            columns['google_maps_link'].append(f"https://www.google.com/maps/place/ChIJ{link_id[i]:016x}/")
+    return columns
+
+def generate_chunks(rows, seed=42, maps_link_rate=0.5, chunk_size=100000, start_id=1000000):
+    """Yield the dataset as dicts of column lists, `chunk_size` rows at a time"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_size):
+        yield _chunk(rng, start_id + start, min(chunk_size, rows - start), maps_link_rate)
+
+def generate_records(rows, seed=42, maps_link_rate=0.5, chunk_size=100000, start_id=1000000):
+    """Yield one CSV-schema dict per market, empty cells left out"""
+    for columns in generate_chunks(rows, seed, maps_link_rate, chunk_size, start_id):
+        for values in zip(*columns.values()):
+            yield {name: value for name, value in zip(COLUMNS, values) if value != ''}
+
+def write_csv(path, rows, seed=42, maps_link_rate=0.5, chunk_size=100000, start_id=1000000):
+    """Stream the dataset to a CSV file (gzip-compressed when path ends in .gz, stdout for '-')"""
+    if path == '-':
+        f = sys.stdout
+    elif path.endswith('.gz'):
+        f = gzip.open(path, 'wt', newline='', compresslevel=6)
+    else:
+        f = open(path, 'w', newline='')
+    written = 0
+    try:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for columns in generate_chunks(rows, seed, maps_link_rate, chunk_size, start_id):
+            writer.writerows(zip(*columns.values()))
+            written += len(columns['listing_id'])
+            if f is not sys.stdout:
+                print(f"Wrote {written}/{rows} rows", file=sys.stderr)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--output', default=os.path.join('uploads', 'synthetic_markets.csv'),
+                        help="CSV path; .gz compresses, '-' writes to stdout")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--maps-links', type=float, default=0.5,
+                        help='share of rows with a Google Maps link (0 for none)')
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--start-id', type=int, default=1000000, help='first listing_id')
+    args = parser.parse_args()
+
+    if args.output != '-' and os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    started = time.perf_counter()
+    written = write_csv(args.output, args.rows, args.seed, args.maps_links, args.chunk_size, args.start_id)
+    if args.output != '-':
+        print(f"Generated {written} markets in {args.output} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,19 @@
 import pandas as pd
 import numpy as np
-from pymongo import MongoClient, GEOSPHERE
+from pymongo import MongoClient
 from datetime import datetime
 import os
+import sys
 from dotenv import load_dotenv
+from market_fields import add_derived_fields
+from market_schema import canonicalize_market
+from indexes import reconcile_indexes
+from market_cache import bump_dataset_version
+from profiling import profile_job
+from nearby import rebuild_nearby
+from rollups import rebuild_rollups
+from snapshot import refresh_snapshot
+from viewport import rebuild_clusters
 
 # Load environment variables
 load_dotenv()
@@ -106,49 +116,46 @@ def clean_and_transform_data(df):
         record['id'] = str(record['listing_id'])
         record.pop('listing_id', None)
         
-        # Remove any None values to keep documents clean
-        record = {k: v for k, v in record.items() if v is not None}
-        cleaned_records.append(record)
+        # Map onto the canonical schema (also drops None values)
+        cleaned_records.append(canonicalize_market(record))
     
-    return cleaned_records
+    # Precompute place_id, image_url and has_image once at import
+    return add_derived_fields(cleaned_records)
 
-def import_data(csv_path):
+def import_data(csv_path, chunk_size=50000):
     """Import data from CSV to MongoDB"""
     try:
-        # Read CSV file
-        df = pd.read_csv(csv_path)
-        
-        # Clean and transform data
-        records = clean_and_transform_data(df)
+        # Open the CSV before dropping anything, so a bad path leaves the data alone
+        reader = pd.read_csv(csv_path, chunksize=chunk_size)
         
         # Drop existing collection
         markets.drop()
         
         # Create indexes
         try:
-            # Create geospatial index
-            markets.create_index([("location", GEOSPHERE)])
-            
-            # Create text index for searching
-            markets.create_index([
-                ("listing_name", "text"),
-                ("listing_desc", "text")
-            ])
-            
-            # Create index for common queries
-            markets.create_index("id", unique=True, name="id_unique_index")
-            markets.create_index("address.state")
-            markets.create_index("address.zipCode")
+            reconcile_indexes(db)
         except Exception as e:
             print(f"Warning: Error creating indexes: {str(e)}")
         
-        # Insert records
-        if records:
-            markets.insert_many(records)
-            print(f"Successfully imported {len(records)} records")
+        # Read, clean and insert the CSV a chunk at a time so large files fit in memory
+        imported = 0
+        for df in reader:
+            records = clean_and_transform_data(df)
+            if records:
+                markets.insert_many(records)
+                imported += len(records)
+        
+        if imported:
+            bump_dataset_version(db)
+            rebuild_clusters(db)
+            rebuild_nearby(db)
+            rebuild_rollups(db)
+            refresh_snapshot(db)
+            print(f"Successfully imported {imported} records")
             
     except Exception as e:
         print(f"Error importing data: {str(e)}")
 
 if __name__ == "__main__":
-    import_data(CSV_PATH) 
\ No newline at end of file
+    with profile_job('import_data'):
+        import_data(sys.argv[1] if len(sys.argv) > 1 else CSV_PATH) 
\ No newline at end of file
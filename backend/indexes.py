@@ -0,0 +1,152 @@
+"""
+Declarative index definitions and the reconcile step that applies them.
+
+INDEX_SPECS is the single source of truth for every index the app relies
+on. reconcile_indexes() diffs it against list_indexes(), drops indexes that
+are stale or whose definition changed, builds the missing ones and returns
+a report; scripts/reconcile_indexes.py runs it and prints $indexStats
+usage. Nothing creates indexes on the request path.
+"""
+import sys
+
+from pymongo import IndexModel
+
+# collection -> index definitions. `keys` is a list of (field, direction)
+# pairs; every other entry is passed to create_index as an option.
+INDEX_SPECS = {
+    'markets': [
+        # $text in search_markets
+        {'name': 'market_text_index',
+         'keys': [('market_name', 'text'), ('market_address', 'text')],
+         'weights': {'market_name': 10, 'market_address': 2}},
+        # state filter + pagination in get_markets, state-counts aggregation
+        {'name': 'state_index', 'keys': [('state', 1)]},
+        # id lookup in get_market_by_id
+        {'name': 'usda_listing_id_index', 'keys': [('USDA_listing_id', 1)]},
+        # $near radius search
+        {'name': 'location_2dsphere_index', 'keys': [('location', '2dsphere')]},
+        # ?with_images=1 filter; only markets with images are indexed
+        {'name': 'has_image_index', 'keys': [('has_image', 1)],
+         'partialFilterExpression': {'has_image': True}},
+        # canonical schema migration progress
+        {'name': 'schema_version_index', 'keys': [('schema_version', 1)]},
+        # get_market_by_id for the _ids of merged duplicates (dedup.py); only merged markets have any
+        {'name': 'merged_ids_index', 'keys': [('merged_ids', 1)], 'sparse': True},
+    ],
+    'market_clusters': [
+        # Cell range lookups in get_viewport (built by viewport.rebuild_clusters)
+        {'name': 'zoom_cell_index', 'keys': [('zoom', 1), ('x', 1), ('y', 1)]},
+    ],
+    'market_neighbors': [
+        # Lists mentioning moved or deleted markets (nearby.rebuild_nearby)
+        {'name': 'neighbors_index', 'keys': [('neighbors', 1)]},
+    ],
+    'rate_limits': [
+        # Shared token buckets (rate_limit.py) expire once they would be full again
+        {'name': 'expires_at_ttl_index', 'keys': [('expires_at', 1)], 'expireAfterSeconds': 0},
+    ],
+}
+
+# Options compared when deciding whether an existing index matches its spec
+COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds', 'weights')
+
+def _normalized(spec):
+    """Comparable form of an index spec or a list_indexes() entry"""
+    if 'keys' in spec:
+        keys = [(field, direction) for field, direction in spec['keys']]
+        text_fields = [field for field, direction in keys if direction == 'text']
+        options = {k: spec[k] for k in COMPARED_OPTIONS if k in spec}
+        if text_fields:
+            weights = {field: 1 for field in text_fields}
+            weights.update(options.get('weights', {}))
+            options['weights'] = weights
+            keys = [(field, direction) for field, direction in keys if direction != 'text']
+            keys.append(('$text', 'text'))
+    else:
+        # list_indexes() stores text indexes as _fts/_ftsx plus a weights document
+        keys = [(field, direction) for field, direction in spec['key'].items()
+                if field not in ('_fts', '_ftsx') and direction != 'text']
+        if len(keys) != len(spec['key']):
+            keys.append(('$text', 'text'))
+        options = {k: spec[k] for k in COMPARED_OPTIONS if k in spec}
+    if 'weights' in options:
+        options['weights'] = {k: int(v) for k, v in options['weights'].items()}
+    if options.get('unique') is False:
+        options.pop('unique')
+    if options.get('sparse') is False:
+        options.pop('sparse')
+    return keys, options
+
+def _index_model(spec):
+    options = {k: v for k, v in spec.items() if k != 'keys'}
+    # background is ignored by MongoDB 4.2+ (builds only lock briefly) but
+    # keeps older servers from blocking reads during the build
+    options.setdefault('background', True)
+    return IndexModel(spec['keys'], **options)
+
+def index_models(collection_name):
+    """IndexModels for a collection's specs, for collections built aside and renamed into place"""
+    return [_index_model(spec) for spec in INDEX_SPECS[collection_name]]
+
+def diff_indexes(collection, specs):
+    """Return (missing, changed, stale) for one collection"""
+    existing = {idx['name']: idx for idx in collection.list_indexes()}
+    wanted = {spec['name']: spec for spec in specs}
+    missing, changed = [], []
+    for name, spec in wanted.items():
+        if name not in existing:
+            missing.append(spec)
+        elif _normalized(existing[name]) != _normalized(spec):
+            changed.append(spec)
+    stale = [idx for name, idx in existing.items() if name != '_id_' and name not in wanted]
+    return missing, changed, stale
+
+def reconcile_indexes(db, dry_run=False, build=True, drop_stale=True, collections=None):
+    """
+    Bring the indexes of every collection in INDEX_SPECS in line with it.
+
+    Stale and changed indexes are dropped before anything is built, since
+    MongoDB rejects a second text index or an index whose keys already
+    exist under another name. Returns a report dict per collection.
+    """
+    report = {}
+    for collection_name, specs in INDEX_SPECS.items():
+        if collections and collection_name not in collections:
+            continue
+        collection = db[collection_name]
+        missing, changed, stale = diff_indexes(collection, specs)
+        report[collection_name] = {
+            'missing': [spec['name'] for spec in missing],
+            'changed': [spec['name'] for spec in changed],
+            'stale': [idx['name'] for idx in stale],
+        }
+        if dry_run:
+            continue
+
+        to_drop = [spec['name'] for spec in changed]
+        if drop_stale:
+            to_drop += [idx['name'] for idx in stale]
+        for name in to_drop:
+            collection.drop_index(name)
+            print(f"Dropped index {collection_name}.{name}")
+
+        if build:
+            to_build = missing + changed
+            if to_build:
+                collection.create_indexes([_index_model(spec) for spec in to_build])
+                for spec in to_build:
+                    print(f"Built index {collection_name}.{spec['name']}")
+        sys.stdout.flush()
+    return report
+
+def index_usage(db, collection_name='markets'):
+    """Return $indexStats usage per index: ops since the server last restarted"""
+    usage = []
+    for stats in db[collection_name].aggregate([{'$indexStats': {}}]):
+        usage.append({
+            'name': stats['name'],
+            'ops': stats.get('accesses', {}).get('ops', 0),
+            'since': stats.get('accesses', {}).get('since'),
+            'host': stats.get('host'),
+        })
+    return sorted(usage, key=lambda entry: entry['ops'], reverse=True)
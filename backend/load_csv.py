@@ -3,6 +3,15 @@ from pymongo import MongoClient
 import os
 from dotenv import load_dotenv
 import sys
+from market_fields import add_derived_fields
+from market_schema import canonicalize_market
+from indexes import reconcile_indexes
+from market_cache import bump_dataset_version
+from profiling import profile_job
+from nearby import rebuild_nearby
+from rollups import rebuild_rollups
+from snapshot import refresh_snapshot
+from viewport import rebuild_clusters
 
 # Load environment variables
 load_dotenv()
@@ -24,7 +33,11 @@ def verify_mongodb_connection():
         print(f"Failed to connect to MongoDB Atlas: {str(e)}")
         return False
 
-def load_csv_to_mongodb():
+# Rows read, converted and inserted at a time, so large CSVs
+# (e.g. from generate_markets.py) never have to fit in memory
+CHUNK_SIZE = 50000
+
+def load_csv_to_mongodb(csv_path=None):
     # Verify MongoDB connection first
     if not verify_mongodb_connection():
         print("Please make sure MongoDB Atlas connection string is correct")
@@ -36,33 +49,44 @@ def load_csv_to_mongodb():
         client = MongoClient(mongo_uri)
         db = client.farmers_market
         
+        # Open the CSV file before dropping anything
+        csv_path = csv_path or os.path.join('uploads', 'farmers_market.csv')
+        print(f"Reading CSV file from: {csv_path}")
+        reader = pd.read_csv(csv_path, chunksize=CHUNK_SIZE)
+        
         # Drop existing collection to ensure clean data
         db.markets.drop()
         print("Dropped existing markets collection")
         
-        # Read CSV file
-        csv_path = os.path.join('uploads', 'farmers_market.csv')
-        print(f"Reading CSV file from: {csv_path}")
-        df = pd.read_csv(csv_path)
-        print(f"Found {len(df)} rows in CSV")
-        
-        # Clean the data
-        df = df.replace({pd.NA: None})
-        
-        # Convert to records
-        records = df.to_dict('records')
-        
-        # Insert into MongoDB
-        result = db.markets.insert_many(records)
+        inserted = 0
+        for df in reader:
+            # Clean the data
+            df = df.replace({pd.NA: None})
+            
+            # Convert to records in the canonical schema
+            records = [canonicalize_market(record) for record in df.to_dict('records')]
+            
+            # Precompute place_id, image_url and has_image once at import
+            add_derived_fields(records)
+            
+            # Insert into MongoDB
+            result = db.markets.insert_many(records)
+            inserted += len(result.inserted_ids)
+            print(f"Inserted {inserted} markets...")
+            sys.stdout.flush()
+        bump_dataset_version(db)
         
-        print(f"Successfully inserted {len(result.inserted_ids)} markets")
+        print(f"Successfully inserted {inserted} markets")
         
         # Create indexes
         print("Creating indexes...")
-        db.markets.create_index([("Name", "text"), ("Address", "text")])
-        db.markets.create_index("state")
-        db.markets.create_index("usda_listing_id", name="usda_listing_id_index")  # Non-unique index
-        db.markets.create_index([("longitude", 1), ("latitude", 1)])
+        reconcile_indexes(db)
+        
+        # Map clusters for /api/markets/viewport, nearby markets for the detail page
+        rebuild_clusters(db)
+        rebuild_nearby(db)
+        rebuild_rollups(db)
+        refresh_snapshot(db)
         
         print("Indexes created successfully")
         
@@ -83,4 +107,5 @@ def load_csv_to_mongodb():
         sys.exit(1)
 
 if __name__ == "__main__":
-    load_csv_to_mongodb() 
\ No newline at end of file
+    with profile_job('load_csv'):
+        load_csv_to_mongodb(sys.argv[1] if len(sys.argv) > 1 else None) 
\ No newline at end of file
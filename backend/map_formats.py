@@ -0,0 +1,122 @@
+"""
+Map-friendly encodings of market and cluster lists.
+
+The list, search and viewport endpoints take a `format` argument:
+
+    json      (default) the documents as they are
+    geojson   a FeatureCollection of Points, served as application/geo+json
+              so map libraries can load the URL directly. Each market
+              carries only its id and name; a cluster carries its count
+              and, for a single market, market_id. The endpoint's other
+              keys (total, page, count, ...) are foreign members, with the
+              viewport's `type` renamed to `layer`.
+    compact   the same values as columnar arrays. Coordinates are
+              quantised to MAP_COORDINATE_PRECISION decimals (5 is about
+              1 m) and sent as integer deltas from the previous item:
+
+                  lat[i] = (lat[0] + ... + lat[i]) / 10 ** precision
+
+The map formats fetch only MAP_PROJECTION from MongoDB. Items without a
+position are left out, so `count` can exceed the number of points.
+Positions are read from the GeoJSON `location` field when it is present,
+and from `latitude`/`longitude` otherwise.
+benchmarks/bench_map_formats.py measures payload size and client parse
+time for each format.
+"""
+import os
+
+import numpy as np
+from flask import jsonify
+
+FORMATS = ('json', 'geojson', 'compact')
+GEOJSON_MIMETYPE = 'application/geo+json'
+MAP_COORDINATE_PRECISION = int(os.getenv('MAP_COORDINATE_PRECISION', 5))
+
+# Fields a map layer needs; the list endpoint's LIST_PROJECTION drops _id
+MAP_PROJECTION = {'_id': 1, 'market_name': 1, 'latitude': 1, 'longitude': 1, 'location': 1}
+MAP_FIELDS = list(MAP_PROJECTION)
+
+def parse_format(value):
+    """The requested format, 'json' when absent; ValueError for anything else"""
+    value = (value or 'json').lower()
+    if value not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    return value
+
+def _position(item):
+    location = item.get('location')
+    if isinstance(location, dict):
+        coordinates = location.get('coordinates')
+        if isinstance(coordinates, (list, tuple)) and len(coordinates) == 2:
+            return coordinates[0], coordinates[1]
+    return item.get('longitude'), item.get('latitude')
+
+def _positioned(items):
+    """(items that have a position, their longitudes, their latitudes)"""
+    kept, lngs, lats = [], [], []
+    for item in items:
+        lng, lat = _position(item)
+        if isinstance(lng, (int, float)) and isinstance(lat, (int, float)) and lng == lng and lat == lat:
+            kept.append(item)
+            lngs.append(lng)
+            lats.append(lat)
+    return kept, np.asarray(lngs, dtype=np.float64), np.asarray(lats, dtype=np.float64)
+
+def _market_id(market):
+    market_id = market.get('_id')
+    return str(market_id) if market_id is not None else market.get('USDA_listing_id')
+
+def _columns(items, kind):
+    if kind == 'clusters':
+        return {'count': [item['count'] for item in items],
+                'market_id': [item.get('market_id') for item in items]}
+    return {'id': [_market_id(item) for item in items],
+            'name': [item.get('market_name') for item in items]}
+
+def to_geojson(items, kind='markets'):
+    """FeatureCollection of the positioned markets (or clusters)"""
+    items, lngs, lats = _positioned(items)
+    columns = _columns(items, kind)
+    features = []
+    for i, (lng, lat) in enumerate(zip(lngs.tolist(), lats.tolist())):
+        feature = {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lng, lat]}}
+        if kind == 'clusters':
+            feature['properties'] = {'count': columns['count'][i]}
+            if columns['market_id'][i] is not None:
+                feature['properties']['market_id'] = columns['market_id'][i]
+        else:
+            feature['id'] = columns['id'][i]
+            feature['properties'] = {'name': columns['name'][i]}
+        features.append(feature)
+    return {'type': 'FeatureCollection', 'features': features}
+
+def quantised_deltas(values, precision=MAP_COORDINATE_PRECISION):
+    """Fixed-point integers, each but the first as the difference from the one before"""
+    fixed = np.rint(values * 10 ** precision).astype(np.int64)
+    return np.diff(fixed, prepend=0).tolist()
+
+def to_compact(items, kind='markets', precision=MAP_COORDINATE_PRECISION):
+    """Columnar arrays of the positioned markets (or clusters) with delta-encoded coordinates"""
+    items, lngs, lats = _positioned(items)
+    columns = _columns(items, kind)
+    columns['lng'] = quantised_deltas(lngs, precision)
+    columns['lat'] = quantised_deltas(lats, precision)
+    return columns
+
+def map_response(fmt, payload, key='markets', kind='markets'):
+    """jsonify payload, re-encoding the list under key when a map format was asked for"""
+    if fmt == 'json':
+        return jsonify(payload)
+    # The payload may be shared with coalesced requests (single_flight.py): work on a copy
+    payload = dict(payload)
+    items = payload.pop(key)
+    if fmt == 'geojson':
+        # The viewport's 'type' (markets or clusters) would clash with GeoJSON's own
+        if 'type' in payload:
+            payload['layer'] = payload.pop('type')
+        response = jsonify({**payload, **to_geojson(items, kind)})
+        response.mimetype = GEOJSON_MIMETYPE
+        return response
+    payload.update({'format': 'compact', 'precision': MAP_COORDINATE_PRECISION,
+                    key: to_compact(items, kind)})
+    return jsonify(payload)
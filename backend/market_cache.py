@@ -0,0 +1,75 @@
+"""
+In-process caches built from the markets collection.
+
+Writers bump a dataset version stored in the `meta` collection; each cache
+checks that version at most every `check_interval` seconds and rebuilds
+itself when it has changed, so workers pick up imports and backfills
+without a restart.
+"""
+import contextvars
+import threading
+import time
+import sys
+
+META_ID = 'markets'
+
+def get_dataset_version(db):
+    """Return the current markets dataset version (0 if never bumped)"""
+    meta = db.meta.find_one({'_id': META_ID}, {'version': 1})
+    return meta.get('version', 0) if meta else 0
+
+def bump_dataset_version(db):
+    """Mark the markets collection as changed so in-process caches rebuild"""
+    db.meta.update_one({'_id': META_ID}, {'$inc': {'version': 1}}, upsert=True)
+
+class DatasetCache:
+    """
+    Lazily build an object from the markets collection and rebuild it when
+    the dataset version changes.
+
+    `builder(db)` returns the cached object. Builds happen under a lock so
+    concurrent requests in a threaded worker build only once; a failed
+    version check keeps serving the existing object. Objects derived from
+    their own collection pass that collection's `version_of(db)` instead
+    of the dataset version.
+    """
+    def __init__(self, name, builder, check_interval=30, version_of=get_dataset_version):
+        self.name = name
+        self.builder = builder
+        self.check_interval = check_interval
+        self.version_of = version_of
+        self._value = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, db):
+        now = time.monotonic()
+        if self._value is not None and now - self._checked_at < self.check_interval:
+            return self._value
+        with self._lock:
+            if self._value is not None and now - self._checked_at < self.check_interval:
+                return self._value
+            try:
+                version = self.version_of(db)
+            except Exception as e:
+                if self._value is None:
+                    raise
+                print(f"Warning: could not check {self.name} version: {str(e)}", file=sys.stderr)
+                self._checked_at = now
+                return self._value
+            if self._value is None or version != self._version:
+                started = time.perf_counter()
+                # Build in a fresh context so the request's time budget (deadlines.py)
+                # does not cut short a build every later request depends on
+                self._value = contextvars.Context().run(self.builder, db)
+                self._version = version
+                print(f"Built {self.name} cache (version {version}) in "
+                      f"{(time.perf_counter() - started) * 1000:.0f}ms", file=sys.stderr)
+            self._checked_at = time.monotonic()
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._checked_at = 0
@@ -0,0 +1,203 @@
+"""
+Canonical market document schema.
+
+Over time the loaders wrote markets under different field names (Name,
+MarketName, listing_name, Address, Market_Address, location_address,
+usda_listing_id, id, ...). canonicalize_market() maps any of them onto
+one schema so handlers and indexes only deal with a single field per
+value; scripts/migrate_schema.py rewrites existing documents with it and
+indexes.py defines the index set that goes with it.
+"""
+import math
+import re
+
+from market_fields import STATE_NAMES, extract_state
+
+# 3: city re-derived where v2 stored a state or ZIP code in it
+SCHEMA_VERSION = 3
+
+# Canonical field -> legacy field names it replaces, in order of preference
+LEGACY_FIELDS = {
+    'market_name': ['MarketName', 'Name', 'listing_name'],
+    'market_address': ['Address', 'Market_Address', 'location_address'],
+    'city': ['City'],
+    'zipCode': ['zip', 'Zip', 'zipcode', 'zip_code'],
+    'USDA_listing_id': ['usda_listing_id', 'listing_id', 'id'],
+    'latitude': ['location_y', 'Latitude'],
+    'longitude': [' longitude', 'location_x', 'Longitude'],
+}
+
+# Fields returned by the market list endpoint
+LIST_PROJECTION = {
+    '_id': 0,
+    'market_name': 1,
+    'market_address': 1,
+    'city': 1,
+    'state': 1,
+    'zipCode': 1,
+    'latitude': 1,
+    'longitude': 1,
+    'phone_number': 1,
+    'website': 1,
+    'USDA_listing_id': 1,
+    'rating': 1,
+    'google_maps_link': 1,
+    'image_url': 1
+}
+LIST_FIELDS = [field for field, included in LIST_PROJECTION.items() if included]
+
+ZIP_RE = re.compile(r'\b(\d{5})(?:-\d{4})?\s*$')
+ZIP_ONLY_RE = re.compile(r'\d{5}(?:-\d{4})?')
+COUNTRY_NAMES = {'US', 'USA', 'UNITED STATES', 'UNITED STATES OF AMERICA'}
+# Full state names, longest first so "West Virginia" is tried before "Virginia"
+STATE_FULL_NAMES = sorted((name.upper() for name in STATE_NAMES.values()), key=len, reverse=True)
+
+def _present(value):
+    if value is None:
+        return False
+    if isinstance(value, float) and math.isnan(value):
+        return False
+    if isinstance(value, str) and not value.strip():
+        return False
+    return True
+
+def _pick(doc, canonical):
+    for name in [canonical] + LEGACY_FIELDS[canonical]:
+        if _present(doc.get(name)):
+            return doc[name]
+    return None
+
+def _coordinate(value, limit):
+    try:
+        value = float(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and -limit <= value <= limit else None
+
+def _strip_state(segment):
+    """(segment without a trailing state and ZIP code, whether it had a state)"""
+    text = ZIP_RE.sub('', segment).strip().rstrip('.')
+    # Abbreviations only count in capitals: "Ok" or "In" may be part of a name
+    words = text.split()
+    if words and words[-1] in STATE_NAMES:
+        return ' '.join(words[:-1]), True
+    upper = text.upper()
+    for name in STATE_FULL_NAMES:
+        if upper == name or upper.endswith(' ' + name):
+            return text[:len(text) - len(name)].strip(), True
+    return segment, False
+
+def is_city(value):
+    """False for a state abbreviation, a ZIP code or an empty value (New York and Washington are cities too)"""
+    if not isinstance(value, str) or not value.strip():
+        return False
+    value = value.strip()
+    return not (ZIP_ONLY_RE.fullmatch(value) or value.upper() in STATE_NAMES)
+
+def city_from_address(address):
+    """
+    Take the city from an address such as "street, city, ST 12345",
+    "street, city, ST, 12345", "street, city ST 12345" or "city, ST 12345".
+    """
+    if not isinstance(address, str):
+        return None
+    parts = [part.strip() for part in address.split(',') if part.strip()]
+    if parts and parts[-1].upper() in COUNTRY_NAMES:
+        parts.pop()
+    if parts and ZIP_ONLY_RE.fullmatch(parts[-1]):
+        parts.pop()
+    had_state = False
+    if parts:
+        rest, had_state = _strip_state(parts[-1])
+        if rest:
+            parts[-1] = rest
+        elif had_state:
+            parts.pop()
+    # What is left ends in the city, unless only a street remains
+    if len(parts) >= 2 or (had_state and parts and not parts[-1][0].isdigit()):
+        city = parts[-1]
+        if is_city(city) and not city[0].isdigit():
+            return city
+    return None
+
+def canonicalize_market(doc):
+    """Return a copy of a market document in the canonical schema"""
+    market = {k: v for k, v in doc.items() if _present(v) or k == '_id'}
+
+    # import_data.py stored the parsed address as a sub-document
+    parsed = market.pop('address', None)
+    if isinstance(parsed, str):
+        market.setdefault('market_address', parsed)
+        parsed = None
+    parsed = parsed if isinstance(parsed, dict) else {}
+
+    name = _pick(market, 'market_name')
+    address = _pick(market, 'market_address') or parsed.get('full')
+    city = _pick(market, 'city')
+    derived = city_from_address(address)
+    # v2 stored the state (or ZIP code) segment as the city for some address forms
+    if not is_city(city) or (derived and str(city).strip().upper() in STATE_FULL_NAMES):
+        city = parsed.get('city') if is_city(parsed.get('city')) else derived
+    zip_code = _pick(market, 'zipCode') or parsed.get('zipCode')
+    listing_id = _pick(market, 'USDA_listing_id')
+    lat = _coordinate(_pick(market, 'latitude'), 90)
+    lng = _coordinate(_pick(market, 'longitude'), 180)
+
+    location = market.get('location')
+    if (lat is None or lng is None) and isinstance(location, dict):
+        coordinates = location.get('coordinates') or []
+        if len(coordinates) == 2:
+            lng, lat = _coordinate(coordinates[0], 180), _coordinate(coordinates[1], 90)
+
+    for legacy in LEGACY_FIELDS.values():
+        for field in legacy:
+            market.pop(field, None)
+
+    if name is not None:
+        market['market_name'] = str(name).strip()
+    if address is not None:
+        market['market_address'] = str(address).strip()
+    if city:
+        market['city'] = str(city).strip()
+    else:
+        market.pop('city', None)
+    if zip_code is None and isinstance(address, str):
+        match = ZIP_RE.search(address)
+        zip_code = match.group(1) if match else None
+    if zip_code is not None:
+        if isinstance(zip_code, float):
+            zip_code = int(zip_code)
+        market['zipCode'] = str(zip_code).strip().zfill(5)[:5]
+    if listing_id is not None:
+        if isinstance(listing_id, float) and listing_id.is_integer():
+            listing_id = int(listing_id)
+        market['USDA_listing_id'] = str(listing_id)
+
+    state = market.get('state')
+    if not (isinstance(state, str) and state.upper() in STATE_NAMES):
+        state = extract_state(address) or parsed.get('state')
+    if isinstance(state, str) and state.upper() in STATE_NAMES:
+        market['state'] = state.upper()
+    else:
+        market.pop('state', None)
+
+    if lat is not None and lng is not None:
+        market['latitude'] = lat
+        market['longitude'] = lng
+        market['location'] = {'type': 'Point', 'coordinates': [lng, lat]}
+    else:
+        for field in ('latitude', 'longitude', 'location'):
+            market.pop(field, None)
+
+    market['schema_version'] = SCHEMA_VERSION
+    return market
+
+def canonical_update(doc):
+    """Return the $set/$unset update that rewrites doc into the canonical schema"""
+    market = canonicalize_market(doc)
+    market.pop('_id', None)
+    unset = {field: '' for field in doc if field != '_id' and field not in market}
+    update = {'$set': market}
+    if unset:
+        update['$unset'] = unset
+    return update
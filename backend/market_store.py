@@ -0,0 +1,108 @@
+"""
+Compact in-process store for the market list fields.
+
+A pymongo document costs a few kilobytes per market once every key, str
+and float is a separate Python object. MarketStore keeps the list
+endpoint's fields (market_schema.LIST_FIELDS) in the columns snapshot.py
+writes to disk, held in memory instead of mapped from a directory:
+
+    text fields     dictionary-encoded: int32 codes into one UTF-8 blob
+                    plus int64 offsets, so repeated cities, states and
+                    ZIP codes are stored once
+    coordinates     float64, rating float64, NaN where missing
+    _id             S12 raw ObjectId bytes, sorted
+
+Lookups by ObjectId are a binary search over the sorted _id column and
+USDA listing ids have their own sorted key array, so no per-market
+Python objects are kept. documents() and json_rows() read a page one
+column at a time and give the same values the dict-based endpoints
+return. record() is there for code that wants objects.
+benchmarks/bench_market_store.py compares memory use with plain dicts.
+"""
+import json
+
+import numpy as np
+
+from market_schema import LIST_FIELDS
+from snapshot import SNAPSHOT_FORMAT, MarketSnapshot, encode_columns
+
+class MarketRecord:
+    """One market as attributes, for callers that want an object"""
+    __slots__ = ('_id',) + tuple(LIST_FIELDS)
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+class MarketStore(MarketSnapshot):
+    """Snapshot columns for a fixed set of fields, held in memory"""
+
+    def __init__(self, manifest, arrays, fields=LIST_FIELDS):
+        self.directory = None
+        self.fields = list(fields)
+        self._open(manifest, arrays)
+
+    @classmethod
+    def from_markets(cls, markets, fields=LIST_FIELDS):
+        """Build from market documents sorted by _id (any iterable, read once)"""
+        keep = ('_id',) + tuple(fields)
+        count, columns, arrays = encode_columns(
+            {field: market[field] for field in keep if field in market} for market in markets)
+        ids = arrays.get('_id')
+        if ids is not None and columns['_id']['kind'] == 'objectid' and np.any(ids[1:] < ids[:-1]):
+            raise ValueError("MarketStore.from_markets needs markets sorted by _id")
+        return cls({'format': SNAPSHOT_FORMAT, 'count': count, 'columns': columns}, arrays, fields)
+
+    @property
+    def nbytes(self):
+        """Memory held by the store's arrays"""
+        return sum(array.nbytes for array in self._arrays.values())
+
+    def row_of(self, market_id):
+        """Row for an ObjectId hex string or USDA listing id, or None"""
+        return self.find(market_id)
+
+    def rows_for_state(self, state):
+        return self.filter(state)
+
+    def document(self, row, fields=None):
+        """The market as a dict shaped like the list endpoint's documents"""
+        return super().document(row, fields or self.fields)
+
+    def record(self, row):
+        return MarketRecord(_id=self.value('_id', row), **self.document(row))
+
+    def documents(self, rows, fields=None):
+        """document() for many rows, gathering each column once"""
+        rows = np.asarray(rows, dtype=np.int64)
+        documents = [{} for _ in range(len(rows))]
+        for field in fields or self.fields:
+            kind = self.kinds.get(field)
+            if kind is None:
+                continue
+            if kind in ('str', 'json'):
+                codes = self._array(f'{field}.codes')[rows]
+                present = codes >= 0
+                offsets = self._array(f'{field}.offsets')
+                data = memoryview(self._array(f'{field}.data'))
+                entries = iter([str(data[start:end], 'utf-8') for start, end in zip(
+                    offsets[codes[present]].tolist(), offsets[codes[present] + 1].tolist())])
+                if kind == 'json':
+                    entries = map(json.loads, entries)
+                values = [next(entries) if here else None for here in present.tolist()]
+            elif kind == 'float':
+                values = [value if value == value else None for value in self._array(field)[rows].tolist()]
+            else:
+                values = [self._scalar(kind, value) for value in self._array(field)[rows]]
+            nulls = (np.isin(rows, self._array(f'{field}.nulls')).tolist()
+                     if self.manifest['columns'][field].get('nulls') else None)
+            for position, (document, value) in enumerate(zip(documents, values)):
+                if value is not None:
+                    document[field] = value
+                elif nulls is not None and nulls[position]:
+                    document[field] = None
+        return documents
+
+    def json_rows(self, rows, fields=None):
+        """JSON array bytes for rows, ready to be spliced into a response body"""
+        return json.dumps(self.documents(rows, fields)).encode('utf-8')
@@ -0,0 +1,222 @@
+"""
+Request and MongoDB instrumentation exposed in Prometheus text format.
+
+init_metrics(app) times every request per route with before/after request
+hooks and serves GET /metrics. The pymongo listeners returned by
+mongo_listeners() time every command, count the commands each request
+sends, and track connection pool checkouts. Pass them to MongoClient.
+
+Metrics live in the worker process, so with several gunicorn workers each
+scrape sees the worker that answered it. Scrape every worker (or run one
+worker per container) to get the full picture.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request, Response
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        return Counter.render(self)
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {count}")
+        return lines
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route', ('route', 'method', 'status'))
+REQUEST_MONGO_COMMANDS = Histogram(
+    'http_request_mongo_commands', 'MongoDB commands sent while serving a request', ('route',),
+    buckets=COUNT_BUCKETS)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'Requests currently being served')
+MONGO_COMMAND_LATENCY = Histogram(
+    'mongo_command_duration_seconds', 'MongoDB command round-trip time', ('command', 'status'))
+MONGO_POOL_CONNECTIONS = Gauge(
+    'mongo_pool_connections', 'Open connections in the MongoDB pool', ('address',))
+MONGO_POOL_CHECKED_OUT = Gauge(
+    'mongo_pool_checked_out', 'Connections currently checked out of the pool', ('address',))
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    'mongo_pool_checkout_failures_total', 'Failed connection checkouts', ('address', 'reason'))
+
+REGISTRY = [REQUEST_LATENCY, REQUEST_MONGO_COMMANDS, REQUESTS_IN_PROGRESS, MONGO_COMMAND_LATENCY,
+            MONGO_POOL_CONNECTIONS, MONGO_POOL_CHECKED_OUT, MONGO_POOL_CHECKOUT_FAILURES]
+
+# Commands sent by the current thread since its request started
+_request_state = threading.local()
+
+class CommandTimer(monitoring.CommandListener):
+    """Records the duration of every MongoDB command"""
+
+    def started(self, event):
+        _request_state.commands = getattr(_request_state, 'commands', 0) + 1
+
+    def succeeded(self, event):
+        MONGO_COMMAND_LATENCY.observe(event.duration_micros / 1e6, event.command_name, 'ok')
+
+    def failed(self, event):
+        MONGO_COMMAND_LATENCY.observe(event.duration_micros / 1e6, event.command_name, 'error')
+
+class PoolTracker(monitoring.ConnectionPoolListener):
+    """Tracks open and checked-out connections per server"""
+
+    def _address(self, event):
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc(self._address(event))
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec(self._address(event))
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKED_OUT.inc(self._address(event))
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec(self._address(event))
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.inc(self._address(event), str(event.reason))
+
+    # Remaining pool events are not needed for these metrics
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+def mongo_listeners():
+    """Event listeners to pass to MongoClient(event_listeners=...)"""
+    return [CommandTimer(), PoolTracker()]
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def init_metrics(app):
+    """Register the timing hooks and the /metrics endpoint on a Flask app"""
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        _request_state.commands = 0
+        REQUESTS_IN_PROGRESS.inc()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            route = _route()
+            REQUEST_LATENCY.observe(time.perf_counter() - started, route, request.method, response.status_code)
+            REQUEST_MONGO_COMMANDS.observe(getattr(_request_state, 'commands', 0), route)
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        # teardown runs even when after_request is skipped, so the gauge cannot leak
+        if g.pop('metrics_started', None) is not None:
+            REQUESTS_IN_PROGRESS.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus scrape endpoint"""
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,258 @@
+"""
+Precomputed nearest markets for market detail pages.
+
+rebuild_nearby() finds the NEARBY_K nearest markets within
+NEARBY_MAX_MILES of every market and stores them in `market_neighbors`,
+one document per market:
+
+    {_id: market _id, neighbors: [ObjectId, ...], miles: [float, ...],
+     at: [lng, lat], radius: miles to the farthest neighbour kept}
+
+GET /api/markets/<id>?nearby=5 embeds the first five neighbours. This
+costs two _id lookups instead of a $near query.
+
+The search is exact and vectorised. Markets are placed on the unit
+sphere as 3-D points and binned into a uniform grid. Each grid cell's
+markets are compared with those of the surrounding block of cells. The
+block grows until it provably holds the k nearest, because anything
+outside a block of half-width r cells is at least r cells away.
+Straight-line (chord) distance ranks points the same way as great-circle
+distance, and the 3-D grid has no poles or antimeridian to special-case.
+
+Rebuilds are incremental. `at` records where each market was when its
+list was computed, so a rebuild only recomputes markets that are new or
+moved, markets whose list mentions a moved or deleted market, and
+markets that a moved or new market is now closer to than their farthest
+neighbour. Pass full=True (scripts/rebuild_nearby.py --full) after
+changing NEARBY_K or NEARBY_MAX_MILES.
+"""
+import itertools
+import math
+import os
+import sys
+import time
+
+import numpy as np
+from bson import ObjectId
+from pymongo import DeleteMany, ReplaceOne
+
+from fuzzy_search import EARTH_RADIUS_MILES
+
+NEARBY_K = int(os.getenv('NEARBY_K', 10))
+NEARBY_MAX_MILES = float(os.getenv('NEARBY_MAX_MILES', 100))
+
+# What the detail page shows for each nearby market
+NEARBY_PROJECTION = {'market_name': 1, 'city': 1, 'state': 1, 'latitude': 1, 'longitude': 1,
+                     'USDA_listing_id': 1, 'image_url': 1}
+NEARBY_FIELDS = ['_id'] + list(NEARBY_PROJECTION)
+
+def unit_vectors(lats, lngs):
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lng = np.radians(np.asarray(lngs, dtype=np.float64))
+    return np.column_stack((np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)))
+
+def chord_for_miles(miles):
+    return 2 * math.sin(min(miles / EARTH_RADIUS_MILES, math.pi) / 2)
+
+def miles_for_chord(chord):
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+class PointIndex:
+    """Uniform 3-D grid over unit vectors, for exact nearest-neighbour and radius queries"""
+
+    def __init__(self, points, per_cell=4, cell_size=None):
+        self.points = points
+        count = len(points)
+        if cell_size is None:
+            extent = float((points.max(axis=0) - points.min(axis=0)).max()) if count else 1.0
+            # Markets lie on a surface, so ~count/per_cell cells means sqrt of that per axis
+            cell_size = extent / math.sqrt(max(count / per_cell, 1))
+        self.cell_size = max(cell_size, 1e-6)
+        self.cells = np.floor(points / self.cell_size).astype(np.int64)
+        # Blocks wider than this already hold every point
+        self.span = int((self.cells.max(axis=0) - self.cells.min(axis=0)).max()) if count else 0
+        keys = self._keys(self.cells)
+        self.order = np.argsort(keys, kind='stable')
+        cell_keys, starts, counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self._ranges = dict(zip(cell_keys.tolist(), zip(starts.tolist(), (starts + counts).tolist())))
+
+    @staticmethod
+    def _keys(cells):
+        # Cell coordinates span under 2 / 1e-6 < 2**21 per axis: pack three into an int64
+        shifted = cells + (1 << 20)
+        return (shifted[..., 0] << 42) | (shifted[..., 1] << 21) | shifted[..., 2]
+
+    def chords(self, rows, candidates):
+        """Straight-line distances between two sets of rows, as a len(rows) x len(candidates) matrix"""
+        # |p - q|^2 = 2 - 2 p.q for unit vectors: one matrix product
+        dots = self.points[rows] @ self.points[candidates].T
+        return np.sqrt(np.maximum(2 - 2 * dots, 0))
+
+    def block(self, cell, r):
+        """Rows in the cells within r steps of cell along every axis"""
+        offsets = np.arange(-r, r + 1)
+        grid = np.stack(np.meshgrid(offsets, offsets, offsets, indexing='ij'), axis=-1).reshape(-1, 3)
+        slices = [self._ranges.get(key) for key in self._keys(grid + cell).tolist()]
+        parts = [self.order[start:end] for start, end in filter(None, slices)]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def by_cell(self, rows, chunk=256):
+        """Group rows by grid cell: yields (cell coordinates, up to chunk rows in it)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not rows.size:
+            return
+        keys = self._keys(self.cells[rows])
+        order = np.argsort(keys, kind='stable')
+        _, starts = np.unique(keys[order], return_index=True)
+        for group in np.split(rows[order], starts[1:]):
+            for start in range(0, len(group), chunk):
+                yield self.cells[group[0]], group[start:start + chunk]
+
+    def nearest(self, rows, k, max_chord):
+        """Yield (row, neighbour rows nearest first, chord distances) for each of rows"""
+        for cell, group in self.by_cell(rows):
+            r = 1
+            while True:
+                candidates = self.block(cell, r)
+                distances = self.chords(group, candidates)
+                distances[group[:, None] == candidates[None, :]] = np.inf
+                distances[distances > max_chord] = np.inf
+                take = min(k, len(candidates))
+                nearest = np.argpartition(distances, take - 1, axis=1)[:, :take]
+                kth = np.take_along_axis(distances, nearest, axis=1).max(axis=1, initial=0)
+                # Exact once the block reaches past the cap or past every point's kth neighbour
+                if (r * self.cell_size >= max_chord or r >= self.span
+                        or (take == k and (kth <= r * self.cell_size).all())):
+                    break
+                r += 1
+            # Only the k partitioned off need sorting
+            nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1, kind='stable')
+            nearest = np.take_along_axis(nearest, order, axis=1)
+            nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+            for i, row in enumerate(group.tolist()):
+                found = np.isfinite(nearest_distances[i])
+                yield row, candidates[nearest[i][found]], nearest_distances[i][found]
+
+    def within(self, rows, max_chord):
+        """Yield (row, rows within max_chord of it, their chord distances) for each of rows"""
+        r = max(1, min(math.ceil(max_chord / self.cell_size), self.span))
+        for cell, group in self.by_cell(rows):
+            candidates = self.block(cell, r)
+            distances = self.chords(group, candidates)
+            for i, row in enumerate(group.tolist()):
+                inside = (distances[i] <= max_chord) & (candidates != row)
+                yield row, candidates[inside], distances[i, inside]
+
+    def pairs_within(self, max_chord):
+        """(a, b) arrays of every pair of rows within max_chord of each other, a < b.
+
+        For radii up to one cell, where a pair always sits in the same or
+        adjacent cells: each of the 27 neighbouring cells is looked up for
+        all rows at once, with no per-row or per-cell loop.
+        """
+        if max_chord > self.cell_size:
+            raise ValueError("pairs_within needs max_chord <= cell_size")
+        sorted_keys = self._keys(self.cells)[self.order]
+        rows = np.arange(len(self.points))
+        firsts, seconds = [], []
+        for offset in itertools.product((-1, 0, 1), repeat=3):
+            neighbour = self._keys(self.cells + np.array(offset))
+            starts = np.searchsorted(sorted_keys, neighbour, side='left')
+            sizes = np.searchsorted(sorted_keys, neighbour, side='right') - starts
+            # Expand each row's [start, start + size) range of the sorted rows
+            a = np.repeat(rows, sizes)
+            b = self.order[np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())]
+            keep = a < b
+            a, b = a[keep], b[keep]
+            close = np.einsum('ij,ij->i', self.points[a], self.points[b]) >= 1 - max_chord ** 2 / 2
+            firsts.append(a[close])
+            seconds.append(b[close])
+        return np.concatenate(firsts), np.concatenate(seconds)
+
+def _load_positions(db):
+    ids, lats, lngs = [], [], []
+    for market in db.markets.find({'latitude': {'$type': 'number'}, 'longitude': {'$type': 'number'}},
+                                  {'latitude': 1, 'longitude': 1}):
+        ids.append(market['_id'])
+        lats.append(market['latitude'])
+        lngs.append(market['longitude'])
+    return ids, lats, lngs
+
+def _referencing(db, market_ids, batch_size=10000):
+    """_ids of neighbour lists that mention any of market_ids"""
+    found = set()
+    for start in range(0, len(market_ids), batch_size):
+        batch = market_ids[start:start + batch_size]
+        found.update(doc['_id'] for doc in db.market_neighbors.find({'neighbors': {'$in': batch}}, {'_id': 1}))
+    return found
+
+def rebuild_nearby(db, full=False, k=NEARBY_K, max_miles=NEARBY_MAX_MILES, batch_size=5000):
+    """Recompute the neighbour lists affected by markets changed since the last rebuild (all with full)"""
+    started = time.time()
+    ids, lats, lngs = _load_positions(db)
+    row_of = {market_id: row for row, market_id in enumerate(ids)}
+    stored = {doc['_id']: doc for doc in db.market_neighbors.find({}, {'at': 1, 'radius': 1})}
+    deleted = [market_id for market_id in stored if market_id not in row_of]
+
+    if full:
+        changed = list(range(len(ids)))
+    else:
+        changed = [row for row, market_id in enumerate(ids)
+                   if stored.get(market_id, {}).get('at') != [lngs[row], lats[row]]]
+    index = PointIndex(unit_vectors(lats, lngs).reshape(-1, 3))
+    max_chord = chord_for_miles(max_miles)
+    affected = set(changed)
+    if len(affected) < len(ids):
+        # Lists that mention a market that moved or went away
+        moved = [ids[row] for row in changed if ids[row] in stored]
+        affected.update(row_of[market_id] for market_id in _referencing(db, moved + deleted) if market_id in row_of)
+        # Markets a new or moved market is now closer to than their farthest neighbour
+        radius = np.array([chord_for_miles(stored[market_id].get('radius', max_miles)) if market_id in stored
+                           else max_chord for market_id in ids])
+        for _, rows, distances in index.within(changed, max_chord):
+            affected.update(rows[distances < radius[rows]].tolist())
+
+    operations = [DeleteMany({'_id': {'$in': deleted[start:start + batch_size]}})
+                  for start in range(0, len(deleted), batch_size)]
+    for row, neighbours, chords in index.nearest(sorted(affected), k, max_chord):
+        miles = miles_for_chord(chords)
+        operations.append(ReplaceOne({'_id': ids[row]}, {
+            'neighbors': [ids[neighbour] for neighbour in neighbours.tolist()],
+            'miles': np.round(miles, 2).tolist(),
+            'at': [lngs[row], lats[row]],
+            # Anything farther than this cannot join the list
+            'radius': float(miles[-1]) if len(miles) == k else max_miles,
+        }, upsert=True))
+        if len(operations) >= batch_size:
+            db.market_neighbors.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.market_neighbors.bulk_write(operations, ordered=False)
+    print(f"Rebuilt market_neighbors: {len(affected)} of {len(ids)} markets recomputed, "
+          f"{len(deleted)} removed in {time.time() - started:.1f}s", file=sys.stderr)
+    return len(affected)
+
+def nearby_markets(db, market_id, limit, snapshot=None):
+    """The first `limit` precomputed neighbours of a market (ObjectId or hex string), with their distance"""
+    if isinstance(market_id, str):
+        market_id = ObjectId(market_id)
+    doc = db.market_neighbors.find_one({'_id': market_id},
+                                       {'neighbors': {'$slice': limit}, 'miles': {'$slice': limit}})
+    if doc is None:
+        return []
+    if snapshot is not None:
+        rows = [snapshot.find(str(neighbour)) for neighbour in doc['neighbors']]
+        markets = {document['_id']: document
+                   for document in (snapshot.document(row, NEARBY_FIELDS) for row in rows if row is not None)}
+    else:
+        markets = {str(market['_id']): market
+                   for market in db.markets.find({'_id': {'$in': doc['neighbors']}}, NEARBY_PROJECTION)}
+    nearby = []
+    for neighbour, miles in zip(doc['neighbors'], doc['miles']):
+        market = markets.get(str(neighbour))
+        if market is not None:
+            market['_id'] = str(neighbour)
+            market['miles'] = miles
+            nearby.append(market)
+    return nearby
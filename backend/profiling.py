@@ -0,0 +1,312 @@
+"""
+On-demand profiling for live workers and batch jobs.
+
+init_profiling(app) adds three admin-only tools (X-Admin-Token must match
+ADMIN_TOKEN; with no token configured they are switched off):
+
+  per-request cProfile   send X-Profile: 1 with the admin token, or set
+                         PROFILE_SAMPLE_RATE to profile a share of all
+                         requests. Stats are dumped to PROFILE_DIR as .prof
+                         files (open with pstats or snakeviz); the file name
+                         comes back in the X-Profile-File header.
+  sampling profiler      POST /admin/profile/sampler?seconds=N samples every
+                         thread's stack (wall clock, so time spent waiting on
+                         MongoDB shows up) and writes folded stacks for
+                         flamegraph.pl / speedscope.
+  tracemalloc            POST /admin/profile/tracemalloc/start, then
+                         .../snapshot repeatedly: each snapshot returns the
+                         allocation growth since the previous one.
+
+Each gunicorn worker profiles itself; repeat a request until it lands on
+the worker you are after. profile_job() wraps import and backfill scripts
+and is switched on with PROFILE_JOBS=cpu or PROFILE_JOBS=memory.
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from flask import g, jsonify, request
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+MAX_SAMPLER_SECONDS = 300
+
+def admin_token_valid():
+    """True if the request carries the configured admin token"""
+    token = os.getenv('ADMIN_TOKEN')
+    supplied = request.headers.get('X-Admin-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+def admin_required(view):
+    """Reject requests without a valid X-Admin-Token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not os.getenv('ADMIN_TOKEN'):
+            return jsonify({'success': False, 'error': 'Admin endpoints are disabled (ADMIN_TOKEN not set)'}), 404
+        if not admin_token_valid():
+            return jsonify({'success': False, 'error': 'Invalid admin token'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def _dump_path(label, suffix):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', label).strip('-')[:60] or 'root'
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    return os.path.join(PROFILE_DIR, f"{stamp}-{os.getpid()}-{slug}{suffix}")
+
+def _prune_dumps():
+    """Keep only the newest PROFILE_MAX_FILES dumps"""
+    try:
+        files = sorted(os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR))
+    except OSError:
+        return
+    for path in files[:-PROFILE_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def top_functions(profiler, limit=20, sort='cumulative'):
+    """Text table of the most expensive functions in a profile"""
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+class StackSampler:
+    """Wall-clock sampling profiler over every thread of the process"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stop_at = None
+        self.interval = 0.005
+        self.output = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, interval=0.005):
+        with self._lock:
+            if self.running:
+                return False
+            self.counts = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.started_at = time.time()
+            self.stop_at = time.monotonic() + seconds
+            self.output = _dump_path('sampler', '.folded')
+            self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self.stop_at = 0
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while time.monotonic() < self.stop_at:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                self.counts[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        with open(self.output, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+        _prune_dumps()
+
+    def report(self, limit=20):
+        # Leaf frames: where each thread was when sampled
+        leaves = Counter()
+        for stack, count in self.counts.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return {
+            'running': self.running,
+            'started_at': datetime.utcfromtimestamp(self.started_at).isoformat() + 'Z' if self.started_at else None,
+            'samples': self.samples,
+            'interval_ms': self.interval * 1000,
+            'output': self.output,
+            'top_frames': [{'frame': frame, 'samples': count} for frame, count in leaves.most_common(limit)],
+            'top_stacks': [{'stack': stack, 'samples': count} for stack, count in self.counts.most_common(5)],
+        }
+
+sampler = StackSampler()
+
+class MemoryTracker:
+    """tracemalloc snapshots, each diffed against the previous one"""
+
+    def __init__(self):
+        self.previous = None
+        self.group_by = 'lineno'
+        self._lock = threading.Lock()
+
+    def start(self, frames=10, group_by='lineno'):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self.group_by = group_by
+            self.previous = tracemalloc.take_snapshot()
+
+    def snapshot(self, limit=20):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return None
+            current = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            stats = current.compare_to(self.previous, self.group_by) if self.previous else \
+                current.statistics(self.group_by)
+            self.previous = current
+            traced, peak = tracemalloc.get_traced_memory()
+        return {
+            'traced_kb': round(traced / 1024, 1),
+            'peak_kb': round(peak / 1024, 1),
+            'top': [{
+                'where': str(stat.traceback[0]) if stat.traceback else '?',
+                'size_kb': round(stat.size / 1024, 1),
+                'size_diff_kb': round(getattr(stat, 'size_diff', stat.size) / 1024, 1),
+                'count_diff': getattr(stat, 'count_diff', stat.count),
+            } for stat in stats[:limit]],
+        }
+
+    def stop(self):
+        with self._lock:
+            self.previous = None
+            tracemalloc.stop()
+
+memory_tracker = MemoryTracker()
+
+@contextmanager
+def profile_job(name, mode=None):
+    """
+    Profile a batch job when PROFILE_JOBS is set: 'cpu' dumps cProfile stats
+    and prints the top functions, 'memory' prints the biggest allocations.
+    """
+    mode = (mode or os.getenv('PROFILE_JOBS', '')).lower()
+    if mode in ('cpu', '1', 'true', 'yes'):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = _dump_path(name, '.prof')
+            profiler.dump_stats(path)
+            print(f"Profile of {name} written to {path}", file=sys.stderr)
+            print(top_functions(profiler), file=sys.stderr)
+    elif mode == 'memory':
+        tracemalloc.start(10)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            traced, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"Memory of {name}: {traced / 1e6:.1f}MB traced at exit, {peak / 1e6:.1f}MB peak",
+                  file=sys.stderr)
+            for stat in snapshot.statistics('lineno')[:20]:
+                print(f"  {stat}", file=sys.stderr)
+    else:
+        yield
+
+def init_profiling(app):
+    """Register the per-request profiler hooks and the /admin/profile endpoints"""
+
+    @app.before_request
+    def start_request_profile():
+        wanted = request.headers.get('X-Profile') == '1' and admin_token_valid()
+        if wanted or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def dump_request_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            try:
+                path = _dump_path(f"{request.method}-{request.path}", '.prof')
+                profiler.dump_stats(path)
+                _prune_dumps()
+                response.headers['X-Profile-File'] = os.path.basename(path)
+            except OSError as e:
+                print(f"Warning: could not write profile: {str(e)}", file=sys.stderr)
+        return response
+
+    @app.route('/admin/profile/sampler', methods=['POST'])
+    @admin_required
+    def start_sampler():
+        """Sample every thread's stack for `seconds` (default 10)"""
+        seconds = min(request.args.get('seconds', type=float, default=10), MAX_SAMPLER_SECONDS)
+        interval_ms = max(request.args.get('interval_ms', type=float, default=5), 1)
+        if not sampler.start(seconds, interval_ms / 1000):
+            return jsonify({'success': False, 'error': 'Sampler already running', **sampler.report()}), 409
+        return jsonify({'success': True, 'pid': os.getpid(), 'seconds': seconds, 'output': sampler.output})
+
+    @app.route('/admin/profile/sampler', methods=['GET'])
+    @admin_required
+    def sampler_report():
+        """Progress and hottest frames of the current (or last) sampling run"""
+        limit = request.args.get('limit', type=int, default=20)
+        return jsonify({'success': True, 'pid': os.getpid(), **sampler.report(limit)})
+
+    @app.route('/admin/profile/sampler', methods=['DELETE'])
+    @admin_required
+    def stop_sampler():
+        sampler.stop()
+        return jsonify({'success': True, 'pid': os.getpid(), **sampler.report()})
+
+    @app.route('/admin/profile/tracemalloc/start', methods=['POST'])
+    @admin_required
+    def start_tracemalloc():
+        """Start tracing allocations and take the first snapshot"""
+        group_by = request.args.get('group_by', 'lineno')
+        if group_by not in ('lineno', 'filename', 'traceback'):
+            return jsonify({'success': False, 'error': 'group_by must be lineno, filename or traceback'}), 400
+        memory_tracker.start(request.args.get('frames', type=int, default=10), group_by)
+        return jsonify({'success': True, 'pid': os.getpid()})
+
+    @app.route('/admin/profile/tracemalloc/snapshot', methods=['POST'])
+    @admin_required
+    def tracemalloc_snapshot():
+        """Allocation growth since the previous snapshot"""
+        diff = memory_tracker.snapshot(request.args.get('limit', type=int, default=20))
+        if diff is None:
+            return jsonify({'success': False, 'error': 'tracemalloc is not running'}), 409
+        return jsonify({'success': True, 'pid': os.getpid(), **diff})
+
+    @app.route('/admin/profile/tracemalloc/stop', methods=['POST'])
+    @admin_required
+    def stop_tracemalloc():
+        memory_tracker.stop()
+        return jsonify({'success': True, 'pid': os.getpid()})
@@ -0,0 +1,240 @@
+"""
+Per-client rate limiting and load shedding for the public API.
+
+Each client has a token bucket holding up to RATE_LIMIT_BURST tokens. The
+bucket refills at RATE_LIMIT_PER_MINUTE tokens a minute. A request spends
+its route's cost from ROUTE_COSTS, so search costs more than a detail
+lookup. An empty bucket gets a 429 with Retry-After. Every limited
+response carries RateLimit-Limit, RateLimit-Remaining and RateLimit-Reset
+headers.
+
+Clients are identified by an X-API-Key listed in RATE_LIMIT_API_KEYS,
+which may set its own per-minute limit. Anyone else is identified by IP.
+Behind a proxy, set RATE_LIMIT_PROXY_HOPS so the IP is taken from
+X-Forwarded-For. Render adds one hop.
+
+Buckets are stored per worker (RATE_LIMIT_STORAGE=memory) or shared
+between workers and instances in the `rate_limits` collection
+(RATE_LIMIT_STORAGE=mongodb). The memory store is the local stand-in for
+the shared one. If MongoDB cannot answer quickly, or the circuit breaker
+is open, the limiter falls back to the memory store rather than failing
+requests.
+
+Load shedding caps the total cost of requests in flight in one worker at
+MAX_IN_FLIGHT_COST. Expensive requests are turned away first with an
+immediate 429, so they do not queue until the time budget runs out. This
+only matters with threaded workers (gunicorn --threads).
+"""
+import contextlib
+import math
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from flask import g, jsonify, request
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from metrics import Counter, Gauge, REGISTRY
+from resilience import OPEN, REVALIDATE_FLAG, breaker
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', 120))
+RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', 60))
+RATE_LIMIT_STORAGE = os.getenv('RATE_LIMIT_STORAGE', 'memory')
+RATE_LIMIT_PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', 0))
+RATE_LIMIT_STORE_TIMEOUT_MS = int(os.getenv('RATE_LIMIT_STORE_TIMEOUT_MS', 100))
+MAX_IN_FLIGHT_COST = int(os.getenv('MAX_IN_FLIGHT_COST', 0))
+
+# Tokens spent per request, by endpoint; other api endpoints cost DEFAULT_COST
+ROUTE_COSTS = {
+    'api.search_markets': 5,
+    'api.get_markets': 2,
+    'api.get_state_counts': 2,
+    'api.get_viewport': 2,
+    'api.autocomplete_markets': 1,
+    'api.filter_markets': 1,
+    'api.get_rollups': 1,
+    'api.get_market_by_id': 1,
+    'upload_file': 20,
+}
+DEFAULT_COST = 1
+
+RATE_LIMITED = Counter('http_rate_limited_total', 'Requests rejected with a 429', ('route', 'reason'))
+IN_FLIGHT_COST = Gauge('http_in_flight_cost', 'Total cost of requests being served by this worker')
+REGISTRY.extend([RATE_LIMITED, IN_FLIGHT_COST])
+
+def parse_api_keys(value):
+    """'key1,key2=600' -> {'key1': None, 'key2': 600.0} (None: the default limit)"""
+    keys = {}
+    for item in (value or '').split(','):
+        key, _, limit = item.strip().partition('=')
+        if key:
+            keys[key] = float(limit) if limit else None
+    return keys
+
+API_KEYS = parse_api_keys(os.getenv('RATE_LIMIT_API_KEYS'))
+
+def route_cost(endpoint):
+    return ROUTE_COSTS.get(endpoint, DEFAULT_COST)
+
+class MemoryBuckets:
+    """Token buckets in this process, pruned of idle (full) clients"""
+
+    def __init__(self, max_clients=10000):
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, cost, capacity, rate):
+        """Spend cost tokens; returns (allowed, tokens left)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._prune(now, capacity, rate)
+            return allowed, tokens
+
+    def _prune(self, now, capacity, rate):
+        idle = [key for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * rate >= capacity]
+        for key in idle:
+            del self._buckets[key]
+
+class MongoBuckets:
+    """Token buckets shared through MongoDB, one atomic update per request"""
+
+    def __init__(self, get_db, fallback):
+        self.get_db = get_db
+        self.fallback = fallback
+        self._failing = False
+
+    def consume(self, key, cost, capacity, rate):
+        if breaker.state == OPEN:
+            return self.fallback.consume(key, cost, capacity, rate)
+        try:
+            # pymongo.timeout() needs pymongo 4.2; older installs rely on the client timeouts
+            deadline = (pymongo.timeout(RATE_LIMIT_STORE_TIMEOUT_MS / 1000) if hasattr(pymongo, 'timeout')
+                        else contextlib.nullcontext())
+            with deadline:
+                # Idle buckets are removed by the TTL index on expires_at (indexes.py)
+                bucket = self.get_db().rate_limits.find_one_and_update(
+                    {'_id': key}, self._pipeline(cost, capacity, rate),
+                    upsert=True, return_document=ReturnDocument.AFTER)
+        except PyMongoError as e:
+            if not self._failing:
+                print(f"Warning: rate limit store unavailable, limiting per worker: {str(e)[:200]}",
+                      file=sys.stderr)
+                self._failing = True
+            return self.fallback.consume(key, cost, capacity, rate)
+        self._failing = False
+        return bucket['allowed'], bucket['tokens']
+
+    @staticmethod
+    def _pipeline(cost, capacity, rate):
+        now = datetime.now(timezone.utc)
+        refilled = {'$min': [capacity, {'$add': [
+            {'$ifNull': ['$tokens', capacity]},
+            {'$multiply': [{'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}, rate / 1000]},
+        ]}]}
+        return [
+            {'$set': {'tokens': refilled, 'updated_at': now,
+                      'expires_at': now + timedelta(seconds=capacity / rate)}},
+            # Both fields read the refilled tokens from the stage above
+            {'$set': {'allowed': {'$gte': ['$tokens', cost]},
+                      'tokens': {'$cond': [{'$gte': ['$tokens', cost]}, {'$subtract': ['$tokens', cost]},
+                                           '$tokens']}}},
+        ]
+
+class InFlightLimiter:
+    """Caps the summed cost of concurrent requests in this worker"""
+
+    def __init__(self, max_cost):
+        self.max_cost = max_cost
+        self.cost = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, cost):
+        with self._lock:
+            # A request costing more than the cap is still let through when the worker is idle
+            if self.cost and self.cost + cost > self.max_cost:
+                return False
+            self.cost += cost
+            IN_FLIGHT_COST.set(self.cost)
+            return True
+
+    def release(self, cost):
+        with self._lock:
+            self.cost -= cost
+            IN_FLIGHT_COST.set(self.cost)
+
+def client_identity():
+    """(bucket key, per-minute limit) for the current request"""
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in API_KEYS:
+        return f'key:{api_key}', API_KEYS[api_key] or RATE_LIMIT_PER_MINUTE
+    route = request.access_route
+    if RATE_LIMIT_PROXY_HOPS and len(route) >= RATE_LIMIT_PROXY_HOPS:
+        return f'ip:{route[-RATE_LIMIT_PROXY_HOPS]}', RATE_LIMIT_PER_MINUTE
+    return f'ip:{request.remote_addr}', RATE_LIMIT_PER_MINUTE
+
+def _too_many(reason, retry_after, message):
+    RATE_LIMITED.inc(request.url_rule.rule if request.url_rule is not None else 'unmatched', reason)
+    response = jsonify({'success': False, 'error': 'Too many requests', 'message': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def init_rate_limits(app, get_db):
+    """Rate limit and shed load on the api blueprint and the costed app routes"""
+    memory_buckets = MemoryBuckets()
+    buckets = MongoBuckets(get_db, memory_buckets) if RATE_LIMIT_STORAGE == 'mongodb' else memory_buckets
+    in_flight = InFlightLimiter(MAX_IN_FLIGHT_COST)
+
+    @app.before_request
+    def admit():
+        # CORS preflights and background stale-cache refreshes are not client traffic
+        if request.method == 'OPTIONS' or request.environ.get(REVALIDATE_FLAG):
+            return None
+        if request.blueprint != 'api' and request.endpoint not in ROUTE_COSTS:
+            return None
+        cost = route_cost(request.endpoint)
+
+        # Shed before spending tokens, so a busy worker does not also drain the client's bucket
+        if MAX_IN_FLIGHT_COST > 0:
+            if not in_flight.acquire(cost):
+                return _too_many('shed', 1, 'The server is busy. Please try again shortly.')
+            g.in_flight_cost = cost
+
+        if RATE_LIMIT_PER_MINUTE > 0:
+            key, per_minute = client_identity()
+            rate = per_minute / 60
+            allowed, tokens = buckets.consume(key, cost, RATE_LIMIT_BURST, rate)
+            g.rate_limit = (RATE_LIMIT_BURST, tokens, rate)
+            if not allowed:
+                return _too_many('rate', math.ceil((cost - tokens) / rate),
+                                 'Rate limit exceeded. Please slow down.')
+        return None
+
+    @app.after_request
+    def rate_limit_headers(response):
+        limit = g.get('rate_limit')
+        if limit is not None:
+            capacity, tokens, rate = limit
+            response.headers['RateLimit-Limit'] = str(int(capacity))
+            response.headers['RateLimit-Remaining'] = str(int(tokens))
+            response.headers['RateLimit-Reset'] = str(math.ceil((capacity - tokens) / rate))
+        return response
+
+    @app.teardown_request
+    def release(exc):
+        cost = g.pop('in_flight_cost', None)
+        if cost is not None:
+            in_flight.release(cost)
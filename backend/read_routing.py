@@ -0,0 +1,77 @@
+"""
+Read preference and read concern for the public API's reads.
+
+Reads served by the `api` blueprint can go to secondaries so bulk jobs
+writing to the primary (update_states, imports, migrations) do not slow
+users down. Everything else - writes, admin and debug endpoints, and the
+scripts - keeps the client's default of primary reads.
+
+    MONGODB_READ_PREFERENCE        primary (default), primaryPreferred,
+                                   secondary, secondaryPreferred or nearest
+    MONGODB_MAX_STALENESS_SECONDS  skip secondaries lagging more than this
+                                   (at least 90; unset or -1 for no limit)
+    MONGODB_READ_TAGS              prefer members with these tags, e.g.
+                                   "use:reads,region:us-east"
+    MONGODB_READ_CONCERN           local, available or majority
+                                   (unset uses the server default)
+
+Against a standalone mongod every mode reads from that one server.
+"""
+import os
+
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+READ_CONCERNS = ('local', 'available', 'majority')
+
+# MongoDB rejects smaller maxStalenessSeconds values
+MIN_MAX_STALENESS = 90
+
+def parse_tags(value):
+    """'use:reads,region:us-east' -> [{'use': 'reads', 'region': 'us-east'}, {}]"""
+    if not value:
+        return None
+    tags = dict((key.strip(), tag.strip()) for key, tag in
+                (pair.split(':', 1) for pair in value.split(',') if ':' in pair))
+    # The trailing empty tag set falls back to any eligible member
+    return [tags, {}] if tags else None
+
+def read_preference(mode='primary', max_staleness=-1, tags=None):
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference {mode!r}; use one of {', '.join(READ_PREFERENCES)}")
+    if mode == 'primary':
+        if max_staleness != -1 or tags:
+            raise ValueError("max staleness and tags cannot be used with the primary read preference")
+        return Primary()
+    if max_staleness != -1 and max_staleness < MIN_MAX_STALENESS:
+        raise ValueError(f"max staleness must be at least {MIN_MAX_STALENESS} seconds, got {max_staleness}")
+    return READ_PREFERENCES[mode](tag_sets=tags, max_staleness=max_staleness)
+
+def api_read_options():
+    """Keyword arguments for MongoClient.get_database() used by the api blueprint"""
+    mode = os.getenv('MONGODB_READ_PREFERENCE') or 'primary'
+    max_staleness = int(os.getenv('MONGODB_MAX_STALENESS_SECONDS') or -1)
+    concern = os.getenv('MONGODB_READ_CONCERN') or None
+    if concern is not None and concern not in READ_CONCERNS:
+        raise ValueError(f"Unknown read concern {concern!r}; use one of {', '.join(READ_CONCERNS)}")
+    return {
+        'read_preference': read_preference(mode, max_staleness, parse_tags(os.getenv('MONGODB_READ_TAGS'))),
+        'read_concern': ReadConcern(concern),
+    }
+
+def describe(db):
+    """Read settings of a database handle, for debug output"""
+    preference = db.read_preference
+    return {
+        'read_preference': preference.mongos_mode,
+        'max_staleness': preference.max_staleness,
+        'tags': preference.tag_sets,
+        'read_concern': db.read_concern.level,
+    }
@@ -0,0 +1,289 @@
+"""
+Circuit breaker and stale-while-revalidate for the read endpoints.
+
+@resilient_read wraps the api views. Every good (200) response is kept in
+an in-memory cache keyed by path and query, bounded by entry count and
+by total size (STALE_CACHE_MAX_MB per worker). When a view fails
+because MongoDB is down or out of time budget, or the breaker is open,
+the last good response for that request is served instead, marked with
+`Warning: 110 - "Response is Stale"`, `X-Cache: STALE` and `Age`, and a
+background thread retries the request until it succeeds and refreshes
+the cache. Requests with nothing cached get a 503 with Retry-After.
+Only UNAVAILABLE_ERRORS (pymongo connection, server selection and
+timeout errors) count as failures; a view that fails in any other way,
+or answers with a 5xx status, leaves the breaker alone.
+
+The breaker trips when, over the last BREAKER_WINDOW_SECONDS (and at
+least BREAKER_MIN_CALLS calls), the share of failed calls or of calls
+slower than BREAKER_SLOW_MS passes its threshold. While open no request
+reaches MongoDB; after BREAKER_COOLDOWN_SECONDS one probe request is let
+through (half-open) and closes the breaker again if it succeeds. State
+is per worker process.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, jsonify, make_response, request
+from pymongo.errors import ConnectionFailure
+
+from deadlines import TIMEOUT_ERRORS
+from metrics import Counter, Gauge, REGISTRY
+
+# MongoDB slow or unreachable. Handlers re-raise these from their generic
+# `except Exception` so @resilient_read can serve a stale response.
+UNAVAILABLE_ERRORS = TIMEOUT_ERRORS + (ConnectionFailure,)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+CIRCUIT_STATE = Gauge('mongo_circuit_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)')
+STALE_RESPONSES = Counter('http_stale_responses_total', 'Responses served from the stale cache', ('reason',))
+REGISTRY.extend([CIRCUIT_STATE, STALE_RESPONSES])
+CIRCUIT_STATE.set(0)
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling MongoDB while the breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__('Database temporarily unavailable')
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=0.5, slow_threshold=0.8, slow_ms=2000, min_calls=10,
+                 window_seconds=30, cooldown_seconds=15):
+        self.failure_threshold = failure_threshold
+        self.slow_threshold = slow_threshold
+        self.slow_seconds = slow_ms / 1000
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.state = CLOSED
+        self.opened_at = 0
+        self._calls = deque()
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            print(f"Circuit breaker {self.state} -> {state}", file=sys.stderr)
+            self.state = state
+            CIRCUIT_STATE.set({CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[state])
+
+    def retry_after(self):
+        return max(1, int(self.opened_at + self.cooldown_seconds - time.monotonic()) + 1)
+
+    def allow(self):
+        """True if a call may go to the database now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, ok, duration):
+        now = time.monotonic()
+        with self._lock:
+            if self.state != CLOSED:
+                # The half-open probe decides; late results from before the trip are ignored
+                if self._probe_in_flight:
+                    self._probe_in_flight = False
+                    if ok and duration < self.slow_seconds:
+                        self._calls.clear()
+                        self._set_state(CLOSED)
+                    else:
+                        self.opened_at = now
+                        self._set_state(OPEN)
+                return
+            self._calls.append((now, ok, duration >= self.slow_seconds))
+            while self._calls and self._calls[0][0] < now - self.window_seconds:
+                self._calls.popleft()
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for _, call_ok, _ in self._calls if not call_ok)
+            slow = sum(1 for _, _, call_slow in self._calls if call_slow)
+            if failures / total >= self.failure_threshold or slow / total >= self.slow_threshold:
+                print(f"Circuit breaker tripped: {failures}/{total} failed, {slow}/{total} slow",
+                      file=sys.stderr)
+                self.opened_at = now
+                self._calls.clear()
+                self._set_state(OPEN)
+
+    def release_probe(self):
+        """Give up a half-open probe that ended without a database verdict"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def status(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'calls_in_window': len(self._calls),
+                'retry_after': self.retry_after() if self.state != CLOSED else None,
+            }
+
+class StaleCache:
+    """Last good response per request, LRU-bounded by entry count and total body bytes"""
+
+    def __init__(self, max_entries=1000, max_entry_bytes=512 * 1024, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, body, mimetype):
+        if len(body) > min(self.max_entry_bytes, self.max_bytes):
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= len(previous[0])
+            self._entries[key] = (body, mimetype, time.time())
+            self.nbytes += len(body)
+            # Evict least recently used entries until both bounds hold
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+breaker = CircuitBreaker(
+    failure_threshold=_env_float('BREAKER_FAILURE_THRESHOLD', 0.5),
+    slow_threshold=_env_float('BREAKER_SLOW_THRESHOLD', 0.8),
+    slow_ms=_env_float('BREAKER_SLOW_MS', 2000),
+    min_calls=int(os.getenv('BREAKER_MIN_CALLS', 10)),
+    window_seconds=_env_float('BREAKER_WINDOW_SECONDS', 30),
+    cooldown_seconds=_env_float('BREAKER_COOLDOWN_SECONDS', 15),
+)
+stale_cache = StaleCache(
+    max_entries=int(os.getenv('STALE_CACHE_ENTRIES', 1000)),
+    max_entry_bytes=int(os.getenv('STALE_CACHE_MAX_ENTRY_KB', 512)) * 1024,
+    max_bytes=int(os.getenv('STALE_CACHE_MAX_MB', 32)) * 1024 * 1024,
+)
+
+REVALIDATE_FLAG = 'farmers_market.revalidate'
+REFRESH_ATTEMPTS = 6
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def _cache_key():
+    return request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+
+def _schedule_refresh(app, key):
+    """Retry a request in the background until it succeeds and refreshes the cache"""
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def refresh():
+        try:
+            delay = 1
+            for _ in range(REFRESH_ATTEMPTS):
+                time.sleep(delay)
+                delay = min(delay * 2, breaker.cooldown_seconds)
+                with app.test_request_context(key, environ_base={REVALIDATE_FLAG: True}):
+                    response = app.full_dispatch_request()
+                if response.status_code == 200:
+                    return
+        except Exception as e:
+            print(f"Warning: background refresh of {key} failed: {str(e)}", file=sys.stderr)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=refresh, name='stale-refresh', daemon=True).start()
+
+def _stale_response(key, reason):
+    entry = stale_cache.get(key)
+    if entry is None:
+        return None
+    body, mimetype, stored_at = entry
+    STALE_RESPONSES.inc(reason)
+    response = make_response(body)
+    response.mimetype = mimetype
+    response.headers['Warning'] = '110 - "Response is Stale"'
+    response.headers['X-Cache'] = 'STALE'
+    response.headers['Age'] = str(int(time.time() - stored_at))
+    if not request.environ.get(REVALIDATE_FLAG):
+        _schedule_refresh(current_app._get_current_object(), key)
+    return response
+
+def resilient_read(view):
+    """Serve the last good response when MongoDB fails or the breaker is open"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = _cache_key()
+        revalidating = request.environ.get(REVALIDATE_FLAG, False)
+        if not breaker.allow():
+            stale = None if revalidating else _stale_response(key, 'circuit_open')
+            if stale is not None:
+                return stale
+            raise CircuitOpenError(breaker.retry_after())
+
+        started = time.perf_counter()
+        try:
+            response = make_response(view(*args, **kwargs))
+        except UNAVAILABLE_ERRORS:
+            breaker.record(False, time.perf_counter() - started)
+            stale = None if revalidating else _stale_response(key, 'error')
+            if stale is not None:
+                return stale
+            raise
+        except BaseException:
+            breaker.release_probe()
+            raise
+
+        if response.status_code >= 500:
+            # A handler error (a bug or bad input), not MongoDB failing: those raise
+            # UNAVAILABLE_ERRORS above. It says nothing about the database either way.
+            breaker.release_probe()
+            return response
+        breaker.record(True, time.perf_counter() - started)
+        if response.status_code == 200:
+            stale_cache.put(key, response.get_data(), response.mimetype)
+            response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+def init_resilience(app):
+    """Answer an open breaker or an unreachable database with a 503"""
+
+    @app.errorhandler(CircuitOpenError)
+    @app.errorhandler(ConnectionFailure)
+    def database_unavailable(e):
+        retry_after = e.retry_after if isinstance(e, CircuitOpenError) else int(breaker.cooldown_seconds)
+        response = jsonify({
+            'success': False,
+            'error': 'Database temporarily unavailable',
+            'message': 'The server is busy. Please try again shortly.'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    @app.route('/debug/circuit', methods=['GET'])
+    def debug_circuit():
+        """Circuit breaker state and stale cache size"""
+        return jsonify({'success': True, **breaker.status(), 'stale_entries': len(stale_cache)})
@@ -0,0 +1,129 @@
+"""
+Market counts rolled up by state, city and ZIP code.
+
+rebuild_rollups() materialises one collection per level with a $group
+aggregation that ends in $out, so MongoDB does the grouping and each
+collection is swapped in whole:
+
+    state_rollups   {state, count, with_images, avg_rating, latitude, longitude}
+    city_rollups    the same per (state, city)
+    zip_rollups     the same per zipCode, with the state of its first market
+
+latitude/longitude is the mean position of the markets in the group and
+avg_rating ignores markets without a rating. The importers rebuild the
+rollups after every import, and so does anything else that rewrites
+state or image fields (/update-states, update_state_field.py,
+refresh_place_ids.py); scripts/rebuild_rollups.py does it by hand.
+
+GET /api/markets/rollups/<level> serves them from an in-process cache:
+
+    state=CA           only this state's cities or ZIP codes
+    sort=count         count (default), name, avg_rating or with_images
+    order=desc         desc (default; asc for name)
+    limit=50           top N, at most ROLLUP_MAX_LIMIT
+
+The cache follows a version of its own in `meta`, bumped when the rollups
+are rewritten. Following the dataset version instead would let a worker
+cache the old rollups between an import's bump and the rebuild after it.
+"""
+import heapq
+import os
+import sys
+import time
+
+from market_cache import DatasetCache
+
+ROLLUP_META_ID = 'rollups'
+ROLLUP_MAX_LIMIT = int(os.getenv('ROLLUP_MAX_LIMIT', 1000))
+
+# Level -> collection, grouping fields and the field sort=name uses
+ROLLUPS = {
+    'state': {'collection': 'state_rollups', 'keys': ('state',), 'name': 'state'},
+    'city': {'collection': 'city_rollups', 'keys': ('state', 'city'), 'name': 'city'},
+    'zip': {'collection': 'zip_rollups', 'keys': ('zipCode',), 'name': 'zipCode'},
+}
+SORTS = ('count', 'name', 'avg_rating', 'with_images')
+
+def rollup_pipeline(level):
+    """$group the markets into the level's rollup collection"""
+    keys = ROLLUPS[level]['keys']
+    group = {
+        '_id': {key: f'${key}' for key in keys},
+        'count': {'$sum': 1},
+        'with_images': {'$sum': {'$cond': [{'$eq': ['$has_image', True]}, 1, 0]}},
+        # $avg skips missing and non-numeric values
+        'avg_rating': {'$avg': '$rating'},
+        'latitude': {'$avg': '$latitude'},
+        'longitude': {'$avg': '$longitude'},
+    }
+    if 'state' not in keys:
+        group['state'] = {'$first': '$state'}
+    return [
+        {'$match': {key: {'$type': 'string', '$ne': ''} for key in keys}},
+        {'$group': group},
+        {'$addFields': {key: f'$_id.{key}' for key in keys}},
+        {'$out': ROLLUPS[level]['collection']},
+    ]
+
+def get_rollup_version(db):
+    meta = db.meta.find_one({'_id': ROLLUP_META_ID}, {'version': 1})
+    return meta.get('version', 0) if meta else 0
+
+def rebuild_rollups(db):
+    """Rewrite every rollup collection from the markets collection"""
+    started = time.time()
+    for level in ROLLUPS:
+        # $out returns no documents; list() runs the pipeline
+        list(db.markets.aggregate(rollup_pipeline(level), allowDiskUse=True))
+    db.meta.update_one({'_id': ROLLUP_META_ID}, {'$inc': {'version': 1}}, upsert=True)
+    counts = {level: db[spec['collection']].estimated_document_count() for level, spec in ROLLUPS.items()}
+    print(f"Rebuilt rollups: {counts['state']} states, {counts['city']} cities, "
+          f"{counts['zip']} ZIP codes in {time.time() - started:.1f}s", file=sys.stderr)
+    return counts
+
+def _rounded(rollup):
+    rollup.pop('_id', None)
+    for field in ('avg_rating', 'latitude', 'longitude'):
+        if isinstance(rollup.get(field), float):
+            rollup[field] = round(rollup[field], 2 if field == 'avg_rating' else 5)
+    return rollup
+
+def build_rollups(db):
+    """{level: [rollup, ...]} from the rollup collections, in name order"""
+    return {level: [_rounded(rollup) for rollup in
+                    db[spec['collection']].find({}).sort([(key, 1) for key in spec['keys']])]
+            for level, spec in ROLLUPS.items()}
+
+rollup_cache = DatasetCache('rollups', build_rollups, version_of=get_rollup_version)
+
+def parse_rollup_query(level, sort=None, order=None, limit=None):
+    """Validated (sort, descending, limit); ValueError for anything out of range"""
+    if level not in ROLLUPS:
+        raise ValueError(f"level must be one of {', '.join(ROLLUPS)}")
+    sort = sort or 'count'
+    if sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    order = (order or ('asc' if sort == 'name' else 'desc')).lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+    limit = int(limit) if limit is not None else 50
+    if not 1 <= limit <= ROLLUP_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {ROLLUP_MAX_LIMIT}")
+    return sort, order == 'desc', limit
+
+def top_rollups(rollups, level, sort='count', descending=True, limit=50, state=None):
+    """(number of matching rollups, the first `limit` of them in sort order)"""
+    if state:
+        rollups = [rollup for rollup in rollups if rollup.get('state') == state]
+    field = ROLLUPS[level]['name'] if sort == 'name' else sort
+
+    # Ties keep the cached name order; rollups without the value (no rated markets) go last
+    def key(entry):
+        position, rollup = entry
+        value = rollup.get(field)
+        if descending:
+            return (value is not None, value if value is not None else 0, -position)
+        return (value is None, value if value is not None else 0, position)
+
+    pick = heapq.nlargest if descending else heapq.nsmallest
+    return len(rollups), [rollup for _, rollup in pick(limit, enumerate(rollups), key=key)]
@@ -0,0 +1,55 @@
+"""
+Write the ZIP centroid table that ZIP code search uses (see zip_index.py)
+from the Census Bureau's ZCTA gazetteer file
+(https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html).
+Without an argument the national file is downloaded from GAZETTEER_URL;
+a downloaded copy (.txt, or the .zip it comes in) can be passed instead:
+
+    python scripts/build_zip_centroids.py [2023_Gaz_zcta_national.zip] [--output data/zip_centroids.csv]
+
+The table has one zip,latitude,longitude row per ZCTA, sorted by ZIP code.
+build.sh runs this on deploy when no table is committed; commit the table
+so deployments never need to reach census.gov.
+"""
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from zip_index import ZIP_CENTROIDS_PATH  # noqa: E402
+
+GAZETTEER_URL = ('https://www2.census.gov/geo/docs/maps-data/data/gazetteer/'
+                 '2023_Gazetteer/2023_Gaz_zcta_national.zip')
+
+def build_table(source):
+    """zip,latitude,longitude DataFrame from a gazetteer file path or URL"""
+    # read_csv unpacks .zip sources itself
+    gazetteer = pd.read_csv(source, sep='\t', dtype={'GEOID': str})
+    # The last header carries trailing whitespace
+    gazetteer.columns = gazetteer.columns.str.strip()
+    return pd.DataFrame({
+        'zip': gazetteer['GEOID'].str.zfill(5),
+        'latitude': gazetteer['INTPTLAT'].round(5),
+        'longitude': gazetteer['INTPTLONG'].round(5),
+    }).dropna().sort_values('zip')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('gazetteer', nargs='?', default=GAZETTEER_URL,
+                        help='Census ZCTA gazetteer file or URL (tab-separated, optionally zipped)')
+    parser.add_argument('--output', default=ZIP_CENTROIDS_PATH)
+    args = parser.parse_args()
+    try:
+        table = build_table(args.gazetteer)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        table.to_csv(args.output, index=False)
+        print(f"Wrote {len(table)} ZIP centroids to {args.output}")
+    except Exception as e:
+        print(f"Error building ZIP centroids: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
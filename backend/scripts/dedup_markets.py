@@ -0,0 +1,74 @@
+"""
+Find duplicate markets and merge them (see dedup.py).
+
+Without --apply nothing is written: the merge decisions are printed, or
+saved as JSON lines with --output, for review. --apply writes them, bumps
+the dataset version and rebuilds the derived collections. If a snapshot
+is published under SNAPSHOT_DIR (see snapshot.py), a new one is exported
+so snapshot-serving workers stop listing the removed duplicates:
+
+    python scripts/dedup_markets.py --output merges.jsonl
+    python scripts/dedup_markets.py --apply [--min-score 0.8] [--max-miles 0.25]
+"""
+import argparse
+import json
+import os
+import sys
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dedup import DEDUP_MAX_MILES, DEDUP_MIN_SCORE, apply_merges, plan_merges  # noqa: E402
+from market_cache import bump_dataset_version  # noqa: E402
+from nearby import rebuild_nearby  # noqa: E402
+from profiling import profile_job  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from snapshot import refresh_snapshot  # noqa: E402
+from viewport import rebuild_clusters  # noqa: E402
+
+# Load environment variables
+load_dotenv()
+
+def get_db():
+    """Get MongoDB connection and database"""
+    mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
+    client = MongoClient(mongo_uri)
+    return client.farmers_market
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--apply', action='store_true', help='write the merges (default: only report them)')
+    parser.add_argument('--output', help='write the merge decisions to this file as JSON lines')
+    parser.add_argument('--min-score', type=float, default=DEDUP_MIN_SCORE)
+    parser.add_argument('--max-miles', type=float, default=DEDUP_MAX_MILES)
+    args = parser.parse_args()
+    try:
+        with profile_job('dedup_markets'):
+            db = get_db()
+            decisions = plan_merges(db, args.min_score, args.max_miles)
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as f:
+                    for decision in decisions:
+                        f.write(json.dumps(decision, default=str) + '\n')
+                print(f"Wrote {len(decisions)} merge decisions to {args.output}")
+            else:
+                for decision in decisions[:20]:
+                    print(json.dumps(decision, default=str))
+            print(f"{len(decisions)} markets to keep, "
+                  f"{sum(len(decision['remove']) for decision in decisions)} duplicates to remove")
+
+            if args.apply and decisions:
+                apply_merges(db, decisions)
+                bump_dataset_version(db)
+                rebuild_clusters(db)
+                rebuild_nearby(db)
+                rebuild_rollups(db)
+                refresh_snapshot(db)
+    except Exception as e:
+        print(f"Error deduplicating markets: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Export the markets collection as a columnar snapshot (see snapshot.py).
+
+Run it after every import or backfill, then serve reads from it with
+SNAPSHOT_SERVING=true. Workers pick up the new snapshot on their next
+check, with no restart needed:
+
+    python scripts/export_snapshot.py [--output snapshots] [--keep 2]
+"""
+import argparse
+import os
+import sys
+import time
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from snapshot import SNAPSHOT_DIR, export_snapshot  # noqa: E402
+from profiling import profile_job  # noqa: E402
+
+# Load environment variables
+load_dotenv()
+
+def get_db():
+    """Get MongoDB connection and database"""
+    mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
+    client = MongoClient(mongo_uri)
+    return client.farmers_market
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=SNAPSHOT_DIR, help='snapshot root directory (SNAPSHOT_DIR)')
+    parser.add_argument('--keep', type=int, default=2, help='snapshots to keep, including the new one')
+    args = parser.parse_args()
+    try:
+        started = time.time()
+        with profile_job('export_snapshot'):
+            directory, count = export_snapshot(get_db(), args.output, args.keep)
+        size = sum(entry.stat().st_size for entry in os.scandir(directory))
+        print(f"Exported {count} markets to {directory} ({size / 1e6:.1f} MB) "
+              f"in {time.time() - started:.1f}s")
+    except Exception as e:
+        print(f"Error exporting snapshot: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Run a throwaway local replica set for testing read routing.
+
+Starts `--members` mongod processes on consecutive ports, initiates them
+as one replica set and prints the connection string. Point the app or
+benchmarks/bench_api.py at it to exercise secondary reads:
+
+    python scripts/local_replica_set.py --members 3
+    MONGODB_URI='mongodb://127.0.0.1:27117,127.0.0.1:27118,127.0.0.1:27119/farmers_market?replicaSet=rs0' \\
+    MONGODB_READ_PREFERENCE=secondaryPreferred MONGODB_MAX_STALENESS_SECONDS=90 \\
+        python benchmarks/bench_api.py --scale 10000
+
+Needs mongod on PATH (or --mongod). Data lives in a temporary directory
+that is removed on Ctrl-C unless --keep is given.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+def wait_for(port, timeout=30):
+    client = MongoClient('127.0.0.1', port, directConnection=True, serverSelectionTimeoutMS=500)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client.admin.command('ping')
+            return client
+        except PyMongoError:
+            time.sleep(0.5)
+    raise RuntimeError(f"mongod on port {port} did not start within {timeout}s")
+
+def start_replica_set(members, base_port, name, data_dir, mongod='mongod'):
+    processes = []
+    for i in range(members):
+        port = base_port + i
+        dbpath = os.path.join(data_dir, f'member{i}')
+        os.makedirs(dbpath, exist_ok=True)
+        processes.append(subprocess.Popen(
+            [mongod, '--replSet', name, '--port', str(port), '--dbpath', dbpath,
+             '--bind_ip', '127.0.0.1', '--quiet', '--logpath', os.path.join(dbpath, 'mongod.log')]))
+    clients = [wait_for(base_port + i) for i in range(members)]
+
+    # The first member gets the highest priority so it is elected primary
+    clients[0].admin.command('replSetInitiate', {
+        '_id': name,
+        'members': [{'_id': i, 'host': f'127.0.0.1:{base_port + i}', 'priority': 2 if i == 0 else 1}
+                    for i in range(members)],
+    })
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        states = [m.get('stateStr') for m in clients[0].admin.command('replSetGetStatus')['members']]
+        if states.count('PRIMARY') == 1 and states.count('SECONDARY') == members - 1:
+            break
+        time.sleep(0.5)
+    else:
+        raise RuntimeError(f"replica set did not elect a primary: {states}")
+    hosts = ','.join(f'127.0.0.1:{base_port + i}' for i in range(members))
+    return processes, f'mongodb://{hosts}/farmers_market?replicaSet={name}'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=3)
+    parser.add_argument('--port', type=int, default=27117, help='port of the first member')
+    parser.add_argument('--name', default='rs0', help='replica set name')
+    parser.add_argument('--mongod', default='mongod', help='path to the mongod binary')
+    parser.add_argument('--data-dir', help='data directory (default: a temporary one)')
+    parser.add_argument('--keep', action='store_true', help='keep the data directory on exit')
+    args = parser.parse_args()
+
+    if shutil.which(args.mongod) is None:
+        print(f"Error: {args.mongod} not found; install MongoDB or pass --mongod")
+        sys.exit(1)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='farmers-market-rs-')
+    processes = []
+    try:
+        processes, uri = start_replica_set(args.members, args.port, args.name, data_dir, args.mongod)
+        print(f"Replica set {args.name} is up with {args.members} members")
+        print(f"MONGODB_URI={uri}")
+        print("Press Ctrl-C to stop")
+        sys.stdout.flush()
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        print("Error: a member exited")
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"Error starting replica set: {str(e)}")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+        if not args.keep and not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
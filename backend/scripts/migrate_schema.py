@@ -0,0 +1,125 @@
+"""
+Rewrite market documents into the canonical schema (see market_schema.py).
+
+The migration runs in batches ordered by _id and records its progress in
+the `migrations` collection after every batch, so an interrupted run picks
+up where it stopped. Documents already at the current schema_version are
+skipped, which also makes re-running it safe.
+
+    python scripts/migrate_schema.py [--batch-size 1000] [--dry-run] [--restart]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+from pymongo import MongoClient, UpdateOne
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from market_schema import SCHEMA_VERSION, canonical_update  # noqa: E402
+from indexes import reconcile_indexes  # noqa: E402
+from market_cache import bump_dataset_version  # noqa: E402
+from profiling import profile_job  # noqa: E402
+from nearby import rebuild_nearby  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from snapshot import refresh_snapshot  # noqa: E402
+from viewport import rebuild_clusters  # noqa: E402
+
+# Load environment variables
+load_dotenv()
+
+MIGRATION_ID = f'canonical_schema_v{SCHEMA_VERSION}'
+
+def get_db():
+    """Get MongoDB connection and database"""
+    mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
+    client = MongoClient(mongo_uri)
+    return client.farmers_market
+
+def migrate(db, batch_size=1000, dry_run=False, restart=False):
+    """Migrate all markets, resuming from the last recorded batch"""
+    markets = db.markets
+    progress = db.migrations.find_one({'_id': MIGRATION_ID}) or {}
+    if restart or progress.get('status') == 'complete':
+        progress = {}
+    last_id = progress.get('last_id')
+    migrated = progress.get('migrated', 0)
+
+    if last_id is not None:
+        print(f"Resuming {MIGRATION_ID} after _id {last_id} ({migrated} documents migrated so far)")
+    pending = markets.count_documents({'schema_version': {'$ne': SCHEMA_VERSION}})
+    print(f"{pending} documents to migrate")
+
+    if not dry_run:
+        # Legacy indexes (e.g. the unique index on `id`) would reject the rewritten documents
+        reconcile_indexes(db, build=False, collections=['markets'])
+
+    started = time.time()
+    while True:
+        query = {'schema_version': {'$ne': SCHEMA_VERSION}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        batch = list(markets.find(query).sort('_id', 1).limit(batch_size))
+        if not batch:
+            # Documents inserted behind the checkpoint while we ran get one more sweep
+            if not dry_run and last_id is not None and \
+                    markets.count_documents({'schema_version': {'$ne': SCHEMA_VERSION}}, limit=1):
+                last_id = None
+                continue
+            break
+
+        updates = [UpdateOne({'_id': doc['_id']}, canonical_update(doc)) for doc in batch]
+        last_id = batch[-1]['_id']
+        if dry_run:
+            if migrated == 0:
+                print(f"Example update for {batch[0]['_id']}: {canonical_update(batch[0])}")
+        else:
+            markets.bulk_write(updates, ordered=False)
+            db.migrations.update_one(
+                {'_id': MIGRATION_ID},
+                {'$set': {'last_id': last_id, 'status': 'running', 'updated_at': datetime.utcnow()},
+                 '$inc': {'migrated': len(batch)}},
+                upsert=True
+            )
+        migrated += len(batch)
+        rate = migrated / max(time.time() - started, 1e-6)
+        print(f"Migrated {migrated} documents ({rate:.0f}/s)")
+        sys.stdout.flush()
+
+    if dry_run:
+        print(f"Dry run: {migrated} documents would be migrated")
+        return migrated
+
+    reconcile_indexes(db, collections=['markets'])
+    db.migrations.update_one(
+        {'_id': MIGRATION_ID},
+        {'$set': {'status': 'complete', 'updated_at': datetime.utcnow()}},
+        upsert=True
+    )
+    bump_dataset_version(db)
+    # Coordinates may have moved into latitude/longitude
+    rebuild_clusters(db)
+    rebuild_nearby(db)
+    rebuild_rollups(db)
+    refresh_snapshot(db)
+    print(f"Migration complete: {migrated} documents migrated, canonical indexes in place")
+    return migrated
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true', help='show what would change without writing')
+    parser.add_argument('--restart', action='store_true', help='ignore recorded progress')
+    args = parser.parse_args()
+    try:
+        with profile_job('migrate_schema'):
+            migrate(get_db(), args.batch_size, args.dry_run, args.restart)
+    except Exception as e:
+        print(f"Error migrating schema: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
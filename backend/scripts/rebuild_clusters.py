@@ -0,0 +1,43 @@
+"""
+Recompute the map clusters behind /api/markets/viewport (see viewport.py).
+
+The importers run this themselves; use it after editing markets by hand
+or changing CLUSTER_MAX_ZOOM / CLUSTER_CELL_PX:
+
+    python scripts/rebuild_clusters.py [--max-zoom 12]
+"""
+import argparse
+import os
+import sys
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from viewport import CLUSTER_MAX_ZOOM, rebuild_clusters  # noqa: E402
+from profiling import profile_job  # noqa: E402
+
+# Load environment variables
+load_dotenv()
+
+def get_db():
+    """Get MongoDB connection and database"""
+    mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
+    client = MongoClient(mongo_uri)
+    return client.farmers_market
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-zoom', type=int, default=CLUSTER_MAX_ZOOM,
+                        help='zoom levels 0 .. max-zoom - 1 are clustered (CLUSTER_MAX_ZOOM)')
+    args = parser.parse_args()
+    try:
+        with profile_job('rebuild_clusters'):
+            rebuild_clusters(get_db(), args.max_zoom)
+    except Exception as e:
+        print(f"Error rebuilding clusters: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Recompute the precomputed nearby markets behind /api/markets/<id>?nearby=N
+(see nearby.py).
+
+The importers run this themselves. Only markets affected by changes since
+the last run are recomputed; pass --full after changing NEARBY_K or
+NEARBY_MAX_MILES:
+
+    python scripts/rebuild_nearby.py [--full]
+"""
+import argparse
+import os
+import sys
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nearby import rebuild_nearby  # noqa: E402
+from profiling import profile_job  # noqa: E402
+
+# Load environment variables
+load_dotenv()
+
+def get_db():
+    """Get MongoDB connection and database"""
+    mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
+    client = MongoClient(mongo_uri)
+    return client.farmers_market
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--full', action='store_true', help='recompute every market, not just the affected ones')
+    args = parser.parse_args()
+    try:
+        with profile_job('rebuild_nearby'):
+            rebuild_nearby(get_db(), full=args.full)
+    except Exception as e:
+        print(f"Error rebuilding nearby markets: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
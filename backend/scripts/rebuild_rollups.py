@@ -0,0 +1,38 @@
+"""
+Rewrite the state, city and ZIP code rollups behind
+/api/markets/rollups/<level> (see rollups.py).
+
+The importers run this themselves:
+
+    python scripts/rebuild_rollups.py
+"""
+import os
+import sys
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from profiling import profile_job  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+
+# Load environment variables
+load_dotenv()
+
+def get_db():
+    """Get MongoDB connection and database"""
+    mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
+    client = MongoClient(mongo_uri)
+    return client.farmers_market
+
+def main():
+    try:
+        with profile_job('rebuild_rollups'):
+            rebuild_rollups(get_db())
+    except Exception as e:
+        print(f"Error rebuilding rollups: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Apply the index definitions in indexes.py to the database.
+
+Builds missing indexes, rebuilds indexes whose definition changed and
+drops indexes that are no longer declared (including the legacy ones that
+used to clash on name, e.g. usda_listing_id_index). Afterwards prints
+$indexStats so unused indexes stand out.
+
+    python scripts/reconcile_indexes.py [--dry-run] [--keep-stale] [--stats-only]
+"""
+import argparse
+import os
+import sys
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from indexes import INDEX_SPECS, reconcile_indexes, index_usage  # noqa: E402
+
+# Load environment variables
+load_dotenv()
+
+def get_db():
+    """Get MongoDB connection and database"""
+    mongo_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/farmers_market')
+    client = MongoClient(mongo_uri)
+    return client.farmers_market
+
+def print_report(report, dry_run):
+    prefix = "Would " if dry_run else ""
+    for collection_name, diff in report.items():
+        print(f"\n{collection_name}:")
+        if not any(diff.values()):
+            print("  indexes match the spec")
+        for name in diff['missing']:
+            print(f"  {prefix}build missing index {name}")
+        for name in diff['changed']:
+            print(f"  {prefix}rebuild changed index {name}")
+        for name in diff['stale']:
+            print(f"  stale index {name} (not in spec)")
+
+def print_usage(db):
+    for collection_name in INDEX_SPECS:
+        try:
+            usage = index_usage(db, collection_name)
+        except Exception as e:
+            print(f"\nCould not read $indexStats for {collection_name}: {str(e)}")
+            continue
+        print(f"\n{collection_name} index usage since {min((u['since'] for u in usage if u['since']), default='n/a')}:")
+        for entry in usage:
+            flag = "  <- unused" if entry['ops'] == 0 and entry['name'] != '_id_' else ""
+            print(f"  {entry['name']:<28} {entry['ops']:>10} ops{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='only report the differences')
+    parser.add_argument('--keep-stale', action='store_true', help='do not drop indexes missing from the spec')
+    parser.add_argument('--stats-only', action='store_true', help='only print $indexStats')
+    args = parser.parse_args()
+
+    try:
+        db = get_db()
+        if not args.stats_only:
+            report = reconcile_indexes(db, dry_run=args.dry_run, drop_stale=not args.keep_stale)
+            print_report(report, args.dry_run)
+        print_usage(db)
+    except Exception as e:
+        print(f"Error reconciling indexes: {str(e)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
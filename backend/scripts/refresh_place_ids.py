@@ -2,8 +2,16 @@ from googlemaps import Client
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
+import sys
 import time
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from market_cache import bump_dataset_version  # noqa: E402
+from market_fields import STREETVIEW_URL, add_derived_fields  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from snapshot import refresh_snapshot  # noqa: E402
+
 # Load environment variables
 load_dotenv()
 
@@ -20,12 +28,12 @@ def refresh_place_id(market):
     """Refresh the Place ID for a single market"""
     try:
         # Get market name and address
-        name = market.get('MarketName', '')
-        address = market.get('Address', '')
+        name = market.get('market_name', '')
+        address = market.get('market_address', '')
         
         if not name or not address:
             print(f"Skipping market {market.get('_id')}: Missing name or address")
-            return
+            return False
         
         # Search for the place
         places_result = gmaps.places(
@@ -39,20 +47,29 @@ def refresh_place_id(market):
             # Get the first result
             place = places_result['results'][0]
             
-            # Update the market document with new Place ID
-            markets.update_one(
-                {'_id': market['_id']},
-                {'$set': {'place_id': place['place_id']}}
-            )
+            # Re-derive image_url and has_image for the new place; a Street View
+            # URL generated for the old place must not survive the refresh
+            refreshed = dict(market, place_id=place['place_id'])
+            if str(refreshed.get('image_url')).startswith(STREETVIEW_URL.split('?')[0]):
+                refreshed.pop('image_url')
+            add_derived_fields([refreshed])
+            fields = {field: refreshed.get(field) for field in ('place_id', 'image_url', 'has_image')}
+            
+            # Update the market document with the new Place ID and image fields together
+            markets.update_one({'_id': market['_id']}, {'$set': fields})
             print(f"Updated Place ID for {name}: {place['place_id']}")
+            updated = True
         else:
             print(f"No results found for {name}")
+            updated = False
             
         # Sleep to avoid hitting rate limits
         time.sleep(0.5)
+        return updated
         
     except Exception as e:
         print(f"Error processing {market.get('_id')}: {str(e)}")
+        return False
 
 def main():
     """Main function to refresh all Place IDs"""
@@ -67,13 +84,20 @@ def main():
     })
     
     count = 0
+    updated = 0
     for market in markets_to_update:
-        refresh_place_id(market)
+        updated += refresh_place_id(market)
         count += 1
         if count % 10 == 0:
             print(f"Processed {count} markets...")
     
-    print(f"Completed! Processed {count} markets.")
+    if updated:
+        # Let the in-process caches pick up the new image fields
+        bump_dataset_version(db)
+        # The rollups count markets with images
+        rebuild_rollups(db)
+        refresh_snapshot(db)
+    print(f"Completed! Processed {count} markets, updated {updated}.")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
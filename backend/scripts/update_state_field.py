@@ -4,6 +4,14 @@ from pymongo import MongoClient, UpdateOne
 from dotenv import load_dotenv
 import re
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from indexes import reconcile_indexes  # noqa: E402
+from market_cache import bump_dataset_version  # noqa: E402
+from profiling import profile_job  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from snapshot import refresh_snapshot  # noqa: E402
+
 # Load environment variables
 load_dotenv()
 
@@ -66,7 +74,7 @@ def update_state_fields():
         print(f"Processing {len(all_markets)} markets...")
         
         for market in all_markets:
-            state = extract_state(market.get('Address'))
+            state = extract_state(market.get('market_address'))
             if state:
                 updates.append(
                     UpdateOne(
@@ -77,11 +85,13 @@ def update_state_fields():
         
         if updates:
             result = markets.bulk_write(updates)
+            bump_dataset_version(db)
             print(f"Updated {result.modified_count} markets with state information")
+            rebuild_rollups(db)
+            refresh_snapshot(db)
             
-            # Create index on state field
-            markets.create_index('state')
-            print("Created index on state field")
+            # Make sure the declared indexes (including state) exist
+            reconcile_indexes(db, drop_stale=False)
         else:
             print("No updates needed")
             
@@ -90,4 +100,5 @@ def update_state_fields():
         sys.exit(1)
 
 if __name__ == '__main__':
-    update_state_fields() 
\ No newline at end of file
+    with profile_job('update_state_field'):
+        update_state_fields() 
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Request coalescing for identical concurrent reads.
+
+When several threads of a worker (gthread/gevent workers) ask for the same
+thing at once - page 1 after a deploy, state-counts after a CDN purge -
+only the first runs the query; the others wait for it and get the same
+result. Results are shared between callers, so they must be treated as
+read-only (the handlers only jsonify them). Errors are shared too.
+
+Set SINGLE_FLIGHT=false to run every request independently.
+"""
+import os
+import threading
+
+from pymongo.errors import ExecutionTimeout
+
+from metrics import Counter, REGISTRY
+
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT', 'true').lower() not in ('0', 'false', 'no')
+# Followers stop waiting after this long (the leader's own time budget normally ends it first)
+WAIT_TIMEOUT = int(os.getenv('REQUEST_TIME_BUDGET_MS', 10000)) / 1000 + 1
+
+COALESCED_REQUESTS = Counter(
+    'http_coalesced_requests_total', 'Requests answered by an identical in-flight request', ('key',))
+REGISTRY.append(COALESCED_REQUESTS)
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+class SingleFlight:
+    """Run fn() once per key among concurrent callers"""
+
+    def __init__(self, enabled=True, wait_timeout=WAIT_TIMEOUT):
+        self.enabled = enabled
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+
+        if not leader:
+            COALESCED_REQUESTS.inc(key[0])
+            if not call.done.wait(self.wait_timeout):
+                raise ExecutionTimeout(f"Timed out waiting for an identical in-flight request ({key[0]})")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return {key: call.followers for key, call in self._calls.items()}
+
+single_flight = SingleFlight(enabled=SINGLE_FLIGHT_ENABLED)
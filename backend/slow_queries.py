@@ -0,0 +1,195 @@
+"""
+Slow MongoDB operation log with sampled explain plans.
+
+SlowQueryLog is a pymongo CommandListener. Reads that take longer than
+SLOW_QUERY_MS are recorded with their query shape (the filter with every
+value replaced by "?") and logged. A sample of them (SLOW_QUERY_EXPLAIN_SAMPLE)
+is re-run as explain('executionStats') on a background thread, never on
+the request path, so the log shows whether the plan was a COLLSCAN, a
+$text plan or a deep skip. Recent entries are served by
+/debug/slow-queries.
+"""
+import hashlib
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import has_request_context, request
+from pymongo import monitoring
+
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct'}
+
+# Session/cluster fields that cannot be sent back inside an explain
+_COMMAND_NOISE = {'lsid', '$db', '$clusterTime', '$readPreference', 'txnNumber', 'maxTimeMS',
+                  'readConcern', 'cursor', 'batchSize', 'singleBatch', 'comment'}
+
+def normalize_filter(value):
+    """Replace the values of a filter with '?', keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: normalize_filter(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        # $and/$or keep their clauses; value lists ($in, coordinates) collapse to '?'
+        return [normalize_filter(item) for item in value] if value and isinstance(value[0], dict) else '?'
+    return '?'
+
+def query_shape(command_name, command):
+    """Describe what was queried, without the values, for grouping slow operations"""
+    shape = {'command': command_name, 'collection': command.get(command_name)}
+    if command_name == 'aggregate':
+        shape['pipeline'] = [
+            {stage: normalize_filter(body) if stage in ('$match', '$geoNear') else sorted(body)
+             if isinstance(body, dict) else '?'}
+            for step in command.get('pipeline', []) for stage, body in step.items()
+        ]
+    else:
+        shape['filter'] = normalize_filter(command.get('filter', command.get('query', {})))
+        if command.get('sort'):
+            shape['sort'] = dict(command['sort'])
+    return shape
+
+def _summarize_plan(explain):
+    """Pull the winning plan stages and execution counters out of an explain result"""
+    stages = []
+
+    def walk(plan):
+        if not isinstance(plan, dict):
+            return
+        if 'stage' in plan:
+            stage = plan['stage']
+            if plan.get('indexName'):
+                stage += f"({plan['indexName']})"
+            stages.append(stage)
+        for key in ('inputStage', 'queryPlan'):
+            walk(plan.get(key))
+        for child in plan.get('inputStages', []):
+            walk(child)
+
+    planner = explain.get('queryPlanner')
+    if planner is None:
+        # aggregate explains nest the find-layer plan in the first $cursor stage
+        for stage in explain.get('stages', []):
+            if '$cursor' in stage:
+                planner = stage['$cursor'].get('queryPlanner')
+                explain = stage['$cursor']
+                break
+    walk((planner or {}).get('winningPlan'))
+    stats = explain.get('executionStats', {})
+    return {
+        'stages': stages,
+        'collscan': 'COLLSCAN' in stages,
+        'n_returned': stats.get('nReturned'),
+        'docs_examined': stats.get('totalDocsExamined'),
+        'keys_examined': stats.get('totalKeysExamined'),
+        'execution_ms': stats.get('executionTimeMillis'),
+    }
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Records slow read commands and explains a sample of them off the request path"""
+
+    def __init__(self, threshold_ms=None, explain_sample=None, size=None):
+        self.threshold_ms = float(threshold_ms if threshold_ms is not None else os.getenv('SLOW_QUERY_MS', 200))
+        self.explain_sample = float(explain_sample if explain_sample is not None
+                                    else os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE', 0.2))
+        self.entries = deque(maxlen=int(size or os.getenv('SLOW_QUERY_LOG_SIZE', 100)))
+        self.shapes = {}
+        self.client_factory = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._explain_queue = queue.Queue(maxsize=50)
+        self._worker = None
+
+    # CommandListener interface (called on the thread that runs the command)
+    def started(self, event):
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            with self._lock:
+                self._pending[(event.connection_id, event.request_id)] = (
+                    event.command, request.path if has_request_context() else None)
+
+    def succeeded(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms >= self.threshold_ms:
+            command, path = pending
+            self.record(event.command_name, event.database_name, command, duration_ms, path)
+
+    def failed(self, event):
+        with self._lock:
+            self._pending.pop((event.connection_id, event.request_id), None)
+
+    def record(self, command_name, database_name, command, duration_ms, path=None):
+        shape = query_shape(command_name, command)
+        shape_id = hashlib.sha1(json.dumps(shape, sort_keys=True, default=str).encode()).hexdigest()[:12]
+        entry = {
+            'at': datetime.utcnow().isoformat() + 'Z',
+            'path': path,
+            'command': command_name,
+            'collection': shape['collection'],
+            'duration_ms': round(duration_ms, 1),
+            'shape_id': shape_id,
+            'shape': shape,
+            'skip': command.get('skip'),
+            'limit': command.get('limit'),
+            'plan': None,
+        }
+        with self._lock:
+            self.entries.append(entry)
+            stats = self.shapes.setdefault(shape_id, {'shape': shape, 'count': 0, 'max_ms': 0, 'total_ms': 0})
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+        print(f"Slow query {shape_id} on {path or '-'}: {command_name} {shape['collection']} "
+              f"{duration_ms:.0f}ms {json.dumps(shape, default=str)}", file=sys.stderr)
+
+        if self.client_factory is not None and random.random() < self.explain_sample:
+            explainable = {k: v for k, v in command.items() if k not in _COMMAND_NOISE}
+            if command_name == 'aggregate':
+                explainable['cursor'] = {}
+            try:
+                self._explain_queue.put_nowait((entry, database_name, explainable))
+                self._ensure_worker()
+            except queue.Full:
+                pass
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._explain_loop, name='slow-query-explain', daemon=True)
+            self._worker.start()
+
+    def _explain_loop(self):
+        while True:
+            entry, database_name, command = self._explain_queue.get()
+            try:
+                started = time.perf_counter()
+                explain = self.client_factory()[database_name].command(
+                    {'explain': command, 'verbosity': 'executionStats'})
+                entry['plan'] = _summarize_plan(explain)
+                entry['plan']['explain_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                print(f"Slow query {entry['shape_id']} plan: {json.dumps(entry['plan'])}", file=sys.stderr)
+            except Exception as e:
+                entry['plan'] = {'error': str(e)}
+
+    def report(self, limit=50):
+        """Recent slow operations (newest first) and per-shape totals"""
+        with self._lock:
+            entries = list(self.entries)[-limit:][::-1]
+            shapes = sorted(
+                ({'shape_id': shape_id, **stats, 'max_ms': round(stats['max_ms'], 1),
+                  'total_ms': round(stats['total_ms'], 1)} for shape_id, stats in self.shapes.items()),
+                key=lambda s: s['total_ms'], reverse=True)
+        return {
+            'threshold_ms': self.threshold_ms,
+            'explain_sample': self.explain_sample,
+            'recent': entries,
+            'shapes': shapes,
+        }
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,397 @@
+"""
+Columnar snapshots of the markets collection for database-free reads.
+
+scripts/export_snapshot.py writes the collection, sorted by _id, to a
+directory of .npy files with one manifest.json. Every top-level field
+becomes a column stored according to its type:
+
+    objectid  <field>.npy           S12 raw ObjectId bytes (_id: sorted)
+    float     <field>.npy           float64, NaN where missing
+    int       <field>.npy           int64, INT_MISSING where missing
+    bool      <field>.npy           int8, -1 where missing
+    str/json  <field>.codes.npy     int32 index into the field's dictionary
+                                    (-1 where missing)
+              <field>.offsets.npy   int64 Arrow-style dictionary: entry i is
+              <field>.data.npy      data[offsets[i]:offsets[i + 1]], UTF-8
+                                    (JSON text for mixed-type fields)
+
+Fields stored as an explicit null get <field>.nulls.npy, the sorted rows
+that hold the null, so documents come back with the same keys as from
+MongoDB. USDA_listing_id also gets a sorted key array for id lookups, and
+merged_ids (see dedup.py) a sorted map from each merged-away id to the
+row that absorbed it.
+
+With SNAPSHOT_SERVING=true the api blueprint answers list, state filter,
+id lookup, radius search and state counts from the newest snapshot under
+SNAPSHOT_DIR instead of MongoDB. Text and fuzzy search and the map
+viewport still query the database. The arrays are opened with mmap_mode='r', so workers share one
+copy through the page cache and only touch the pages a request reads.
+Exports go to a new directory and are published by rewriting CURRENT,
+and serving workers switch to them within SNAPSHOT_CHECK_SECONDS. The
+importers and the scripts that rewrite markets call refresh_snapshot(),
+which exports again whenever a snapshot is published. A
+worker maps all of a snapshot's files when it opens it, so it keeps
+serving a snapshot that a later export has pruned.
+"""
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+
+from fuzzy_search import haversine_miles
+from market_cache import get_dataset_version
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_SERVING = os.getenv('SNAPSHOT_SERVING', 'false').lower() in ('1', 'true', 'yes')
+SNAPSHOT_CHECK_SECONDS = int(os.getenv('SNAPSHOT_CHECK_SECONDS', 30))
+INT_MISSING = np.iinfo(np.int64).min
+MILES_PER_DEGREE_LAT = 69.0
+
+# Marks a field a document does not have, as opposed to one set to null
+_MISSING = object()
+
+def _value_type(value):
+    # bool before int (it is a subclass); bson Int64 counts as int
+    for kind in (bool, int, float, str, ObjectId):
+        if isinstance(value, kind):
+            return kind
+    return type(value)
+
+def _column_kind(field, values):
+    types = {_value_type(value) for value in values if value is not None and value is not _MISSING}
+    if field == '_id' and types == {ObjectId}:
+        return 'objectid'
+    if types == {bool}:
+        return 'bool'
+    if types == {int}:
+        return 'int'
+    if types and types <= {int, float}:
+        return 'float'
+    if types == {str}:
+        return 'str'
+    return 'json'
+
+def _dictionary_arrays(values, encode):
+    codes = np.full(len(values), -1, dtype=np.int32)
+    dictionary = {}
+    for row, value in enumerate(values):
+        if value is not None and value is not _MISSING:
+            codes[row] = dictionary.setdefault(encode(value), len(dictionary))
+    encoded = [entry.encode('utf-8') for entry in dictionary]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(entry) for entry in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return codes, offsets, data
+
+def encode_columns(markets):
+    """
+    Encode market documents (sorted by _id) as snapshot columns.
+
+    Returns (count, manifest columns, arrays by name); write_snapshot saves
+    each array as <name>.npy and market_store.MarketStore keeps them in memory.
+    """
+    columns = {}
+    count = 0
+    for market in markets:
+        for field, value in market.items():
+            if field not in columns:
+                columns[field] = [_MISSING] * count
+            columns[field].append(value)
+        count += 1
+        for values in columns.values():
+            if len(values) < count:
+                values.append(_MISSING)
+
+    manifest_columns = {}
+    arrays = {}
+    for field, values in columns.items():
+        kind = _column_kind(field, values)
+        column = {'kind': kind}
+        nulls = [row for row, value in enumerate(values) if value is None]
+        if nulls:
+            arrays[f'{field}.nulls'] = np.array(nulls, dtype=np.int32)
+            column['nulls'] = len(nulls)
+        values = [None if value is _MISSING else value for value in values]
+        if kind == 'objectid':
+            arrays[field] = np.array([value.binary for value in values], dtype='S12')
+        elif kind == 'float':
+            arrays[field] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        elif kind == 'int':
+            arrays[field] = np.array([INT_MISSING if value is None else value for value in values], dtype=np.int64)
+        elif kind == 'bool':
+            arrays[field] = np.array([-1 if value is None else value for value in values], dtype=np.int8)
+        else:
+            encode = str if kind == 'str' else (lambda value: json.dumps(value, default=str))
+            codes, offsets, data = _dictionary_arrays(values, encode)
+            arrays[f'{field}.codes'], arrays[f'{field}.offsets'], arrays[f'{field}.data'] = codes, offsets, data
+            column['dictionary_size'] = len(offsets) - 1
+        manifest_columns[field] = column
+
+    if 'USDA_listing_id' in columns:
+        keys = np.array([str(value).encode('utf-8') if value is not None else b''
+                         for value in columns['USDA_listing_id']])
+        order = np.argsort(keys, kind='stable').astype(np.int32)
+        arrays['USDA_listing_id.sorted'] = keys[order]
+        arrays['USDA_listing_id.order'] = order
+
+    if 'merged_ids' in columns:
+        # Ids merged away by scripts/dedup_markets.py, sorted, with the row that absorbed each
+        merged = [(str(merged_id).encode('utf-8'), row) for row, value in enumerate(columns['merged_ids'])
+                  if isinstance(value, list) for merged_id in value]
+        keys = np.array([key for key, _ in merged], dtype=bytes)
+        order = np.argsort(keys, kind='stable')
+        arrays['merged_ids.sorted'] = keys[order]
+        arrays['merged_ids.rows'] = np.array([row for _, row in merged], dtype=np.int32)[order]
+    return count, manifest_columns, arrays
+
+def write_snapshot(markets, directory, dataset_version=None):
+    """Write market documents (sorted by _id) as a snapshot directory; returns the row count"""
+    count, columns, arrays = encode_columns(markets)
+    os.makedirs(directory)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), array)
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'count': count,
+        'dataset_version': dataset_version,
+        'exported_at': datetime.now(timezone.utc).isoformat(),
+        'columns': columns,
+    }
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return count
+
+def refresh_snapshot(db, root=SNAPSHOT_DIR, keep=2):
+    """Re-export after a write to markets if a snapshot is published under root"""
+    if not os.path.exists(os.path.join(root, 'CURRENT')):
+        return None
+    directory, count = export_snapshot(db, root, keep)
+    print(f"Exported {count} markets to {directory}")
+    return directory, count
+
+def export_snapshot(db, root=SNAPSHOT_DIR, keep=2):
+    """Export db.markets under root, publish it as CURRENT and prune old snapshots"""
+    version = get_dataset_version(db)
+    name = f"markets-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-v{version}"
+    directory = os.path.join(root, name)
+    count = write_snapshot(db.markets.find({}).sort('_id', 1), directory, dataset_version=version)
+
+    pointer = os.path.join(root, 'CURRENT')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(name)
+    os.replace(pointer + '.tmp', pointer)
+
+    snapshots = sorted(entry for entry in os.listdir(root) if entry.startswith('markets-'))
+    for old in snapshots[:-keep] if keep > 0 else []:
+        if old != name:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return directory, count
+
+def _objectid_bytes(value):
+    # numpy drops trailing NUL bytes when reading an S12 element
+    return bytes(value).ljust(12, b'\0')
+
+class MarketSnapshot:
+    """Read-only view over one snapshot directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {manifest.get('format')} in {directory}")
+        # Map every array up front: export_snapshot prunes old directories while
+        # workers may still serve them, and an open mapping outlives its file
+        arrays = {entry[:-len('.npy')]: np.load(os.path.join(directory, entry), mmap_mode='r')
+                  for entry in os.listdir(directory) if entry.endswith('.npy')}
+        self._open(manifest, arrays)
+
+    def _open(self, manifest, arrays):
+        self.manifest = manifest
+        self.count = manifest['count']
+        self.kinds = {field: column['kind'] for field, column in manifest['columns'].items()}
+        self._arrays = arrays
+        self._codes_by_value = {}
+
+    def __len__(self):
+        return self.count
+
+    def _array(self, name):
+        return self._arrays[name]
+
+    def _entry(self, field, code):
+        offsets = self._array(f'{field}.offsets')
+        return bytes(self._array(f'{field}.data')[offsets[code]:offsets[code + 1]]).decode('utf-8')
+
+    def value(self, field, row):
+        """The field's value in a row, or None where the document had no such field"""
+        kind = self.kinds.get(field)
+        if kind is None:
+            return None
+        if kind in ('str', 'json'):
+            code = self._array(f'{field}.codes')[row]
+            return self._decoded(field, kind, code) if code >= 0 else None
+        return self._scalar(kind, self._array(field)[row])
+
+    def _decoded(self, field, kind, code):
+        entry = self._entry(field, code)
+        return entry if kind == 'str' else json.loads(entry)
+
+    def _scalar(self, kind, value):
+        if kind == 'objectid':
+            return _objectid_bytes(value).hex()
+        if kind == 'float':
+            return None if np.isnan(value) else float(value)
+        if kind == 'int':
+            return None if value == INT_MISSING else int(value)
+        return None if value < 0 else bool(value)
+
+    def document(self, row, fields=None):
+        """Rebuild a market as the API returns it (_id as a hex string)"""
+        document = {}
+        for field in fields or self.kinds:
+            value = self.value(field, row)
+            if value is not None:
+                document[field] = value
+            elif self._is_null(field, row):
+                document[field] = None
+        return document
+
+    def _is_null(self, field, row):
+        if not self.manifest['columns'].get(field, {}).get('nulls'):
+            return False
+        nulls = self._array(f'{field}.nulls')
+        position = int(np.searchsorted(nulls, row))
+        return position < len(nulls) and nulls[position] == row
+
+    def code_of(self, field, value):
+        """Dictionary code of a string value, or None if no row has it"""
+        codes = self._codes_by_value.get(field)
+        if codes is None:
+            size = self.manifest['columns'][field]['dictionary_size']
+            codes = self._codes_by_value[field] = {self._entry(field, code): code for code in range(size)}
+        return codes.get(value)
+
+    def find(self, market_id):
+        """Row of the market with this ObjectId hex string or USDA listing id"""
+        if self.kinds.get('_id') == 'objectid' and ObjectId.is_valid(market_id):
+            ids = self._array('_id')
+            key = ObjectId(market_id).binary
+            row = int(np.searchsorted(ids, key))
+            if row < self.count and _objectid_bytes(ids[row]) == key:
+                return row
+        if 'USDA_listing_id' in self.kinds:
+            keys = self._array('USDA_listing_id.sorted')
+            key = market_id.encode('utf-8')
+            position = int(np.searchsorted(keys, key))
+            if position < len(keys) and keys[position] == key:
+                return int(self._array('USDA_listing_id.order')[position])
+        return None
+
+    def merged_into(self, market_id):
+        """Row of the market a duplicate with this id was merged into, or None"""
+        keys = self._arrays.get('merged_ids.sorted')
+        if keys is None or not len(keys):
+            return None
+        key = market_id.encode('utf-8')
+        position = int(np.searchsorted(keys, key))
+        if position < len(keys) and keys[position] == key:
+            return int(self._array('merged_ids.rows')[position])
+        return None
+
+    def filter(self, state=None, with_images=False):
+        """Rows matching the list endpoint's filters, in _id order"""
+        mask = np.ones(self.count, dtype=bool)
+        if state:
+            code = self.code_of('state', state) if self.kinds.get('state') == 'str' else None
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= self._array('state.codes') == code
+        if with_images:
+            if self.kinds.get('has_image') != 'bool':
+                return np.empty(0, dtype=np.int64)
+            mask &= self._array('has_image') == 1
+        return np.flatnonzero(mask)
+
+    def near(self, lat, lng, radius_miles, rows=None):
+        """Rows within radius_miles of a point, nearest first (like $near)"""
+        if self.kinds.get('latitude') != 'float' or self.kinds.get('longitude') != 'float':
+            return np.empty(0, dtype=np.int64)
+        lats = self._array('latitude')
+        if rows is None:
+            # Cheap latitude band before the haversine
+            rows = np.flatnonzero(np.abs(lats - lat) <= radius_miles / MILES_PER_DEGREE_LAT)
+        lngs = self._array('longitude')
+        distances = haversine_miles(lat, lng, lats[rows], lngs[rows])
+        inside = distances <= radius_miles
+        rows, distances = rows[inside], distances[inside]
+        return rows[np.argsort(distances, kind='stable')]
+
+    def state_counts(self):
+        """Same shape as the $group on state: [{'_id': state or None, 'count': n}]"""
+        if self.kinds.get('state') != 'str':
+            return [{'_id': None, 'count': self.count}] if self.count else []
+        codes = self._array('state.codes')
+        counts = np.bincount(codes + 1, minlength=1)
+        return [{'_id': self._entry('state', code - 1) if code else None, 'count': int(count)}
+                for code, count in enumerate(counts) if count]
+
+    def value_counts(self, field, rows):
+        """Same shape as a $group on field over rows: [{'_id': value or None, 'count': n}]"""
+        kind = self.kinds.get(field)
+        if kind is None:
+            return [{'_id': None, 'count': len(rows)}] if len(rows) else []
+        if kind in ('str', 'json'):
+            counts = np.bincount(self._array(f'{field}.codes')[rows] + 1, minlength=1)
+            return [{'_id': self._decoded(field, kind, code - 1) if code else None, 'count': int(count)}
+                    for code, count in enumerate(counts) if count]
+        values, counts = np.unique(self._array(field)[rows], return_counts=True)
+        return [{'_id': self._scalar(kind, value), 'count': int(count)} for value, count in zip(values, counts)]
+
+class SnapshotStore:
+    """The snapshot named by root/CURRENT, reopened when an export replaces it"""
+
+    def __init__(self, root, check_interval=SNAPSHOT_CHECK_SECONDS):
+        self.root = root
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._name = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked_at < self.check_interval:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot is not None and now - self._checked_at < self.check_interval:
+                return self._snapshot
+            self._checked_at = now
+            try:
+                with open(os.path.join(self.root, 'CURRENT')) as f:
+                    name = f.read().strip()
+                if name != self._name:
+                    self._snapshot = MarketSnapshot(os.path.join(self.root, name))
+                    self._name = name
+                    print(f"Serving snapshot {name} ({len(self._snapshot)} markets)", file=sys.stderr)
+            except (OSError, ValueError) as e:
+                if self._snapshot is None:
+                    print(f"Warning: no usable snapshot in {self.root}: {str(e)}", file=sys.stderr)
+            return self._snapshot
+
+    def status(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        status = {key: snapshot.manifest.get(key) for key in ('count', 'dataset_version', 'exported_at')}
+        status['name'] = self._name
+        return status
+
+snapshot_store = SnapshotStore(SNAPSHOT_DIR) if SNAPSHOT_SERVING else None
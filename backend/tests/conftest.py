@@ -0,0 +1,40 @@
+"""
+Offline tests for the backend modules: python -m pytest -q backend/tests
+
+test_api.py is a smoke script against a deployed API (python
+tests/test_api.py), not part of this suite. Tests that need the app use
+the `stand_in` fixture: a mongomock database seeded with synthetic
+markets the way benchmarks/bench_api.py --stand-in seeds it.
+"""
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'benchmarks'))
+
+os.environ['WARM_CACHES'] = '0'
+os.environ['RATE_LIMIT_PER_MINUTE'] = '0'
+os.environ['MAX_IN_FLIGHT_COST'] = '0'
+
+collect_ignore = ['test_api.py']
+
+STAND_IN_MARKETS = 300
+
+@pytest.fixture(scope='session')
+def stand_in():
+    """The app module, pointed at a seeded mongomock database"""
+    import app as app_module
+    from bench_api import use_stand_in
+    use_stand_in(app_module, STAND_IN_MARKETS)
+    return app_module
+
+@pytest.fixture(scope='session')
+def db(stand_in):
+    return stand_in.get_db()
+
+@pytest.fixture
+def client(stand_in):
+    return stand_in.app.test_client()
@@ -0,0 +1,57 @@
+import pytest
+
+from app import MAX_PER_PAGE
+from rollups import get_rollup_version, rebuild_rollups
+
+@pytest.mark.parametrize('path', ['/api/markets', '/api/markets/filter'])
+@pytest.mark.parametrize('query', ['page=0', 'page=-1', 'page=x', 'per_page=0', 'per_page=-5',
+                                   'per_page=1.5', f'per_page={MAX_PER_PAGE + 1}', 'page=1&per_page='])
+def test_bad_pagination_is_rejected(client, path, query):
+    response = client.get(f'{path}?{query}')
+    assert response.status_code == 400
+    assert 'page' in response.get_json()['error']
+
+@pytest.mark.parametrize('path', ['/api/markets', '/api/markets/filter'])
+def test_pagination(client, path):
+    body = client.get(f'{path}?page=2&per_page=7').get_json()
+    assert (body['page'], body['per_page'], len(body['markets'])) == (2, 7, 7)
+    assert body['total_pages'] == -(-body['total'] // 7)
+    last = client.get(f"{path}?page={body['total_pages']}&per_page=7").get_json()
+    assert len(last['markets']) == body['total'] - 7 * (body['total_pages'] - 1)
+    assert client.get(f"{path}?per_page={MAX_PER_PAGE}").status_code == 200
+
+def test_update_states_rebuilds_rollups(client, db):
+    def ca_count():
+        return db.state_rollups.find_one({'state': 'CA'})['count']
+
+    before, version = ca_count(), get_rollup_version(db)
+    # A market with no state yet, which /update-states files under CA from its address
+    market_id = db.markets.insert_one({'market_name': 'Fresno Saturday Market',
+                                       'market_address': '1 Main St, Fresno, CA 93701'}).inserted_id
+    try:
+        assert client.post('/update-states').get_json()['success']
+        assert db.markets.find_one({'_id': market_id})['state'] == 'CA'
+        assert get_rollup_version(db) > version
+        assert ca_count() == before + 1
+    finally:
+        db.markets.delete_one({'_id': market_id})
+        rebuild_rollups(db)
+
+def test_merged_market_ids_resolve(client, db):
+    from dedup import apply_merges, merge_decision
+    from indexes import INDEX_SPECS
+
+    assert any(spec['keys'] == [('merged_ids', 1)] for spec in INDEX_SPECS['markets'])
+    ids = db.markets.insert_many([
+        {'market_name': 'Dupont Circle Market', 'market_address': '20th St NW, Washington, DC 20036', 'state': 'DC'},
+        {'market_name': 'Dupont Circle Market', 'market_address': '20th St NW, Washington, DC 20036', 'state': 'DC',
+         'website': 'https://freshfarm.org'},
+    ]).inserted_ids
+    try:
+        apply_merges(db, [merge_decision(list(db.markets.find({'_id': {'$in': ids}})), 1.0)])
+        response = client.get(f'/api/markets/{ids[0]}')
+        assert response.status_code == 200
+        assert response.get_json()['market']['_id'] == str(ids[1])
+        assert client.get(f'/api/markets/{ids[1]}').get_json()['market']['website'] == 'https://freshfarm.org'
+    finally:
+        db.markets.delete_many({'_id': {'$in': ids}})
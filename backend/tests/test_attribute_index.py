@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from attribute_index import AttributeIndex, as_flag
+
+STATES = ['CA', 'NY', 'TX', None]
+
+def markets(count=203, seed=0):
+    rng = np.random.default_rng(seed)
+    for row in range(count):
+        yield {
+            '_id': row,
+            'state': STATES[row % len(STATES)],
+            'SNAP': ['Y', 'N', 'yes', 'no'][rng.integers(4)],
+            'Organic': bool(rng.integers(2)),
+            'Eggs': ['1', '0', None][rng.integers(3)],
+            'has_image': bool(rng.integers(2)),
+            'market_name': f'Market {row}',
+            # Reads as a flag in some rows only, so it is no attribute
+            'season': 'yes' if row % 2 else 'May to October',
+        }
+
+@pytest.fixture(scope='module')
+def data():
+    documents = list(markets())
+    return documents, AttributeIndex.from_markets(documents)
+
+def expected_rows(documents, states=(), all_of=(), any_of=(), none_of=()):
+    def flag(document, field):
+        return as_flag(document.get(field)) is True
+    return [row for row, document in enumerate(documents)
+            if (not states or document['state'] in states)
+            and all(flag(document, field) for field in all_of)
+            and (not any_of or any(flag(document, field) for field in any_of))
+            and not any(flag(document, field) for field in none_of)]
+
+def test_discovers_boolean_fields(data):
+    _, index = data
+    assert index.attribute_names == ['Eggs', 'Organic', 'SNAP', 'has_image']
+
+@pytest.mark.parametrize('query', [
+    {},
+    {'states': ['CA']},
+    {'states': ['CA', 'TX', 'XX']},
+    {'all_of': ['SNAP', 'Organic']},
+    {'any_of': ['Eggs', 'has_image']},
+    {'none_of': ['SNAP']},
+    {'states': ['NY'], 'all_of': ['Organic'], 'any_of': ['Eggs', 'SNAP'], 'none_of': ['has_image']},
+])
+def test_match_equals_brute_force(data, query):
+    documents, index = data
+    bits = index.match(**query)
+    expected = expected_rows(documents, **query)
+    assert index.count_of(bits) == len(expected)
+    assert index.rows(bits).tolist() == expected
+
+@pytest.mark.parametrize('skip, limit', [(0, 10), (7, 5), (30, 100), (500, 10), (0, None)])
+def test_rows_pages(data, skip, limit):
+    documents, index = data
+    bits = index.match(any_of=['Eggs'])
+    expected = expected_rows(documents, any_of=['Eggs'])
+    assert index.rows(bits, skip, limit).tolist() == expected[skip:][:limit]
+
+def test_names_are_case_insensitive(data):
+    _, index = data
+    assert index.resolve(['snap', 'ORGANIC']) == ['SNAP', 'Organic']
+    with pytest.raises(ValueError):
+        index.resolve(['season'])
+
+def test_api_filter(client):
+    response = client.get('/api/markets/filter?per_page=5&all=has_image')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert len(body['markets']) <= 5
+    assert body['markets'] and all(market.get('image_url') for market in body['markets'])
@@ -0,0 +1,67 @@
+import pytest
+from bson import ObjectId
+
+from autocomplete import MAX_SUGGESTIONS, PrefixIndex, build_suggestions, normalize
+
+MARKETS = [
+    {'_id': ObjectId(), 'market_name': 'Union Square Greenmarket', 'city': 'New York', 'state': 'NY'},
+    {'_id': ObjectId(), 'market_name': 'Green City Market', 'city': 'Chicago', 'state': 'IL'},
+    {'_id': ObjectId(), 'market_name': 'Evergreen Farmers Market', 'city': 'Greenville', 'state': 'SC'},
+    {'_id': ObjectId(), 'market_name': 'Marché Jean-Talon', 'city': 'greenville', 'state': 'SC'},
+    {'_id': ObjectId(), 'market_name': 'Ferry Plaza', 'city': 'San Francisco', 'state': 'CA'},
+]
+
+@pytest.fixture(scope='module')
+def index():
+    return PrefixIndex(build_suggestions(MARKETS))
+
+def texts(results):
+    return [result['text'] for result in results]
+
+def test_normalize():
+    assert normalize('  Marché   Jean-Talon! ') == 'marche jean talon'
+    assert normalize(None) == ''
+
+def test_prefix_matches_word_starts(index):
+    assert texts(index.search('green', 8)) == [
+        'Greenville, SC', 'Green City Market', 'Union Square Greenmarket']
+    # Inside a word is not a word start
+    assert 'Evergreen Farmers Market' not in texts(index.search('green', 8))
+    assert texts(index.search('square green', 8)) == ['Union Square Greenmarket']
+
+def test_prefix_boundaries(index):
+    assert index.search('', 8) == [] and index.search(' -! ', 8) == []
+    # The whole key, and one character past it
+    assert texts(index.search('ferry plaza', 8)) == ['Ferry Plaza']
+    assert index.search('ferry plazas', 8) == []
+    assert index.search('zzz', 8) == []
+    # Accents and case are ignored
+    assert texts(index.search('MARCHE', 8)) == ['Marché Jean-Talon']
+
+def test_state_names_and_abbreviations(index):
+    assert index.search('calif', 8)[0] == {'text': 'California', 'type': 'state', 'state': 'CA', 'count': 1}
+    assert 'California' in texts(index.search('ca', 8))
+
+def test_cities_are_merged_and_weighted_by_count(index):
+    greenville = index.search('greenville', 8)
+    assert greenville[0]['type'] == 'city' and greenville[0]['count'] == 2
+
+def test_limit_boundaries(index):
+    assert len(index.search('m', 1)) == 1
+    assert len(index.search('m', 0)) == 1
+    many = PrefixIndex([{'text': f'Market {i:02d}', 'type': 'market', 'weight': 1.0} for i in range(30)])
+    assert len(many.search('market', 100)) == MAX_SUGGESTIONS
+    # Equal weights come back in alphabetical order
+    assert texts(many.search('market', 3)) == ['Market 00', 'Market 01', 'Market 02']
+
+def test_each_suggestion_once():
+    # 'market' starts two of the first suggestion's words
+    index = PrefixIndex([{'text': 'Market Street Market', 'type': 'market', 'weight': 5.0},
+                         {'text': 'Main Market', 'type': 'market', 'weight': 1.0}])
+    assert texts(index.search('market', 8)) == ['Market Street Market', 'Main Market']
+
+@pytest.mark.parametrize('limit, expected', [('0', 1), ('3', 3), ('500', MAX_SUGGESTIONS)])
+def test_endpoint_limit(client, limit, expected):
+    response = client.get(f'/api/markets/autocomplete?q=m&limit={limit}')
+    assert response.status_code == 200
+    assert len(response.get_json()['suggestions']) == expected
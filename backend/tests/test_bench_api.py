@@ -0,0 +1,23 @@
+from bench_api import baseline_mismatch, compare_with_baseline
+
+META = {'machine': 'x86_64', 'cpus': 1, 'concurrency': 8, 'workers': 2, 'threads': 1}
+
+def result(p95_ms, throughput_rps):
+    return {'requests': 100, 'p95_ms': p95_ms, 'throughput_rps': throughput_rps}
+
+def test_baseline_from_another_host_is_not_comparable():
+    assert baseline_mismatch({'meta': META}, {'meta': dict(META, at='yesterday')}) is None
+    assert baseline_mismatch({'meta': META}, {'meta': dict(META, cpus=8)}) == 'cpus 8 (now 1)'
+    mismatch = baseline_mismatch({'meta': META}, {'meta': dict(META, machine='arm64', workers=4)})
+    assert mismatch == 'machine arm64 (now x86_64), workers 4 (now 2)'
+    assert baseline_mismatch({'meta': META}, {})
+
+def test_regressions_past_tolerance():
+    baseline = {'client': {'markets_page': result(10, 100), 'autocomplete': result(1, 1000)}}
+    report = {'client': {'markets_page': result(12, 80), 'autocomplete': result(2, 400),
+                         'search_fuzzy': result(5, 200)}}
+    assert compare_with_baseline(report, baseline, 0.25) == [
+        'client autocomplete: p95 1ms -> 2ms',
+        'client autocomplete: 1000 -> 400 req/s',
+        'client search_fuzzy: no baseline (re-record with --save-baseline)',
+    ]
@@ -0,0 +1,74 @@
+import time
+
+import pymongo
+import pytest
+from flask import Blueprint, Flask, jsonify
+
+import deadlines
+from deadlines import REQUEST_TIMEOUTS, init_deadlines
+
+# Nothing listens on port 1: server selection keeps retrying until its deadline
+UNREACHABLE_URI = 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=30000&connectTimeoutMS=30000'
+
+@pytest.fixture(scope='module')
+def unreachable():
+    client = pymongo.MongoClient(UNREACHABLE_URI)
+    yield client
+    client.close()
+
+@pytest.fixture
+def client(unreachable):
+    app = Flask(__name__)
+    api = Blueprint('api', __name__)
+
+    @api.route('/api/count')
+    def count():
+        return jsonify({'total': unreachable.test.markets.count_documents({})})
+
+    app.register_blueprint(api)
+
+    @app.route('/health')
+    def health():
+        return jsonify({'status': 'ok'})
+
+    init_deadlines(app)
+    return app.test_client()
+
+def test_budget_expiry_returns_503(client):
+    started = time.monotonic()
+    response = client.get('/api/count', headers={'X-Request-Budget-Ms': '200'})
+    # The 30s server selection timeout is cut short by the request budget
+    assert time.monotonic() - started < 5
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(deadlines.RETRY_AFTER_SECONDS)
+    assert response.get_json()['error'] == 'Request timed out'
+
+def test_expiry_is_counted_by_route(client):
+    before = REQUEST_TIMEOUTS._values.get(('/api/count', 'ServerSelectionTimeoutError'), 0)
+    client.get('/api/count', headers={'X-Request-Budget-Ms': '100'})
+    assert REQUEST_TIMEOUTS._values[('/api/count', 'ServerSelectionTimeoutError')] == before + 1
+
+def test_budget_ends_with_the_request(client):
+    client.get('/api/count', headers={'X-Request-Budget-Ms': '100'})
+    assert pymongo._csot.get_timeout() is None
+
+def test_requests_outside_api_have_no_budget(client):
+    assert client.get('/health').status_code == 200
+
+def test_client_cannot_raise_the_budget(client, monkeypatch):
+    monkeypatch.setattr(deadlines, 'REQUEST_TIME_BUDGET_MS', 150)
+    started = time.monotonic()
+    assert client.get('/api/count', headers={'X-Request-Budget-Ms': '60000'}).status_code == 503
+    assert time.monotonic() - started < 5
+
+def test_pymongo_without_timeout_runs_unbounded(client, monkeypatch):
+    # pymongo before 4.2 has no timeout(): requests must still be served
+    monkeypatch.delattr(pymongo, 'timeout')
+    monkeypatch.setattr(deadlines, 'REQUEST_TIME_BUDGET_MS', 150)
+    assert client.get('/health').status_code == 200
+    app = Flask(__name__)
+    api = Blueprint('api', __name__)
+    api.add_url_rule('/api/ping', 'ping', lambda: jsonify({'pong': True}))
+    app.register_blueprint(api)
+    init_deadlines(app)
+    assert app.test_client().get('/api/ping').status_code == 200
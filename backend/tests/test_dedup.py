@@ -0,0 +1,113 @@
+import mongomock
+import numpy as np
+import pytest
+
+from bench_dedup import accuracy, load_markets
+from dedup import apply_merges, connected_groups, find_duplicates, merge_decision, plan_merges
+
+def groups_of(labels):
+    groups = {}
+    for row, label in enumerate(labels.tolist()):
+        groups.setdefault(label, []).append(row)
+    return sorted(groups.values())
+
+@pytest.mark.parametrize('count, pairs, expected', [
+    (3, [], [[0], [1], [2]]),
+    (4, [(0, 1), (2, 3)], [[0, 1], [2, 3]]),
+    # A chain joins transitively, whatever order its links come in
+    (5, [(3, 4), (1, 2), (2, 3)], [[0], [1, 2, 3, 4]]),
+    (6, [(5, 0), (4, 5), (3, 4), (2, 3), (1, 2)], [[0, 1, 2, 3, 4, 5]]),
+    (5, [(1, 3), (1, 3), (3, 1)], [[0], [1, 3], [2], [4]]),
+])
+def test_connected_groups(count, pairs, expected):
+    a = np.array([pair[0] for pair in pairs], dtype=np.int64)
+    b = np.array([pair[1] for pair in pairs], dtype=np.int64)
+    labels = connected_groups(count, a, b)
+    assert groups_of(labels) == expected
+    # Every label is the smallest row of its group
+    assert all(labels[rows].tolist() == [rows[0]] * len(rows) for rows in groups_of(labels))
+
+def test_connected_groups_matches_reference():
+    rng = np.random.default_rng(0)
+    count = 2000
+    a, b = rng.integers(0, count, 1500), rng.integers(0, count, 1500)
+    parent = list(range(count))
+
+    def root(row):
+        while parent[row] != row:
+            row = parent[row]
+        return row
+
+    for x, y in zip(a.tolist(), b.tolist()):
+        parent[max(root(x), root(y))] = min(root(x), root(y))
+    assert connected_groups(count, a, b).tolist() == [root(row) for row in range(count)]
+
+def market(_id, name, address, lat=None, lng=None, **fields):
+    document = {'_id': _id, 'market_name': name, 'market_address': address, 'state': 'NY', 'zipCode': '10003'}
+    if lat is not None:
+        document.update(latitude=lat, longitude=lng)
+    document.update(fields)
+    return document
+
+def test_find_duplicates_cases():
+    markets = [
+        market(1, 'Union Square Greenmarket', 'E 17th St & Union Sq W, New York, NY 10003', 40.7370, -73.9903),
+        # Respelled, a few metres off
+        market(2, 'Union Square Greenmkt', 'E 17th St & Union Sq W, New York, NY 10003', 40.7371, -73.9904),
+        # Next door but a different market
+        market(3, 'Tompkins Square Market', 'E 7th St & Avenue A, New York, NY 10003', 40.7372, -73.9902),
+        # Same listing, no position
+        market(4, 'Abingdon Square', '12th St & Hudson St, New York, NY 10014', USDA_listing_id='1000'),
+        market(5, 'Abingdon Sq Greenmarket', '', USDA_listing_id='1000'),
+        # Same name in another state, far away
+        market(6, 'Union Square Greenmarket', '1 Main St, Somerville, MA 02143', 42.3796, -71.0935, state='MA'),
+    ]
+    groups = find_duplicates(markets)
+    assert [rows for rows, _ in groups] == [[0, 1], [3, 4]]
+    assert all(0 < score <= 1 for _, score in groups)
+
+def test_find_duplicates_planted():
+    markets, truth = load_markets(2000, 0.05, seed=7)
+    precision, recall = accuracy(find_duplicates(markets), truth)
+    assert precision >= 0.95
+    assert recall >= 0.9
+
+def test_plan_and_apply_merges():
+    db = mongomock.MongoClient().farmers_market
+    db.markets.insert_many([
+        market(1, 'Union Square Greenmarket', 'E 17th St & Union Sq W, New York, NY 10003', 40.7370, -73.9903),
+        market(2, 'Union Square Greenmkt', 'E 17th St & Union Sq W, New York, NY 10003', 40.7371, -73.9904,
+               website='https://www.grownyc.org', phone_number='212-788-7476'),
+        market(3, 'Tompkins Square Market', 'E 7th St & Avenue A, New York, NY 10003', 40.7372, -73.9902),
+    ])
+    decisions = plan_merges(db)
+    assert len(decisions) == 1
+    # The most complete market is kept
+    assert decisions[0]['keep'] == 2 and decisions[0]['remove'] == [1]
+    assert db.markets.count_documents({}) == 3
+
+    assert apply_merges(db, decisions) == (1, 1)
+    kept = db.markets.find_one({'_id': 2})
+    assert kept['merged_ids'] == ['1']
+    assert db.markets.count_documents({}) == 2
+
+def test_unplaced_markets_need_matching_streets():
+    markets = [
+        # No position and no address: a shared generic name is not enough
+        market(1, 'Farmers Market', ''),
+        market(2, 'Farmers Market', ''),
+        # No position, different streets
+        market(3, 'Greenmarket', '1 Main St, New York, NY 10003'),
+        market(4, 'Greenmarket', '400 Broadway, New York, NY 10003'),
+        # No position, same street written the same way
+        market(5, 'Stuyvesant Town Greenmarket', '14th St Loop & Avenue A, New York, NY 10003'),
+        market(6, 'Stuyvesant Town Greenmkt', '14th St Loop & Avenue A, New York, New York 10003'),
+    ]
+    assert [rows for rows, _ in find_duplicates(markets)] == [[4, 5]]
+
+def test_earlier_merges_carry_over():
+    first = merge_decision([market(1, 'A', ''), market(2, 'A', '', website='x', merged_ids=['0'])], 0.9)
+    assert first['keep'] == 2 and first['merged_ids'] == ['1']
+    second = merge_decision([market(2, 'A', '', merged_ids=['0', '1']),
+                             market(3, 'A', '', website='x', phone_number='y')], 0.9)
+    assert second['keep'] == 3 and second['merged_ids'] == ['2', '0', '1']
@@ -0,0 +1,87 @@
+import mongomock
+import numpy as np
+import pytest
+
+from facets import FACET_LIMIT, document_facets, mask_of, parse_facets, snapshot_facets
+from snapshot import MarketSnapshot, export_snapshot
+
+MARKETS = [
+    {'market_name': 'A', 'state': 'CA', 'city': 'Oakland', 'has_image': True, 'rating': 4.5},
+    {'market_name': 'B', 'state': 'CA', 'city': 'Oakland', 'has_image': False, 'rating': 4.0},
+    {'market_name': 'C', 'state': 'CA', 'city': 'Fresno', 'has_image': True, 'rating': 2.9},
+    {'market_name': 'D', 'state': 'NY', 'city': 'Albany', 'has_image': True},
+    {'market_name': 'E', 'state': 'NY', 'city': 'Albany', 'has_image': False, 'rating': None},
+    {'market_name': 'F', 'state': 'OR', 'has_image': True, 'rating': 5},
+]
+
+def counts(facet):
+    return {entry['value']: entry['count'] for entry in facet}
+
+def test_parse_facets():
+    assert parse_facets(' state, city,state ') == ['state', 'city']
+    assert parse_facets(None) == [] and parse_facets(',') == []
+    with pytest.raises(ValueError):
+        parse_facets('state,colour')
+
+def test_document_facets_bucket_and_order():
+    facets = document_facets(MARKETS, ['rating', 'city', 'state'])
+    # Whole stars; missing ratings are not a value
+    assert facets['rating'] == [{'value': 4, 'count': 2}, {'value': 2, 'count': 1}, {'value': 5, 'count': 1}]
+    assert [entry['value'] for entry in facets['city']] == ['Albany', 'Oakland', 'Fresno']
+    assert document_facets(MARKETS, ['state'], limit=1) == {'state': [{'value': 'CA', 'count': 3}]}
+
+@pytest.fixture(scope='module')
+def snapshot(tmp_path_factory):
+    db = mongomock.MongoClient().farmers_market
+    db.markets.insert_many([dict(market) for market in MARKETS])
+    directory, _ = export_snapshot(db, root=str(tmp_path_factory.mktemp('snapshots')))
+    return MarketSnapshot(directory)
+
+def test_a_facet_ignores_its_own_filter(snapshot):
+    everyone = np.arange(snapshot.count)
+    filters = {'state': mask_of(snapshot.filter('CA'), snapshot.count),
+               'with_images': mask_of(snapshot.filter(with_images=True), snapshot.count)}
+    facets = snapshot_facets(snapshot, everyone, filters, ['state', 'has_image', 'city', 'rating'])
+    # Every state with an image, not just CA
+    assert counts(facets['state']) == {'CA': 2, 'NY': 1, 'OR': 1}
+    # Both image values within CA
+    assert counts(facets['has_image']) == {True: 2, False: 1}
+    # Facets without a filter of their own honour both
+    assert counts(facets['city']) == {'Oakland': 1, 'Fresno': 1}
+    assert counts(facets['rating']) == {4: 1, 2: 1}
+
+def test_snapshot_facets_match_document_facets(snapshot):
+    everyone = np.arange(snapshot.count)
+    names = ['state', 'city', 'has_image', 'rating']
+    assert snapshot_facets(snapshot, everyone, {}, names) == document_facets(MARKETS, names)
+
+def expected_facets(markets, state, with_images, names):
+    """The search facets worked out by hand from the documents"""
+    result = {}
+    for name in names:
+        selected = [market for market in markets
+                    if (name == 'state' or market.get('state') == state)
+                    and (name == 'has_image' or not with_images or market.get('has_image') is True)]
+        result[name] = document_facets(selected, [name], limit=FACET_LIMIT)[name]
+    return result
+
+SEARCH = '/api/markets/search?state=CA&with_images=1&facets=state,has_image,city,rating'
+
+def test_search_facets_from_mongodb(client, db, stand_in, monkeypatch):
+    monkeypatch.setattr(stand_in, 'get_snapshot', lambda: None)
+    payload = client.get(SEARCH).get_json()
+    markets = list(db.markets.find())
+    assert payload['facets'] == expected_facets(markets, 'CA', True, ['state', 'has_image', 'city', 'rating'])
+    # The results themselves honour both filters
+    assert payload['count'] == counts(payload['facets']['state'])['CA']
+
+def test_search_facets_from_the_snapshot(client, db, stand_in, monkeypatch, tmp_path):
+    directory, _ = export_snapshot(db, root=str(tmp_path))
+    monkeypatch.setattr(stand_in, 'get_snapshot', lambda: MarketSnapshot(directory))
+    payload = client.get(SEARCH).get_json()
+    markets = list(db.markets.find())
+    assert payload['facets'] == expected_facets(markets, 'CA', True, ['state', 'has_image', 'city', 'rating'])
+    assert payload['count'] == counts(payload['facets']['has_image'])[True]
+
+def test_unknown_facet_is_a_400(client):
+    assert client.get('/api/markets/search?facets=colour').status_code == 400
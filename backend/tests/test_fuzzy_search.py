@@ -0,0 +1,124 @@
+import random
+
+import numpy as np
+import pytest
+
+import fuzzy_search
+from fuzzy_search import TrigramIndex, trigrams
+
+MARKETS = [
+    {'_id': 'a', 'market_name': 'Farmers Market', 'market_address': '1 Main St, Springfield, IL 62701',
+     'state': 'IL', 'latitude': 39.80, 'longitude': -89.64},
+    {'_id': 'b', 'market_name': 'Union Square Greenmarket', 'market_address': 'E 17th St, New York, NY 10003',
+     'state': 'NY', 'latitude': 40.74, 'longitude': -73.99},
+    {'_id': 'c', 'market_name': 'Grand Army Plaza Greenmarket', 'market_address': 'Prospect Park W, Brooklyn, NY',
+     'state': 'NY', 'latitude': 40.67, 'longitude': -73.97},
+    {'_id': 'd', 'market_name': 'Ferry Plaza Farmers Market', 'market_address': 'The Embarcadero, San Francisco, CA',
+     'state': 'CA', 'latitude': 37.80, 'longitude': -122.39},
+    {'_id': 'e', 'market_name': 'Crescent City Farmers Market', 'state': 'LA'},
+]
+
+@pytest.fixture(scope='module')
+def index():
+    return TrigramIndex.from_markets(MARKETS)
+
+def ids(matches):
+    return [market_id for market_id, _ in matches]
+
+def test_trigrams_are_padded_per_word():
+    assert trigrams('Ab c') == {'  a', ' ab', 'ab ', '  c', ' c '}
+
+def test_misspelled_names_match(index):
+    assert ids(index.search("farmer's markt"))[:1] == ['a']
+    assert ids(index.search('grenmarket'))[:2] == ['b', 'c']
+    assert ids(index.search('fery plaza'))[:1] == ['d']
+
+def test_misspelled_address_matches(index):
+    assert ids(index.search('brookyln')) == ['c']
+
+def test_exact_match_scores_one_and_shorter_names_win_ties(index):
+    matches = index.search('farmers market')
+    assert matches[0] == ('a', 1.0)
+    assert ids(matches) == ['a', 'd', 'e']
+
+def test_min_score_and_limit(index):
+    assert index.search('zzzz') == []
+    assert index.search('farmers market', min_score=1.0, limit=1) == [('a', 1.0)]
+    assert all(score >= 0.8 for _, score in index.search('grand army', min_score=0.8))
+
+def test_state_and_radius_filters(index):
+    assert ids(index.search('greenmarket', state='ny')) == ['b', 'c']
+    assert ids(index.search('greenmarket', lat=40.74, lng=-73.99, radius_miles=2)) == ['b']
+    # Markets without coordinates never fall inside a radius
+    assert 'e' not in ids(index.search('farmers market', lat=30.0, lng=-90.0, radius_miles=5000))
+
+def words(rng, n):
+    return ' '.join(''.join(rng.choice('abcdefghiklmnoprstu') for _ in range(rng.randint(4, 8))) for _ in range(n))
+
+@pytest.fixture(scope='module')
+def random_markets():
+    rng = random.Random(7)
+    return [{'_id': i, 'market_name': words(rng, 3), 'market_address': words(rng, 4)} for i in range(2000)]
+
+def typo(rng, text):
+    position = rng.randrange(len(text))
+    return text[:position] + text[position + 1:]
+
+def brute_force(markets, query, min_score):
+    query_grams = trigrams(query)
+    scored = {}
+    for market in markets:
+        best = max(len(query_grams & trigrams(market['market_name'])),
+                   len(query_grams & trigrams(market['market_address'])))
+        if best / len(query_grams) >= min_score:
+            scored[market['_id']] = best / len(query_grams)
+    return scored
+
+@pytest.mark.parametrize('min_score', [0.3, 0.45, 0.7])
+def test_pruned_candidates_match_brute_force(random_markets, min_score, monkeypatch):
+    monkeypatch.setattr(fuzzy_search, 'MAX_RESULTS', len(random_markets))
+    index = TrigramIndex.from_markets(random_markets)
+    rng = random.Random(min_score)
+    for market in rng.sample(random_markets, 10):
+        query = typo(rng, market['market_name'])
+        expected = brute_force(random_markets, query, min_score)
+        got = dict(index.search(query, limit=len(random_markets), min_score=min_score))
+        assert got.keys() == expected.keys()
+        assert market['_id'] in got
+        for market_id, score in got.items():
+            assert score == pytest.approx(expected[market_id])
+
+def test_candidates_scan_only_the_rarest_postings(random_markets):
+    index = TrigramIndex.from_markets(random_markets)
+    gram_ids = [index.vocab[g] for g in trigrams(random_markets[0]['market_name']) if g in index.vocab]
+    need = len(gram_ids) // 2
+    candidates = index.names.candidates(gram_ids, need)
+    everyone = np.arange(len(random_markets))
+    shared = index.names.shared(gram_ids, everyone, len(everyone))
+    # Every row that can reach the score is a candidate...
+    assert set(np.flatnonzero(shared >= need)) <= set(candidates.tolist())
+    # ...and candidates come from len - need + 1 postings, not all of them
+    rarest = sorted(gram_ids, key=lambda g: len(index.names.postings(g)))[:len(gram_ids) - need + 1]
+    assert set(candidates.tolist()) == set(np.concatenate([index.names.postings(g) for g in rarest]).tolist())
+    assert len(index.names.candidates(gram_ids, len(gram_ids) + 1)) == 0
+
+def test_sparse_and_dense_counting_agree(random_markets, monkeypatch):
+    index = TrigramIndex.from_markets(random_markets)
+    gram_ids = [index.vocab[g] for g in trigrams(random_markets[1]['market_address']) if g in index.vocab]
+    rows = np.arange(0, len(random_markets), 3)
+    # A third of the rows is past 1/DENSE_FRACTION: counted with one bincount
+    dense = index.names.shared(gram_ids, rows, len(random_markets))
+    # Now under it: one binary search per trigram
+    monkeypatch.setattr(fuzzy_search, 'DENSE_FRACTION', 1)
+    sparse = index.names.shared(gram_ids, rows, len(random_markets))
+    assert sparse.tolist() == dense.tolist() and dense.any()
+
+def test_fuzzy_endpoint_tolerates_typos(client, db):
+    market = db.markets.find_one({'market_name': {'$regex': '^.{12,}$'}})
+    name = market['market_name']
+    typo = name[:3] + name[4:]
+    response = client.get('/api/markets/search', query_string={'mode': 'fuzzy', 'q': typo, 'limit': 50})
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['mode'] == 'fuzzy'
+    assert str(market['_id']) in [result['_id'] for result in payload['markets']]
@@ -0,0 +1,99 @@
+import math
+
+import numpy as np
+import pytest
+from flask import Flask
+
+from map_formats import MAP_COORDINATE_PRECISION, map_response, parse_format, to_compact, to_geojson
+
+MARKETS = [
+    {'_id': 'a', 'market_name': 'Ferry Plaza', 'latitude': 37.795512, 'longitude': -122.393415},
+    {'_id': 'b', 'market_name': 'Union Square', 'latitude': 40.7359, 'longitude': -73.990305},
+    # location wins over latitude/longitude
+    {'_id': 'c', 'market_name': 'Moved', 'latitude': 0.0, 'longitude': 0.0,
+     'location': {'type': 'Point', 'coordinates': [-87.6298, 41.878114]}},
+    {'_id': 'd', 'market_name': 'No Position'},
+    {'_id': 'e', 'market_name': 'Not A Number', 'latitude': math.nan, 'longitude': -90.0},
+    {'USDA_listing_id': '1001', 'market_name': 'Listing Only', 'latitude': -33.868820, 'longitude': 151.209296},
+]
+POSITIONED = {'a': (-122.393415, 37.795512), 'b': (-73.990305, 40.7359), 'c': (-87.6298, 41.878114),
+              '1001': (151.209296, -33.868820)}
+
+def decode(deltas, precision=MAP_COORDINATE_PRECISION):
+    return (np.cumsum(deltas) / 10 ** precision).tolist()
+
+def test_parse_format():
+    assert parse_format(None) == 'json' and parse_format('GeoJSON') == 'geojson'
+    with pytest.raises(ValueError):
+        parse_format('xml')
+
+def test_geojson_round_trip():
+    collection = to_geojson(MARKETS)
+    assert collection['type'] == 'FeatureCollection'
+    decoded = {feature['id']: tuple(feature['geometry']['coordinates']) for feature in collection['features']}
+    assert decoded == POSITIONED
+    assert collection['features'][0]['properties'] == {'name': 'Ferry Plaza'}
+
+@pytest.mark.parametrize('precision', [3, 5, 6])
+def test_compact_round_trip(precision):
+    compact = to_compact(MARKETS, precision=precision)
+    assert compact['id'] == list(POSITIONED)
+    assert compact['name'] == ['Ferry Plaza', 'Union Square', 'Moved', 'Listing Only']
+    tolerance = 0.5 / 10 ** precision + 1e-9
+    for market_id, lng, lat in zip(compact['id'], decode(compact['lng'], precision), decode(compact['lat'], precision)):
+        assert lng == pytest.approx(POSITIONED[market_id][0], abs=tolerance)
+        assert lat == pytest.approx(POSITIONED[market_id][1], abs=tolerance)
+
+def test_compact_deltas_stay_exact_over_long_runs():
+    rng = np.random.default_rng(3)
+    markets = [{'_id': str(i), 'latitude': lat, 'longitude': lng}
+               for i, (lat, lng) in enumerate(zip(rng.uniform(-90, 90, 5000), rng.uniform(-180, 180, 5000)))]
+    compact = to_compact(markets)
+    # Integer deltas do not drift: the last point is as close as the first
+    expected = np.rint(np.array([m['latitude'] for m in markets]) * 10 ** MAP_COORDINATE_PRECISION)
+    assert np.cumsum(compact['lat']).tolist() == expected.astype(np.int64).tolist()
+
+def test_clusters():
+    clusters = [{'count': 4, 'latitude': 40.0, 'longitude': -75.0},
+                {'count': 1, 'market_id': 'a', 'latitude': 37.8, 'longitude': -122.4}]
+    features = to_geojson(clusters, kind='clusters')['features']
+    assert [feature['properties'] for feature in features] == [{'count': 4}, {'count': 1, 'market_id': 'a'}]
+    assert to_compact(clusters, kind='clusters')['count'] == [4, 1]
+    assert to_compact(clusters, kind='clusters')['market_id'] == [None, 'a']
+
+def test_map_response_leaves_the_shared_payload_alone():
+    payload = {'success': True, 'type': 'markets', 'count': len(MARKETS), 'markets': MARKETS}
+    with Flask(__name__).app_context():
+        geojson = map_response('geojson', payload)
+        compact = map_response('compact', payload)
+    assert payload == {'success': True, 'type': 'markets', 'count': len(MARKETS), 'markets': MARKETS}
+    assert geojson.mimetype == 'application/geo+json'
+    body = geojson.get_json()
+    assert body['layer'] == 'markets' and body['type'] == 'FeatureCollection' and body['count'] == len(MARKETS)
+    assert compact.get_json()['markets']['id'] == list(POSITIONED)
+
+def test_list_endpoint_formats_agree(client):
+    page = '/api/markets?per_page=20'
+    markets = client.get(page).get_json()['markets']
+    # Markets without coordinates are left out of the map formats
+    by_name = {(m['market_name'], m['latitude'], m['longitude']) for m in markets if m.get('latitude') is not None}
+    geojson = client.get(page + '&format=geojson')
+    assert geojson.mimetype == 'application/geo+json'
+    features = geojson.get_json()['features']
+    assert {(f['properties']['name'], f['geometry']['coordinates'][1], f['geometry']['coordinates'][0])
+            for f in features} == by_name
+    compact = client.get(page + '&format=compact').get_json()
+    assert compact['precision'] == MAP_COORDINATE_PRECISION
+    columns = compact['markets']
+    assert columns['id'] == [f['id'] for f in features]
+    for feature, lng, lat in zip(features, decode(columns['lng']), decode(columns['lat'])):
+        assert (lng, lat) == pytest.approx(tuple(feature['geometry']['coordinates']), abs=1e-5)
+
+def test_viewport_clusters_as_geojson(client):
+    response = client.get('/api/markets/viewport?bbox=-130,20,-60,50&zoom=3&format=geojson')
+    body = response.get_json()
+    assert body['layer'] == 'clusters'
+    assert sum(feature['properties']['count'] for feature in body['features']) == body['count']
+
+def test_unknown_format_is_a_400(client):
+    assert client.get('/api/markets?format=xml').status_code == 400
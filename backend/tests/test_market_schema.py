@@ -0,0 +1,41 @@
+import pytest
+
+from market_schema import canonicalize_market, city_from_address
+
+# Address forms in the USDA exports and in generate_markets.py's ADDRESS_FORMATS
+@pytest.mark.parametrize('address, city', [
+    ('123 Main St, Las Vegas, NV 89103', 'Las Vegas'),
+    ('123 Main St, Las Vegas, NV 89103-1234', 'Las Vegas'),
+    ('123 Main St, Las Vegas, NV, 89103', 'Las Vegas'),
+    ('123 Main St, Las Vegas, Nevada 89103', 'Las Vegas'),
+    ('123 Main St, Las Vegas, NV', 'Las Vegas'),
+    ('123 Main St, Las Vegas', 'Las Vegas'),
+    ('123 Main St, Las Vegas NV 89103', 'Las Vegas'),
+    ('Boston, MA 02101', 'Boston'),
+    ('Boston, MA', 'Boston'),
+    ('5 Elm St, Charleston, West Virginia 25301', 'Charleston'),
+    ('12 Broadway, New York, NY 10001', 'New York'),
+    ('Washington, DC, 20050', 'Washington'),
+    ('1 Main St, Tulsa, OK 74103, USA', 'Tulsa'),
+    ('123 Main St, MA 02101', None),
+    ('123 Main St, 02101', None),
+    ('123 Main St', None),
+    ('', None),
+    (None, None),
+])
+def test_city_from_address(address, city):
+    assert city_from_address(address) == city
+
+@pytest.mark.parametrize('stored, address, city', [
+    # Values the v2 schema wrote into city for some address forms
+    ('NV', '123 Main St, Las Vegas, NV, 89103', 'Las Vegas'),
+    ('89103', '123 Main St, Las Vegas, NV, 89103', 'Las Vegas'),
+    ('California', '1 Main St, Fresno, California, 93701', 'Fresno'),
+    ('NV', '123 Main St, NV, 89103', None),
+    # Correct values are kept
+    ('New York', '12 Broadway, New York, NY 10001', 'New York'),
+    ('Henderson', '123 Main St, Las Vegas, NV 89103', 'Henderson'),
+])
+def test_canonicalize_repairs_city(stored, address, city):
+    market = canonicalize_market({'_id': 1, 'market_address': address, 'city': stored})
+    assert market.get('city') == city
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+from bson import ObjectId
+
+from market_schema import LIST_FIELDS
+from market_store import MarketStore
+
+MARKETS = [
+    {'_id': ObjectId('64a000000000000000000001'), 'market_name': 'Ferry Plaza', 'city': 'San Francisco',
+     'state': 'CA', 'zipCode': '94111', 'latitude': 37.795, 'longitude': -122.0, 'rating': 4.5,
+     'USDA_listing_id': '1001', 'image_url': None, 'source': 'usda'},
+    {'_id': ObjectId('64a000000000000000000002'), 'market_name': 'Union Square "Greenmarket"',
+     'city': 'New York', 'state': 'NY', 'latitude': 40.0, 'longitude': -73.99, 'USDA_listing_id': '1002'},
+    {'_id': ObjectId('64a000000000000000000003'), 'market_name': 'Marché Jean-Talon', 'state': 'CA',
+     'zipCode': '95060', 'latitude': 36.97, 'longitude': -122.03, 'rating': 3.5},
+]
+
+def listed(market):
+    return {field: market[field] for field in LIST_FIELDS if field in market}
+
+@pytest.fixture(scope='module')
+def store():
+    return MarketStore.from_markets(iter(MARKETS))
+
+def test_row_of(store):
+    assert store.row_of('64a000000000000000000002') == 1
+    assert store.row_of('1001') == 0
+    assert store.row_of('64a0000000000000000000ff') is None
+    assert store.row_of('9999') is None
+
+def test_rows_for_state(store):
+    assert store.rows_for_state('CA').tolist() == [0, 2]
+    assert store.rows_for_state('NY').tolist() == [1]
+    assert store.rows_for_state('TX').tolist() == []
+
+def test_documents_match_the_list_fields(store):
+    for row, market in enumerate(MARKETS):
+        assert store.document(row) == listed(market)
+    assert store.documents([2, 0]) == [listed(MARKETS[2]), listed(MARKETS[0])]
+    record = store.record(1)
+    assert record._id == '64a000000000000000000002' and record.zipCode is None
+
+def test_json_rows_match_json_dumps(store):
+    rows = [0, 1, 2]
+    body = store.json_rows(rows)
+    assert body == json.dumps([listed(market) for market in MARKETS]).encode("utf-8")
+    # Whole-number floats keep their decimal point, as json.dumps of the documents writes them
+    assert b'"longitude": -122.0' in body and b'"latitude": 40.0' in body
+    assert b'"image_url": null' in body
+    assert store.json_rows([]) == b'[]'
+
+def test_markets_must_be_sorted_by_id():
+    with pytest.raises(ValueError):
+        MarketStore.from_markets(reversed(MARKETS))
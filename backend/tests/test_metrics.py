@@ -0,0 +1,78 @@
+import pytest
+from flask import Flask, jsonify
+
+from metrics import (REQUEST_LATENCY, REQUEST_MONGO_COMMANDS, REQUESTS_IN_PROGRESS, CommandTimer, Counter,
+                     Histogram, init_metrics)
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    histogram = Histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, '/a')
+    assert histogram.render() == [
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="1"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 3.65',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+def test_counter_labels_are_escaped():
+    counter = Counter('errors_total', 'Errors', ('reason',))
+    counter.inc('say "hi"\nback\\slash')
+    counter.inc('say "hi"\nback\\slash', amount=2)
+    assert counter.render()[-1] == 'errors_total{reason="say \\"hi\\"\\nback\\\\slash"} 3'
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    init_metrics(app)
+    timer = CommandTimer()
+
+    @app.route('/metrics-test/<int:commands>')
+    def send_commands(commands):
+        for _ in range(commands):
+            timer.started(None)
+        return jsonify({'sent': commands})
+
+    @app.route('/metrics-test/fail')
+    def fail():
+        raise RuntimeError('boom')
+
+    return app.test_client()
+
+def observed(histogram, *labels):
+    series = histogram._values.get(labels)
+    return series[2] if series else 0
+
+def test_requests_timed_per_route_and_status(client):
+    before = observed(REQUEST_LATENCY, '/metrics-test/<int:commands>', 'GET', 200)
+    for _ in range(3):
+        client.get('/metrics-test/2')
+    client.get('/no-such-route')
+    assert observed(REQUEST_LATENCY, '/metrics-test/<int:commands>', 'GET', 200) == before + 3
+    assert observed(REQUEST_LATENCY, 'unmatched', 'GET', 404) >= 1
+
+def test_mongo_commands_counted_per_request(client):
+    client.get('/metrics-test/0')
+    client.get('/metrics-test/7')
+    counts, total, count = REQUEST_MONGO_COMMANDS._values[('/metrics-test/<int:commands>',)]
+    assert count >= 2 and total >= 7
+    # 7 commands land in the le="10" bucket
+    assert counts[REQUEST_MONGO_COMMANDS.buckets.index(10)] >= 1
+
+def test_in_progress_gauge_returns_to_zero_after_errors(client):
+    before = REQUESTS_IN_PROGRESS._values.get((), 0)
+    client.get('/metrics-test/fail')
+    client.get('/metrics-test/1')
+    assert REQUESTS_IN_PROGRESS._values.get((), 0) == before
+
+def test_metrics_endpoint(client):
+    client.get('/metrics-test/1')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in body
+    assert 'http_request_duration_seconds_count{route="/metrics-test/<int:commands>",method="GET",status="200"}' in body
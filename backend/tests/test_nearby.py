@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from fuzzy_search import haversine_miles
+from nearby import PointIndex, chord_for_miles, nearby_markets, unit_vectors
+
+def random_points(count, seed=0):
+    rng = np.random.default_rng(seed)
+    # Clustered like markets: a few dense metros over a sparse background
+    centres = rng.uniform((25, -125), (49, -67), size=(8, 2))
+    lats = np.concatenate([rng.uniform(25, 49, count // 2),
+                           rng.normal(centres[:, 0].repeat(count // 16), 0.3)[:count - count // 2]])
+    lngs = np.concatenate([rng.uniform(-125, -67, count // 2),
+                           rng.normal(centres[:, 1].repeat(count // 16), 0.3)[:count - count // 2]])
+    return lats, lngs, unit_vectors(lats, lngs)
+
+def brute_chords(points):
+    return np.sqrt(np.maximum(2 - 2 * points @ points.T, 0))
+
+@pytest.mark.parametrize('k, miles', [(1, 100), (5, 100), (10, 25), (10, 3000)])
+def test_nearest_matches_brute_force(k, miles):
+    _, _, points = random_points(400)
+    index = PointIndex(points)
+    chords = brute_chords(points)
+    np.fill_diagonal(chords, np.inf)
+    max_chord = chord_for_miles(miles)
+    seen = set()
+    for row, neighbours, distances in index.nearest(range(len(points)), k, max_chord):
+        seen.add(row)
+        expected = np.sort(chords[row][chords[row] <= max_chord])[:k]
+        np.testing.assert_allclose(distances, expected, atol=1e-12)
+        np.testing.assert_allclose(chords[row, neighbours], distances, atol=1e-12)
+    assert seen == set(range(len(points)))
+
+@pytest.mark.parametrize('miles', [1, 50, 500])
+def test_within_matches_brute_force(miles):
+    _, _, points = random_points(300, seed=1)
+    index = PointIndex(points)
+    chords = brute_chords(points)
+    max_chord = chord_for_miles(miles)
+    for row, rows, _ in index.within(range(len(points)), max_chord):
+        expected = set(np.flatnonzero(chords[row] <= max_chord).tolist()) - {row}
+        assert set(rows.tolist()) == expected
+
+@pytest.mark.parametrize('miles', [0.25, 5, 40])
+def test_pairs_within_matches_brute_force(miles):
+    _, _, points = random_points(600, seed=2)
+    max_chord = chord_for_miles(miles)
+    a, b = PointIndex(points, cell_size=max_chord).pairs_within(max_chord)
+    chords = brute_chords(points)
+    i, j = np.nonzero(np.triu(chords <= max_chord, k=1))
+    assert sorted(zip(a.tolist(), b.tolist())) == sorted(zip(i.tolist(), j.tolist()))
+
+def test_pairs_within_needs_small_radius():
+    _, _, points = random_points(50)
+    with pytest.raises(ValueError):
+        PointIndex(points, cell_size=0.001).pairs_within(0.01)
+
+def test_stored_neighbours_are_nearest(db):
+    markets = list(db.markets.find({'latitude': {'$type': 'number'}}, {'latitude': 1, 'longitude': 1}))
+    for market in markets[:20]:
+        nearby = nearby_markets(db, market['_id'], 5)
+        miles = [haversine_miles(market['latitude'], market['longitude'], other['latitude'], other['longitude'])
+                 for other in markets if other['_id'] != market['_id']]
+        expected = sorted(m for m in miles if m <= 100)[:5]
+        np.testing.assert_allclose([entry['miles'] for entry in nearby], expected, atol=0.01)
+
+def test_unknown_market_has_no_neighbours(db):
+    assert nearby_markets(db, ObjectId(), 5) == []
@@ -0,0 +1,108 @@
+import os
+import pstats
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+import profiling
+from profiling import StackSampler, init_profiling, profile_job
+
+TOKEN = 'secret-token'
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setenv('ADMIN_TOKEN', TOKEN)
+    monkeypatch.setattr(profiling, 'sampler', StackSampler())
+    monkeypatch.setattr(profiling, 'memory_tracker', profiling.MemoryTracker())
+    app = Flask(__name__)
+    init_profiling(app)
+
+    @app.route('/work')
+    def work():
+        return jsonify({'total': sum(i * i for i in range(10000))})
+
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+ADMIN = {'X-Admin-Token': TOKEN}
+
+def test_admin_endpoints_need_the_token(client, monkeypatch):
+    assert client.get('/admin/profile/sampler').status_code == 403
+    assert client.get('/admin/profile/sampler', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert client.get('/admin/profile/sampler', headers=ADMIN).status_code == 200
+    monkeypatch.delenv('ADMIN_TOKEN')
+    assert client.get('/admin/profile/sampler', headers=ADMIN).status_code == 404
+
+def test_request_profile_needs_admin_token(client, profile_dir):
+    assert 'X-Profile-File' not in client.get('/work', headers={'X-Profile': '1'}).headers
+    assert not list(profile_dir.iterdir())
+    response = client.get('/work', headers={'X-Profile': '1', **ADMIN})
+    name = response.headers['X-Profile-File']
+    assert name.endswith('-work.prof')
+    stats = pstats.Stats(str(profile_dir / name))
+    assert any(function == 'work' for _, _, function in stats.stats)
+
+def test_profile_dumps_are_pruned(client, profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MAX_FILES', 2)
+    for _ in range(4):
+        client.get('/work', headers={'X-Profile': '1', **ADMIN})
+    assert len(list(profile_dir.iterdir())) == 2
+
+def test_sampler_sees_busy_threads(client, profile_dir):
+    done = threading.Event()
+
+    def spin():
+        while not done.is_set():
+            sum(i for i in range(1000))
+
+    worker = threading.Thread(target=spin, name='busy-worker')
+    worker.start()
+    try:
+        response = client.post('/admin/profile/sampler?seconds=5&interval_ms=1', headers=ADMIN)
+        assert response.status_code == 200
+        assert client.post('/admin/profile/sampler?seconds=5', headers=ADMIN).status_code == 409
+        time.sleep(0.2)
+        report = client.delete('/admin/profile/sampler', headers=ADMIN).get_json()
+    finally:
+        done.set()
+        worker.join()
+    assert not report['running'] and report['samples'] > 0
+    assert any(stack['stack'].startswith('busy-worker;') for stack in report['top_stacks'])
+    folded = (profile_dir / os.path.basename(report['output'])).read_text()
+    assert 'test_profiling.py:spin' in folded
+
+def test_tracemalloc_snapshots_show_growth(client):
+    assert client.post('/admin/profile/tracemalloc/snapshot', headers=ADMIN).status_code == 409
+    assert client.post('/admin/profile/tracemalloc/start?group_by=bogus', headers=ADMIN).status_code == 400
+    assert client.post('/admin/profile/tracemalloc/start', headers=ADMIN).status_code == 200
+    try:
+        kept = [bytearray(1024) for _ in range(1000)]
+        diff = client.post('/admin/profile/tracemalloc/snapshot', headers=ADMIN).get_json()
+        assert diff['traced_kb'] >= 1000
+        assert any('test_profiling.py' in stat['where'] and stat['size_diff_kb'] >= 1000 for stat in diff['top'])
+        del kept
+    finally:
+        assert client.post('/admin/profile/tracemalloc/stop', headers=ADMIN).status_code == 200
+
+def test_profile_job_cpu_writes_stats(profile_dir, capsys):
+    with profile_job('import test', mode='cpu'):
+        sum(i * i for i in range(10000))
+    [dump] = profile_dir.iterdir()
+    assert dump.name.endswith('-import-test.prof')
+    assert 'function calls' in capsys.readouterr().err
+
+def test_profile_job_off_by_default(profile_dir, monkeypatch):
+    monkeypatch.delenv('PROFILE_JOBS', raising=False)
+    with profile_job('quiet'):
+        pass
+    assert not list(profile_dir.iterdir())
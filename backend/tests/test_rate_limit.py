@@ -0,0 +1,112 @@
+import pytest
+from flask import Blueprint, Flask, jsonify
+from pymongo.errors import ServerSelectionTimeoutError
+
+import rate_limit
+from rate_limit import InFlightLimiter, MemoryBuckets, MongoBuckets, init_rate_limits
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock)
+    return clock
+
+def test_bucket_starts_full_and_empties(clock):
+    buckets = MemoryBuckets()
+    assert [buckets.consume('a', 5, 10, 1)[0] for _ in range(3)] == [True, True, False]
+    # A rejected request spends nothing
+    assert buckets.consume('a', 1, 10, 1) == (False, 0)
+    # Other clients have their own bucket
+    assert buckets.consume('b', 5, 10, 1) == (True, 5)
+
+def test_bucket_refills_at_rate(clock):
+    buckets = MemoryBuckets()
+    assert buckets.consume('a', 10, 10, 2) == (True, 0)
+    clock.now += 1.5
+    assert buckets.consume('a', 5, 10, 2) == (False, 3)
+    clock.now += 1
+    assert buckets.consume('a', 5, 10, 2) == (True, 0)
+    # Never past capacity, however long the client was idle
+    clock.now += 3600
+    assert buckets.consume('a', 1, 10, 2) == (True, 9)
+
+def test_idle_buckets_are_pruned(clock):
+    buckets = MemoryBuckets(max_clients=2)
+    buckets.consume('a', 1, 10, 1)
+    buckets.consume('b', 1, 10, 1)
+    clock.now += 5
+    buckets.consume('c', 1, 10, 1)
+    # a and b have refilled to capacity, so forgetting them changes nothing
+    assert set(buckets._buckets) == {'c'}
+
+def test_in_flight_limiter():
+    limiter = InFlightLimiter(6)
+    # An idle worker takes any request, however expensive
+    assert limiter.acquire(20)
+    limiter.release(20)
+    assert limiter.acquire(5) and limiter.acquire(1)
+    assert not limiter.acquire(1)
+    limiter.release(5)
+    assert limiter.acquire(5)
+
+def test_mongo_store_falls_back_to_memory(clock):
+    class Unreachable:
+        @property
+        def rate_limits(self):
+            raise ServerSelectionTimeoutError('No servers found yet')
+
+    fallback = MemoryBuckets()
+    buckets = MongoBuckets(lambda: Unreachable(), fallback)
+    assert buckets.consume('a', 4, 10, 1) == (True, 6)
+    assert fallback._buckets['a'][0] == 6
+
+def test_mongo_store_without_pymongo_timeout(clock, monkeypatch):
+    # pymongo before 4.2 has no timeout(): the shared store must still be used
+    class Collection:
+        def find_one_and_update(self, *args, **kwargs):
+            return {'allowed': True, 'tokens': 7}
+
+    class Database:
+        rate_limits = Collection()
+
+    monkeypatch.delattr(rate_limit.pymongo, 'timeout')
+    fallback = MemoryBuckets()
+    buckets = MongoBuckets(lambda: Database(), fallback)
+    assert buckets.consume('a', 3, 10, 1) == (True, 7)
+    assert not fallback._buckets
+
+@pytest.fixture
+def app(monkeypatch, clock):
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_PER_MINUTE', 60)
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_BURST', 5)
+    monkeypatch.setattr(rate_limit, 'MAX_IN_FLIGHT_COST', 0)
+    app = Flask(__name__)
+    api = Blueprint('api', __name__)
+
+    @api.route('/api/markets')
+    def get_markets():
+        return jsonify({'success': True})
+
+    app.register_blueprint(api)
+    init_rate_limits(app, lambda: None)
+    return app
+
+def test_requests_limited_and_refilled(app, clock):
+    client = app.test_client()
+    # api.get_markets costs 2
+    statuses = [client.get('/api/markets').status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    response = client.get('/api/markets')
+    assert response.headers['Retry-After'] == '1'
+    clock.now += 1
+    response = client.get('/api/markets')
+    assert response.status_code == 200
+    assert response.headers['RateLimit-Limit'] == '5'
+    assert response.headers['RateLimit-Remaining'] == '0'
@@ -0,0 +1,85 @@
+import mongomock
+import pytest
+from pymongo import MongoClient
+
+from read_routing import api_read_options, describe, parse_tags, read_preference
+
+READ_ENV = ('MONGODB_READ_PREFERENCE', 'MONGODB_MAX_STALENESS_SECONDS', 'MONGODB_READ_TAGS', 'MONGODB_READ_CONCERN')
+
+@pytest.fixture
+def read_env(monkeypatch):
+    for name in READ_ENV:
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+def test_parse_tags():
+    assert parse_tags('use:reads, region:us-east') == [{'use': 'reads', 'region': 'us-east'}, {}]
+    assert parse_tags('') is None and parse_tags('nocolon') is None
+
+def test_defaults_to_primary(read_env):
+    options = api_read_options()
+    assert options['read_preference'].mongos_mode == 'primary'
+    assert options['read_concern'].level is None
+
+def test_secondary_options(read_env):
+    read_env.setenv('MONGODB_READ_PREFERENCE', 'secondaryPreferred')
+    read_env.setenv('MONGODB_MAX_STALENESS_SECONDS', '120')
+    read_env.setenv('MONGODB_READ_TAGS', 'use:reads')
+    read_env.setenv('MONGODB_READ_CONCERN', 'majority')
+    options = api_read_options()
+    assert options['read_preference'].mongos_mode == 'secondaryPreferred'
+    assert options['read_preference'].max_staleness == 120
+    assert options['read_preference'].tag_sets == [{'use': 'reads'}, {}]
+    assert options['read_concern'].level == 'majority'
+
+@pytest.mark.parametrize('mode, staleness, tags', [
+    ('fastest', -1, None),
+    ('secondary', 30, None),
+    ('primary', 120, None),
+    ('primary', -1, [{'use': 'reads'}, {}]),
+])
+def test_invalid_read_preferences(mode, staleness, tags):
+    with pytest.raises(ValueError):
+        read_preference(mode, staleness, tags)
+
+def test_invalid_read_concern(read_env):
+    read_env.setenv('MONGODB_READ_CONCERN', 'linearizable')
+    with pytest.raises(ValueError):
+        api_read_options()
+
+def test_read_db_has_the_api_options_and_db_stays_primary(stand_in, read_env):
+    read_env.setenv('MONGODB_READ_PREFERENCE', 'nearest')
+    read_env.setenv('MONGODB_READ_CONCERN', 'local')
+    # A lazy client: building handles does not contact a server
+    read_env.setattr(stand_in, '_client', MongoClient('mongodb://localhost:27017', connect=False))
+    read_env.setattr(stand_in, '_read_db', None)
+    assert describe(stand_in.get_read_db()) == {
+        'read_preference': 'nearest', 'max_staleness': -1, 'tags': [{}], 'read_concern': 'local'}
+    assert describe(stand_in.get_db())['read_preference'] == 'primary'
+
+@pytest.fixture
+def split(stand_in, db, monkeypatch):
+    """Reads through get_read_db() see the seeded markets, get_db() an empty database"""
+    primary = mongomock.MongoClient().farmers_market
+    monkeypatch.setattr(stand_in, 'get_db', lambda: primary)
+    monkeypatch.setattr(stand_in, 'get_read_db', lambda: db)
+    return primary
+
+def test_api_reads_use_the_read_db(client, db, split):
+    assert client.get('/api/markets').get_json()['total'] == db.markets.count_documents({})
+    market_id = str(db.markets.find_one()['_id'])
+    assert client.get(f'/api/markets/{market_id}').status_code == 200
+
+@pytest.mark.parametrize('url', ['/test-connection', '/debug'])
+def test_admin_and_debug_reads_use_the_primary(client, split, url):
+    payload = client.get(url).get_json()
+    total = payload['total_markets'] if 'total_markets' in payload else payload['database']['total_markets']
+    assert total == 0
+
+def test_writes_use_the_primary(client, db, split):
+    before = db.markets.count_documents({})
+    split.markets.insert_one({'market_name': 'Primary Only', 'market_address': '1 Main St, Springfield, IL 62701'})
+    response = client.post('/update-states')
+    assert response.get_json()['total_markets'] == 1
+    assert split.markets.find_one()['state'] == 'IL'
+    assert db.markets.count_documents({}) == before
@@ -0,0 +1,84 @@
+import pytest
+from flask import Flask, jsonify
+from pymongo.errors import ServerSelectionTimeoutError
+
+import resilience
+from resilience import CLOSED, OPEN, CircuitBreaker, StaleCache, init_resilience, resilient_read
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(min_calls=3, window_seconds=60, cooldown_seconds=60)
+    monkeypatch.setattr(resilience, 'breaker', breaker)
+    monkeypatch.setattr(resilience, 'stale_cache', resilience.StaleCache())
+    return breaker
+
+@pytest.fixture
+def client(breaker):
+    app = Flask(__name__)
+    init_resilience(app)
+
+    @app.route('/handled-bug')
+    @resilient_read
+    def handled_bug():
+        # The api handlers' pattern: re-raise UNAVAILABLE_ERRORS, answer the rest with a 500
+        try:
+            return jsonify({'pages': 10 // 0})
+        except resilience.UNAVAILABLE_ERRORS:
+            raise
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+    @app.route('/unhandled-bug')
+    @resilient_read
+    def unhandled_bug():
+        raise ZeroDivisionError('division by zero')
+
+    @app.route('/unreachable')
+    @resilient_read
+    def unreachable():
+        raise ServerSelectionTimeoutError('No servers found yet')
+
+    return app.test_client()
+
+@pytest.mark.parametrize('path', ['/handled-bug', '/unhandled-bug'])
+def test_handler_errors_leave_breaker_closed(client, breaker, path):
+    for _ in range(10):
+        assert client.get(path).status_code == 500
+    assert breaker.state == CLOSED
+
+def test_server_selection_timeout_opens_breaker(client, breaker):
+    for _ in range(3):
+        assert client.get('/unreachable').status_code == 503
+    assert breaker.state == OPEN
+    # Open: later requests are answered without calling the view
+    response = client.get('/handled-bug')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+def test_stale_cache_stays_under_max_bytes():
+    cache = StaleCache(max_entries=100, max_entry_bytes=400, max_bytes=1000)
+    for i in range(50):
+        cache.put(f'/api/markets?page={i}', b'x' * (100 + i * 7 % 300), 'application/json')
+        assert cache.nbytes == sum(len(body) for body, _, _ in cache._entries.values())
+        assert cache.nbytes <= 1000
+    # The newest entries are the ones kept
+    assert cache.get('/api/markets?page=49') is not None
+    assert cache.get('/api/markets?page=0') is None
+
+def test_stale_cache_evicts_least_recently_used():
+    cache = StaleCache(max_entries=100, max_bytes=300)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, b'x' * 100, 'application/json')
+    cache.get('a')
+    cache.put('d', b'x' * 100, 'application/json')
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in ('a', 'c', 'd'))
+
+def test_stale_cache_replacing_an_entry_frees_its_bytes():
+    cache = StaleCache(max_entries=100, max_bytes=300)
+    for size in (250, 100, 250):
+        cache.put('a', b'x' * size, 'application/json')
+    assert cache.nbytes == 250 and len(cache) == 1
+    # Larger than the whole cache: not kept, and nothing else is evicted for it
+    cache.put('b', b'x' * 301, 'application/json')
+    assert cache.get('b') is None and cache.get('a') is not None
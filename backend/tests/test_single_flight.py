@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+from pymongo.errors import ExecutionTimeout
+
+from single_flight import SingleFlight
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+def run_concurrently(flight, key, fn, callers):
+    """Start callers threads on flight.do(key, fn); returns (threads, results, errors)"""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    entered, release = threading.Event(), threading.Event()
+    calls = []
+
+    def query():
+        calls.append(1)
+        entered.set()
+        release.wait(5)
+        return {'markets': []}
+
+    leader, results, errors = run_concurrently(flight, ('markets', 1), query, 1)
+    assert entered.wait(5)
+    followers, more_results, _ = run_concurrently(flight, ('markets', 1), query, 4)
+    # Wait until all four followers are queued behind the leader
+    wait_for(lambda: flight.in_flight().get(('markets', 1)) == 4)
+    release.set()
+    for thread in leader + followers:
+        thread.join(5)
+    assert len(calls) == 1
+    assert results + more_results == [{'markets': []}] * 5
+    # Followers get the leader's object itself
+    assert all(result is results[0] for result in more_results)
+    assert flight.in_flight() == {}
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    assert flight.do(('a',), lambda: 1) == 1
+    assert flight.do(('b',), lambda: 2) == 2
+    # Finished calls are not cached
+    assert flight.do(('a',), lambda: 3) == 3
+
+def test_errors_are_shared():
+    flight = SingleFlight()
+    entered, release = threading.Event(), threading.Event()
+
+    def query():
+        entered.set()
+        release.wait(5)
+        raise ValueError('bad query')
+
+    leader, _, leader_errors = run_concurrently(flight, ('k',), query, 1)
+    assert entered.wait(5)
+    followers, _, follower_errors = run_concurrently(flight, ('k',), query, 2)
+    wait_for(lambda: flight.in_flight().get(('k',)) == 2)
+    release.set()
+    for thread in leader + followers:
+        thread.join(5)
+    assert [str(e) for e in leader_errors + follower_errors] == ['bad query'] * 3
+
+def test_followers_time_out():
+    flight = SingleFlight(wait_timeout=0.05)
+    entered, release = threading.Event(), threading.Event()
+    leader, results, _ = run_concurrently(flight, ('k',), lambda: entered.set() or release.wait(5), 1)
+    assert entered.wait(5)
+    with pytest.raises(ExecutionTimeout):
+        flight.do(('k',), lambda: None)
+    release.set()
+    leader[0].join(5)
+    assert results == [True]
+
+def test_disabled_runs_every_call():
+    flight = SingleFlight(enabled=False)
+    calls = []
+    flight.do(('k',), lambda: calls.append(1))
+    flight.do(('k',), lambda: calls.append(1))
+    assert len(calls) == 2
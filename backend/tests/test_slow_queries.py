@@ -0,0 +1,60 @@
+import pytest
+
+from slow_queries import SlowQueryLog, normalize_filter, query_shape
+
+def test_normalize_filter_keeps_fields_and_operators():
+    query = {'state': 'CA', 'rating': {'$gte': 4}, 'zipCode': {'$in': ['94110', '94111']},
+             '$or': [{'city': 'Oakland'}, {'city': 'Berkeley'}]}
+    assert normalize_filter(query) == {'state': '?', 'rating': {'$gte': '?'}, 'zipCode': {'$in': '?'},
+                                       '$or': [{'city': '?'}, {'city': '?'}]}
+
+def test_same_shape_for_different_values():
+    a = query_shape('find', {'find': 'markets', 'filter': {'state': 'CA'}, 'sort': {'_id': 1}})
+    b = query_shape('find', {'find': 'markets', 'filter': {'state': 'NY'}, 'sort': {'_id': 1}})
+    assert a == b == {'command': 'find', 'collection': 'markets', 'filter': {'state': '?'}, 'sort': {'_id': 1}}
+    pipeline = query_shape('aggregate', {'aggregate': 'markets', 'pipeline': [
+        {'$match': {'state': 'CA'}}, {'$group': {'_id': '$city', 'count': {'$sum': 1}}}]})
+    assert pipeline['pipeline'] == [{'$match': {'state': '?'}}, {'$group': ['_id', 'count']}]
+
+@pytest.fixture
+def log():
+    return SlowQueryLog(threshold_ms=100, explain_sample=0, size=5)
+
+def test_report_groups_by_shape_newest_first(log):
+    for i, state in enumerate(['CA', 'NY', 'CA', 'TX']):
+        log.record('find', 'farmers_market', {'find': 'markets', 'filter': {'state': state}, 'skip': i}, 100 + i)
+    log.record('count', 'farmers_market', {'count': 'markets', 'query': {}}, 500)
+    report = log.report(3)
+    assert [entry['command'] for entry in report['recent']] == ['count', 'find', 'find']
+    assert report['recent'][1]['skip'] == 3
+    # Heaviest shapes first: the four finds differ only in their values
+    assert [(stats['shape']['command'], stats['count']) for stats in report['shapes']] == [('count', 1), ('find', 4)]
+
+def test_log_keeps_the_latest_entries(log):
+    for i in range(8):
+        log.record('find', 'farmers_market', {'find': 'markets', 'filter': {}, 'skip': i}, 150)
+    assert [entry['skip'] for entry in log.report(50)['recent']] == [7, 6, 5, 4, 3]
+
+@pytest.fixture
+def recorded(stand_in, monkeypatch):
+    log = SlowQueryLog(threshold_ms=100, explain_sample=0, size=5)
+    monkeypatch.setattr(stand_in, 'slow_query_log', log)
+    for i in range(4):
+        log.record('find', 'farmers_market', {'find': 'markets', 'filter': {}, 'skip': i}, 150)
+    return log
+
+@pytest.mark.parametrize('limit, expected', [
+    ('2', [3, 2]),
+    ('0', [3]),
+    ('-3', [3]),
+    ('1000', [3, 2, 1, 0]),
+])
+def test_debug_endpoint_clamps_limit(client, recorded, limit, expected):
+    response = client.get(f'/debug/slow-queries?limit={limit}')
+    assert response.status_code == 200
+    assert [entry['skip'] for entry in response.get_json()['recent']] == expected
+
+@pytest.mark.parametrize('limit', ['abc', '2.5', ''])
+def test_debug_endpoint_rejects_bad_limit(client, recorded, limit):
+    response = client.get(f'/debug/slow-queries?limit={limit}')
+    assert response.status_code == 400
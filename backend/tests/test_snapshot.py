@@ -0,0 +1,61 @@
+import mongomock
+from bson import ObjectId
+
+from snapshot import MarketSnapshot, export_snapshot, refresh_snapshot
+
+def test_snapshot_outlives_pruning(tmp_path):
+    db = mongomock.MongoClient().farmers_market
+    db.markets.insert_many([{'_id': ObjectId(), 'market_name': f'Market {i}', 'state': 'CA',
+                             'latitude': 37.0 + i, 'rating': None} for i in range(3)])
+    first, _ = export_snapshot(db, root=str(tmp_path), keep=2)
+    snapshot = MarketSnapshot(first)
+
+    db.markets.delete_many({})
+    export_snapshot(db, root=str(tmp_path), keep=2)
+    export_snapshot(db, root=str(tmp_path), keep=2)
+    assert not (tmp_path / first.split('/')[-1]).exists()
+
+    document = snapshot.document(1)
+    assert document['market_name'] == 'Market 1'
+    assert document['rating'] is None
+    assert [row['_id'] for row in snapshot.state_counts()] == ['CA']
+
+def test_merged_ids_resolve_from_the_snapshot(tmp_path):
+    db = mongomock.MongoClient().farmers_market
+    kept, other = ObjectId(), ObjectId()
+    db.markets.insert_many([
+        {'_id': kept, 'market_name': 'Kept', 'merged_ids': [str(ObjectId()), 'gone-1']},
+        {'_id': other, 'market_name': 'Other'},
+    ])
+    directory, _ = export_snapshot(db, root=str(tmp_path))
+    snapshot = MarketSnapshot(directory)
+    merged = db.markets.find_one({'_id': kept})['merged_ids']
+    assert [snapshot.merged_into(market_id) for market_id in merged] == [0, 0]
+    assert snapshot.merged_into(str(other)) is None
+    assert snapshot.merged_into('gone-2') is None
+
+def test_refresh_snapshot_only_when_published(tmp_path):
+    db = mongomock.MongoClient().farmers_market
+    db.markets.insert_one({'market_name': 'Only'})
+    assert refresh_snapshot(db, root=str(tmp_path)) is None
+    assert not list(tmp_path.iterdir())
+    export_snapshot(db, root=str(tmp_path))
+    directory, count = refresh_snapshot(db, root=str(tmp_path))
+    assert count == 1
+    assert (tmp_path / 'CURRENT').read_text() == directory.split('/')[-1]
+
+def test_snapshot_lookup_of_merged_id_does_not_read_the_database(client, stand_in, tmp_path, monkeypatch):
+    db = mongomock.MongoClient().farmers_market
+    kept = ObjectId()
+    db.markets.insert_one({'_id': kept, 'market_name': 'Kept', 'merged_ids': ['64a0000000000000000000aa']})
+    directory, _ = export_snapshot(db, root=str(tmp_path))
+
+    def no_database():
+        raise AssertionError('snapshot reads must not query MongoDB')
+
+    monkeypatch.setattr(stand_in, 'get_snapshot', lambda: MarketSnapshot(directory))
+    monkeypatch.setattr(stand_in, 'get_read_db', no_database)
+    response = client.get('/api/markets/64a0000000000000000000aa')
+    assert response.status_code == 200
+    assert response.get_json()['market']['_id'] == str(kept)
+    assert client.get('/api/markets/64a0000000000000000000ab').status_code == 404
@@ -0,0 +1,39 @@
+import pytest
+
+from viewport import lng_spans, market_filter, parse_bbox
+
+def boxes(query):
+    return query['$or'] if '$or' in query else [query]
+
+def ring(box):
+    return box['location']['$geoWithin']['$geometry']['coordinates'][0]
+
+def covered(spans, lng):
+    return any(west <= lng <= east for west, east in spans)
+
+@pytest.mark.parametrize('bbox, inside, outside', [
+    # Ordinary box
+    ('-125,24,-66,50', [-125, -100, -66], [-130, -60, 0]),
+    # Across the antimeridian
+    ('170,-20,-170,20', [170, 179.9, -180, -170], [0, 160, -160]),
+    # Wider than 180 degrees
+    ('-170,-60,170,60', [-170, 0, 90, 170], [175, -175, 180]),
+    # Wider than 180 degrees and across the antimeridian
+    ('-60,-60,-70,60', [-60, 0, 180, -180, -70], [-65]),
+    ('-180,-85,180,85', [-180, 0, 180], []),
+])
+def test_market_filter_covers_bbox(bbox, inside, outside):
+    bbox = parse_bbox(bbox)
+    query = market_filter(bbox)
+    spans = [(ring(box)[0][0], ring(box)[1][0]) for box in boxes(query)]
+    assert spans == lng_spans(bbox[0], bbox[2])
+    for west, east in spans:
+        assert -180 <= west < east <= 180
+        assert east - west < 180
+    assert all(covered(spans, lng) for lng in inside)
+    assert not any(covered(spans, lng) for lng in outside)
+    for box in boxes(query):
+        assert {point[1] for point in ring(box)} == {bbox[1], bbox[3]}
+
+def test_narrow_bbox_is_one_box():
+    assert '$or' not in market_filter(parse_bbox('-122.5,37.7,-122.3,37.8'))
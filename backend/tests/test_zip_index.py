@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+import app as app_module
+import zip_index
+from market_cache import DatasetCache
+from rollups import get_rollup_version
+from zip_index import ZipIndex, build_zip_index, load_table, parse_zip
+
+SCRIPT = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'build_zip_centroids.py')
+
+# Rows in the gazetteer's layout (trailing whitespace on the last header included)
+GAZETTEER = (
+    "GEOID\tALAND\tAWATER\tALAND_SQMI\tAWATER_SQMI\tINTPTLAT\tINTPTLONG                                 \n"
+    "00601\t166847909\t799292\t64.42\t0.309\t18.180556\t-66.749961\n"
+    "59901\t1352329066\t15014839\t522.138\t5.797\t48.217364\t-114.2473\n"
+    "99950\t7679498498\t1429478028\t2965.073\t551.926\t55.542007\t-131.432682\n"
+)
+
+@pytest.mark.parametrize('value, expected', [
+    ('94110', '94110'), (' 94110-1234 ', '94110'), ('9411', None), ('94110-12', None), ('abcde', None), (None, None),
+])
+def test_parse_zip(value, expected):
+    assert parse_zip(value) == expected
+
+def test_lookup_and_merge():
+    table = ZipIndex([59901, 601], [48.2, 18.2], [-114.2, -66.7])
+    assert table.lookup('00601') == (18.2, -66.7)
+    assert table.lookup('00602') is None
+    merged = ZipIndex.merged(([601], [18.2], [-66.7]), ([601, 10001], [0.0, 40.7], [0.0, -74.0]), ([], [], []))
+    # The table wins over the market centroids
+    assert merged.lookup('00601') == (18.2, -66.7)
+    assert merged.lookup('10001') == (40.7, -74.0)
+    assert len(ZipIndex.merged()) == 0
+
+@pytest.fixture(scope='module')
+def table(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('zips')
+    with zipfile.ZipFile(directory / '2023_Gaz_zcta_national.zip', 'w') as archive:
+        archive.writestr('2023_Gaz_zcta_national.txt', GAZETTEER)
+    output = directory / 'zip_centroids.csv'
+    subprocess.run([sys.executable, SCRIPT, str(directory / '2023_Gaz_zcta_national.zip'), '--output', str(output)],
+                   check=True)
+    return str(output)
+
+def test_build_script_writes_table(table):
+    with open(table) as f:
+        assert f.read().splitlines() == [
+            'zip,latitude,longitude',
+            '00601,18.18056,-66.74996',
+            '59901,48.21736,-114.2473',
+            '99950,55.54201,-131.43268',
+        ]
+    zips, lats, lngs = load_table(table)
+    assert zips.tolist() == [601, 59901, 99950]
+
+@pytest.fixture
+def zip_search(monkeypatch, table, db):
+    monkeypatch.setattr(zip_index, 'load_table', lambda: load_table(table))
+    monkeypatch.setattr(app_module, 'zip_cache',
+                        DatasetCache('ZIP centroids', build_zip_index, version_of=get_rollup_version))
+    return app_module.app.test_client()
+
+def test_zip_without_markets_is_searchable(zip_search, db):
+    assert db.markets.count_documents({'zipCode': '99950'}) == 0
+    response = zip_search.get('/api/markets/search?zip=99950&radius=25&mode=fuzzy&q=market')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['origin'] == {'zip': '99950', 'latitude': 55.54201, 'longitude': -131.43268}
+    assert body['markets'] == []
+
+def test_market_zip_falls_back_to_market_centroid(zip_search, db):
+    market = db.markets.find_one({'zipCode': {'$regex': r'^\d{5}$'}, 'latitude': {'$type': 'number'}})
+    response = zip_search.get(f"/api/markets/search?zip={market['zipCode']}&radius=5&mode=fuzzy"
+                              f"&q={market['market_name']}")
+    assert response.status_code == 200
+    assert response.get_json()['origin']['zip'] == market['zipCode']
+
+@pytest.mark.parametrize('query, status', [('zip=00000', 404), ('zip=123', 400), ('zip=59901&lat=1&lng=2', 400)])
+def test_bad_zip(zip_search, query, status):
+    assert zip_search.get(f'/api/markets/search?{query}').status_code == status
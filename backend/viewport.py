@@ -0,0 +1,173 @@
+"""
+Map viewport queries with server-side clustering.
+
+GET /api/markets/viewport?bbox=minLng,minLat,maxLng,maxLat&zoom=z returns
+every market in the box at zoom >= CLUSTER_MAX_ZOOM. Below that it
+returns clusters: the markets are binned into a Web Mercator grid of
+CLUSTER_CELL_PX-pixel cells. Each cell reports its count and centroid,
+plus the market's id when the cell holds a single market. minLng >
+maxLng means the box crosses the antimeridian; boxes of any width are
+queried as pieces narrower than 180 degrees (see lng_spans()).
+
+rebuild_clusters() precomputes the cells of every zoom level below
+CLUSTER_MAX_ZOOM into the `market_clusters` collection. It runs at import
+time, after load_csv.py, import_data.py, clean_data.py and
+migrate_schema.py, or standalone via scripts/rebuild_clusters.py.
+
+Payloads stay bounded whatever bbox a client sends. A box spanning more
+than VIEWPORT_MAX_CELLS cells is served at a coarser zoom. A box holding
+more than VIEWPORT_MAX_MARKETS markets at street level is served as
+clusters of the finest precomputed zoom.
+"""
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+from indexes import index_models
+
+CLUSTER_MAX_ZOOM = int(os.getenv('CLUSTER_MAX_ZOOM', 12))
+CLUSTER_CELL_PX = int(os.getenv('CLUSTER_CELL_PX', 64))
+VIEWPORT_MAX_MARKETS = int(os.getenv('VIEWPORT_MAX_MARKETS', 500))
+VIEWPORT_MAX_CELLS = int(os.getenv('VIEWPORT_MAX_CELLS', 1024))
+TILE_PX = 256
+# Web Mercator stops here; points beyond are clamped onto the edge cells
+MAX_LATITUDE = 85.05112878
+
+CLUSTER_PROJECTION = {'_id': 0, 'count': 1, 'latitude': 1, 'longitude': 1, 'market_id': 1}
+
+def cells_per_axis(zoom):
+    return (TILE_PX // CLUSTER_CELL_PX) << zoom
+
+def cell_x(lng, zoom):
+    n = cells_per_axis(zoom)
+    return np.clip(np.floor((np.asarray(lng, dtype=np.float64) + 180) / 360 * n), 0, n - 1).astype(np.int64)
+
+def cell_y(lat, zoom):
+    n = cells_per_axis(zoom)
+    rad = np.radians(np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    y = (1 - np.log(np.tan(rad) + 1 / np.cos(rad)) / math.pi) / 2 * n
+    return np.clip(np.floor(y), 0, n - 1).astype(np.int64)
+
+def parse_bbox(value):
+    """'minLng,minLat,maxLng,maxLat' -> floats; minLng > maxLng crosses the antimeridian"""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(part) for part in value.split(','))
+    except ValueError:
+        raise ValueError("bbox must be minLng,minLat,maxLng,maxLat")
+    if not all(math.isfinite(v) for v in (min_lng, min_lat, max_lng, max_lat)):
+        raise ValueError("bbox values must be finite numbers")
+    if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise ValueError("bbox is out of range")
+    return min_lng, min_lat, max_lng, max_lat
+
+def _x_ranges(bbox, zoom):
+    min_lng, _, max_lng, _ = bbox
+    x0, x1 = int(cell_x(min_lng, zoom)), int(cell_x(max_lng, zoom))
+    if min_lng <= max_lng:
+        return [(x0, x1)]
+    return [(x0, cells_per_axis(zoom) - 1), (0, x1)]
+
+def cluster_query(bbox, zoom):
+    """(zoom actually used, market_clusters filter) covering bbox with at most VIEWPORT_MAX_CELLS cells"""
+    zoom = max(0, min(zoom, CLUSTER_MAX_ZOOM - 1))
+    while True:
+        x_ranges = _x_ranges(bbox, zoom)
+        y0, y1 = int(cell_y(bbox[3], zoom)), int(cell_y(bbox[1], zoom))
+        cells = sum(x1 - x0 + 1 for x0, x1 in x_ranges) * (y1 - y0 + 1)
+        if cells <= VIEWPORT_MAX_CELLS or zoom == 0:
+            break
+        zoom -= 1
+    ranges = [{'x': {'$gte': x0, '$lte': x1}} for x0, x1 in x_ranges]
+    query = {'zoom': zoom, 'y': {'$gte': y0, '$lte': y1}}
+    if len(ranges) == 1:
+        query.update(ranges[0])
+    else:
+        query['$or'] = ranges
+    return zoom, query
+
+def lng_spans(min_lng, max_lng):
+    """
+    (west, east) longitude spans covering min_lng .. max_lng, split at the
+    antimeridian and into pieces narrower than 180 degrees
+    """
+    spans = [(min_lng, max_lng)] if min_lng <= max_lng else [(min_lng, 180), (-180, max_lng)]
+    pieces = []
+    for west, east in spans:
+        # MongoDB takes the shorter way round for each polygon edge, so a box
+        # 180 degrees or wider would select the complement of what was asked for
+        parts = int((east - west) // 180) + 1
+        step = (east - west) / parts
+        pieces.extend((west + step * i, east if i == parts - 1 else west + step * (i + 1)) for i in range(parts))
+    return pieces
+
+def market_filter(bbox):
+    """$geoWithin filter for the markets inside bbox, one box per lng_spans() piece"""
+    min_lng, min_lat, max_lng, max_lat = bbox
+
+    def box(west, east):
+        ring = [[west, min_lat], [east, min_lat], [east, max_lat], [west, max_lat], [west, min_lat]]
+        return {'location': {'$geoWithin': {'$geometry': {'type': 'Polygon', 'coordinates': [ring]}}}}
+
+    boxes = [box(west, east) for west, east in lng_spans(min_lng, max_lng)]
+    return boxes[0] if len(boxes) == 1 else {'$or': boxes}
+
+def build_clusters(ids, lats, lngs, max_zoom=CLUSTER_MAX_ZOOM):
+    """Yield one cluster document per occupied grid cell for zooms 0 .. max_zoom - 1"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    located = np.isfinite(lats) & np.isfinite(lngs)
+    if not located.all():
+        ids = [market_id for market_id, keep in zip(ids, located.tolist()) if keep]
+        lats, lngs = lats[located], lngs[located]
+    for zoom in range(max_zoom):
+        n = cells_per_axis(zoom)
+        keys = cell_x(lngs, zoom) * n + cell_y(lats, zoom)
+        cells, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        centroid_lat = np.bincount(inverse, weights=lats) / counts
+        centroid_lng = np.bincount(inverse, weights=lngs) / counts
+        # Some market of each cell; for single-market cells it is the market, drawn as a marker
+        first = np.zeros(len(cells), dtype=np.int64)
+        first[inverse] = np.arange(len(keys))
+        for cell, count, lat, lng, row in zip(cells.tolist(), counts.tolist(), centroid_lat.tolist(),
+                                              centroid_lng.tolist(), first.tolist()):
+            cluster = {'zoom': zoom, 'x': cell // n, 'y': cell % n, 'count': count,
+                       'latitude': round(lat, 6), 'longitude': round(lng, 6)}
+            if count == 1:
+                cluster['market_id'] = str(ids[row])
+            yield cluster
+
+def rebuild_clusters(db, max_zoom=CLUSTER_MAX_ZOOM, batch_size=10000):
+    """Recompute market_clusters from the markets' coordinates and swap it in"""
+    started = time.time()
+    ids, lats, lngs = [], [], []
+    for market in db.markets.find({'latitude': {'$type': 'number'}, 'longitude': {'$type': 'number'}},
+                                  {'latitude': 1, 'longitude': 1}):
+        ids.append(market['_id'])
+        lats.append(market['latitude'])
+        lngs.append(market['longitude'])
+
+    # Build aside and rename over the live collection, so readers never see a partial set
+    staging = db.market_clusters_rebuild
+    staging.drop()
+    total = 0
+    batch = []
+    for cluster in build_clusters(ids, lats, lngs, max_zoom):
+        batch.append(cluster)
+        if len(batch) >= batch_size:
+            staging.insert_many(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        staging.insert_many(batch)
+        total += len(batch)
+    if total:
+        staging.create_indexes(index_models('market_clusters'))
+        staging.rename('market_clusters', dropTarget=True)
+    else:
+        db.market_clusters.delete_many({})
+    print(f"Rebuilt market_clusters: {total} cells over {max_zoom} zoom levels from {len(ids)} markets "
+          f"in {time.time() - started:.1f}s", file=sys.stderr)
+    return total
@@ -0,0 +1,101 @@
+"""
+ZIP code to centroid lookup for proximity search.
+
+GET /api/markets/search?zip=94110 (or q=94110 with nothing else to
+locate it) resolves the ZIP code to a latitude/longitude here and then
+runs the usual nearest-first radius search. No geocoding service is
+called. The response names the point it searched from:
+
+    "origin": {"zip": "94110", "latitude": 37.74879, "longitude": -122.41545}
+
+Centroids come from the bundled table ZIP_CENTROIDS_PATH (zip,latitude,
+longitude). scripts/build_zip_centroids.py writes it from the Census
+ZCTA gazetteer. ZIP codes missing from the table, or every ZIP code if
+there is no table, fall back to the mean position of the markets filed
+under them (zip_rollups, see rollups.py).
+
+The index is three parallel arrays sorted by ZIP code, a lookup is one
+np.searchsorted, and 33k ZIP codes take about 400 KB. It is rebuilt
+when the rollups are.
+"""
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+from market_cache import DatasetCache
+from rollups import ROLLUPS, get_rollup_version
+
+# Relative paths are relative to this directory
+ZIP_CENTROIDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  os.getenv('ZIP_CENTROIDS_PATH', os.path.join('data', 'zip_centroids.csv')))
+
+# 5-digit ZIP, optionally ZIP+4
+ZIP_PATTERN = re.compile(r'^\s*(\d{5})(?:-\d{4})?\s*$')
+
+def parse_zip(value):
+    """'94110' or '94110-1234' -> '94110'; None for anything else"""
+    match = ZIP_PATTERN.match(value or '')
+    return match.group(1) if match else None
+
+class ZipIndex:
+    """ZIP code centroids as arrays sorted by ZIP code"""
+
+    def __init__(self, zips, lats, lngs):
+        zips = np.asarray(zips, dtype=np.uint32)
+        order = np.argsort(zips, kind='stable')
+        self.zips = zips[order]
+        self.lats = np.asarray(lats, dtype=np.float64)[order]
+        self.lngs = np.asarray(lngs, dtype=np.float64)[order]
+
+    def __len__(self):
+        return len(self.zips)
+
+    def lookup(self, zip_code):
+        """(latitude, longitude) of a 5-digit ZIP code string, or None if unknown"""
+        key = int(zip_code)
+        at = int(np.searchsorted(self.zips, key))
+        if at == len(self.zips) or self.zips[at] != key:
+            return None
+        return float(self.lats[at]), float(self.lngs[at])
+
+    @classmethod
+    def merged(cls, *sources):
+        """One index from several (zips, lats, lngs) sources; the first to list a ZIP code wins"""
+        sources = [source for source in sources if len(source[0])]
+        if not sources:
+            return cls([], [], [])
+        zips, lats, lngs = (np.concatenate([np.asarray(source[i], dtype=dtype) for source in sources])
+                            for i, dtype in enumerate((np.uint32, np.float64, np.float64)))
+        # np.unique keeps the first occurrence of each ZIP code
+        zips, first = np.unique(zips, return_index=True)
+        return cls(zips, lats[first], lngs[first])
+
+def load_table(path=ZIP_CENTROIDS_PATH):
+    """(zips, lats, lngs) from the bundled centroid table; empty if it is not there"""
+    if not os.path.exists(path):
+        return [], [], []
+    table = pd.read_csv(path, dtype={'zip': str}).dropna()
+    table = table[table['zip'].str.fullmatch(r'\d{5}')]
+    return table['zip'].astype(np.uint32).to_numpy(), table['latitude'].to_numpy(), table['longitude'].to_numpy()
+
+def load_market_centroids(db):
+    """(zips, lats, lngs) from the per-ZIP market rollups"""
+    zips, lats, lngs = [], [], []
+    for rollup in db[ROLLUPS['zip']['collection']].find(
+            {'zipCode': {'$regex': r'^\d{5}$'}, 'latitude': {'$type': 'number'}, 'longitude': {'$type': 'number'}},
+            {'zipCode': 1, 'latitude': 1, 'longitude': 1}):
+        zips.append(int(rollup['zipCode']))
+        lats.append(rollup['latitude'])
+        lngs.append(rollup['longitude'])
+    return zips, lats, lngs
+
+def build_zip_index(db):
+    table = load_table()
+    if not len(table[0]):
+        print(f"Warning: no ZIP centroid table at {ZIP_CENTROIDS_PATH}; using market centroids", file=sys.stderr)
+    return ZipIndex.merged(table, load_market_centroids(db))
+
+zip_cache = DatasetCache('ZIP centroids', build_zip_index, version_of=get_rollup_version)
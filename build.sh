@@ -5,5 +5,11 @@ mkdir -p backend/data
 # Install Python dependencies
 pip install -r requirements.txt
 
+# Build the ZIP centroid table for ZIP code search unless one is committed.
+# ZIP search falls back to market centroids if census.gov cannot be reached.
+if [ ! -f backend/data/zip_centroids.csv ]; then
+    python backend/scripts/build_zip_centroids.py || echo "Warning: ZIP centroid table not built"
+fi
+
 # Make sure the script is executable
 chmod +x start.sh 
\ No newline at end of file